@@ -2,13 +2,20 @@
 
 from __future__ import annotations
 
-from datetime import date as Date, datetime
-from typing import List, Optional
+from datetime import datetime, time as Time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
 
-from app.services import gtfs_loader
+from app.api.routes_otp import (
+    OtpRouteRequest,
+    TransitRouteResponse,
+    build_transit_result,
+    transit_route_response,
+)
+from app.services import fast_json, gtfs_loader, gtfs_tiles, http_cache, isochrones, raptor
 
 
 router = APIRouter(prefix="/api/gtfs", tags=["gtfs"])
@@ -34,6 +41,10 @@ class GtfsStop(BaseModel):
     routes: List[StopRoute] = []
 
 
+class NearbyStop(GtfsStop):
+    distance_m: float
+
+
 class GtfsRoute(BaseModel):
     id: str
     short_name: Optional[str] = None
@@ -75,12 +86,222 @@ class RouteSchedule(BaseModel):
     directions: List[DirectionSchedule]
 
 
+class StopDeparture(BaseModel):
+    trip_id: str
+    route_id: str
+    route_short_name: Optional[str] = None
+    headsign: Optional[str] = None
+    direction_id: Optional[int] = None
+    # Día de servicio del trip y hora GTFS relativa a él (pasa de 24:00:00
+    # en los trips del día anterior que siguen después de medianoche)
+    service_date: str
+    departure_time: str
+
+
+class StopDepartures(BaseModel):
+    stop_id: str
+    stop_name: str
+    date: str
+    time: str
+    departures: List[StopDeparture]
+
+
+class TileStop(BaseModel):
+    id: str
+    name: str
+    lat: float
+    lon: float
+
+
+class TileShape(BaseModel):
+    shape_id: str
+    route_id: str
+    # Trozos del shape dentro de la tesela, como Encoded Polyline (5 decimales)
+    paths: List[str]
+
+
+class GtfsTile(BaseModel):
+    stops: List[TileStop]
+    shapes: List[TileShape]
+
+
+class GtfsPlanRequest(OtpRouteRequest):
+    # Fecha YYYY-MM-DD y hora HH:MM de salida; por defecto, ahora.
+    date: Optional[str] = None
+    time: Optional[str] = None
+    max_transfers: Optional[int] = Field(None, ge=0, le=6)
+
+
+class IsochroneRequest(BaseModel):
+    # Un origen, o varios para mapas de accesibilidad
+    origin: Optional[Point] = None
+    origins: List[Point] = Field(default_factory=list, max_length=500)
+    # Primera salida (YYYY-MM-DD, HH:MM; por defecto, ahora) y ventana de
+    # salidas cada step_minutes (0: solo esa salida)
+    date: Optional[str] = None
+    time: Optional[str] = None
+    window_minutes: int = Field(0, ge=0, le=1440)
+    step_minutes: int = Field(1, ge=1, le=60)
+    max_minutes: int = Field(30, ge=1, le=240)
+    # Percentil del tiempo de viaje entre las salidas de la ventana
+    percentile: int = Field(50, ge=1, le=100)
+    max_transfers: Optional[int] = Field(None, ge=0, le=6)
+    cell_m: int = Field(250, ge=50, le=2000)
+    include_stops: bool = True
+    include_grid: bool = True
+
+
+class IsochroneStop(BaseModel):
+    id: str
+    name: str
+    lat: float
+    lon: float
+    travel_time_s: int
+    min_s: int
+    max_s: Optional[int] = None  # None si en alguna salida no se llega
+    share: float  # fracción de salidas que llegan en max_minutes
+
+
+class IsochroneGrid(BaseModel):
+    # Celda (fila, columna) -> índice fila * cols + columna, filas desde el sur
+    south: float
+    west: float
+    lat_step: float
+    lon_step: float
+    rows: int
+    cols: int
+    cell_m: float
+
+
+class OriginIsochrone(BaseModel):
+    origin: Point
+    reachable_stops: int
+    reachable_km2: float
+    # Por salida: paradas alcanzadas y superficie alcanzada en max_minutes
+    profile_stops: List[int]
+    profile_km2: List[float]
+    stops: Optional[List[IsochroneStop]] = None
+    # Tiempo de viaje (s) por celda, None si supera max_minutes
+    grid: Optional[List[Optional[int]]] = None
+
+
+class IsochroneResponse(BaseModel):
+    date: str
+    departures: List[str]
+    max_minutes: int
+    percentile: int
+    grid: IsochroneGrid
+    results: List[OriginIsochrone]
+
+
 # -----------------------
 # Endpoints
 # -----------------------
 
+# Las listas de paradas y rutas no cambian mientras no cambie el GTFS: se
+# serializan a JSON una sola vez por versión del dataset y las respuestas se
+# montan con esos bytes (mismo JSON que los modelos de response_model, que
+# quedan para la documentación). Todos los GET llevan ETag por versión del
+# dataset (app/services/http_cache.py).
+
+def _route_dict(r: dict) -> dict:
+    return {
+        "id": r["route_id"],
+        "short_name": r.get("short_name"),
+        "long_name": r.get("long_name"),
+        "desc": r.get("desc"),
+        "type": r.get("type"),
+        "agency_id": r.get("agency_id"),
+        "color": r.get("color"),
+        "text_color": r.get("text_color"),
+    }
+
+
+def _stop_dict(s: dict) -> dict:
+    return {
+        "id": s["stop_id"],
+        "name": s["name"],
+        "desc": s["desc"],
+        "lat": float(s["lat"]),
+        "lon": float(s["lon"]),
+        "code": s.get("code"),
+        "wheelchair_boarding": s.get("wheelchair_boarding"),
+        "routes": [
+            {"id": sr["id"], "short_name": sr.get("short_name"), "long_name": sr.get("long_name")}
+            for sr in gtfs_loader.GTFS_DATA.stop_routes.get(s["stop_id"], [])
+        ],
+    }
+
+
+@lru_cache(maxsize=2)
+def _stop_fragments(version: str) -> Dict[str, bytes]:
+    """JSON de cada parada (GtfsStop), por stop_id."""
+    return {stop_id: fast_json.dumps(_stop_dict(s)) for stop_id, s in gtfs_loader.GTFS_DATA.stops.items()}
+
+
+@lru_cache(maxsize=16)
+def _stops_body(version: str, limit: int) -> bytes:
+    fragments = _stop_fragments(version)
+    return fast_json.join_array(fragments[s["stop_id"]] for s in gtfs_loader.list_stops(limit=limit))
+
+
+@lru_cache(maxsize=2)
+def _routes_body(version: str) -> bytes:
+    return fast_json.dumps([_route_dict(r) for r in gtfs_loader.list_routes()])
+
+
+@lru_cache(maxsize=256)
+def _route_details_body(version: str, route_id: str) -> bytes:
+    route_raw, stops_raw, geometry_raw = gtfs_loader.get_route_with_stops(route_id)
+    stops = [
+        {
+            "id": s["stop_id"],
+            "name": s["name"],
+            "desc": s["desc"],
+            "lat": float(s["lat"]),
+            "lon": float(s["lon"]),
+            "code": None,
+            "wheelchair_boarding": None,
+            "routes": [],
+            "sequence": s["sequence"],
+        }
+        for s in stops_raw
+    ]
+    shape = None
+    if geometry_raw:
+        shape = [{"lat": float(p["lat"]), "lon": float(p["lon"])} for p in geometry_raw]
+    return fast_json.dumps({"route": _route_dict(route_raw), "stops": stops, "shape": shape})
+
+
+def _gtfs_response(
+    request: Request,
+    render: Callable[[], bytes],
+    *key,
+    uses_now: bool = False,
+    cache_body: bool = True,
+) -> Response:
+    """
+    Respuesta de un GET que solo depende del GTFS cargado y de la petición
+    (más `key`): ETag/Last-Modified por versión del dataset, 304 sin llamar
+    a `render` y compresión de los cuerpos grandes.
+
+    Con `uses_now` (fecha u hora por defecto) la respuesta cambia aunque no
+    cambie el GTFS: no se envía Last-Modified y solo revalida el ETag, que
+    incluye `key`.
+    """
+    return http_cache.cached_json(
+        request,
+        gtfs_loader.dataset_version(),
+        (request.url.path, request.url.query, *key),
+        render,
+        None if uses_now else gtfs_loader.dataset_last_modified(),
+        cache_body,
+    )
+
+
 @router.get("/stops", response_model=List[GtfsStop])
 def get_stops(
+    request: Request,
     limit: int = Query(500, ge=1, le=5000),
     min_lat: Optional[float] = Query(None),
     max_lat: Optional[float] = Query(None),
@@ -90,102 +311,93 @@ def get_stops(
     """
     Lista de paradas GTFS.
     """
-    bbox = None
-    if None not in (min_lat, max_lat, min_lon, max_lon):
-        bbox = (min_lat, max_lat, min_lon, max_lon)
-
-    stops_raw = gtfs_loader.list_stops(limit=limit, bbox=bbox)
-    stop_routes_index = gtfs_loader.GTFS_DATA.stop_routes
-
-    return [
-        GtfsStop(
-            id=s["stop_id"],
-            name=s["name"],
-            desc=s["desc"],
-            lat=s["lat"],
-            lon=s["lon"],
-            code=s.get("code"),
-            wheelchair_boarding=s.get("wheelchair_boarding"),
-            routes=[
-                StopRoute(
-                    id=sr["id"],
-                    short_name=sr.get("short_name"),
-                    long_name=sr.get("long_name"),
-                )
-                for sr in stop_routes_index.get(s["stop_id"], [])
-            ],
-        )
+
+    def render() -> bytes:
+        version = gtfs_loader.dataset_version()
+        if None in (min_lat, max_lat, min_lon, max_lon):
+            return _stops_body(version, limit)
+        fragments = _stop_fragments(version)
+        stops_raw = gtfs_loader.list_stops(limit=limit, bbox=(min_lat, max_lat, min_lon, max_lon))
+        return fast_json.join_array(fragments[s["stop_id"]] for s in stops_raw)
+
+    return _gtfs_response(request, render)
+
+
+def _nearby_stops_body(stops_raw: List[dict]) -> bytes:
+    # NearbyStop = GtfsStop + distance_m al final del objeto
+    fragments = _stop_fragments(gtfs_loader.dataset_version())
+    return fast_json.join_array(
+        fragments[s["stop_id"]][:-1] + b',"distance_m":' + fast_json.dumps(float(s["distance_m"])) + b"}"
         for s in stops_raw
-    ]
+    )
+
+
+@router.get("/stops/nearest", response_model=List[NearbyStop])
+def get_nearest_stops(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+):
+    """
+    Las k paradas más cercanas a un punto, ordenadas por distancia.
+    """
+    return _gtfs_response(request, lambda: _nearby_stops_body(gtfs_loader.nearest(lat, lon, k)))
+
+
+@router.get("/stops/within", response_model=List[NearbyStop])
+def get_stops_within(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_m: float = Query(500.0, gt=0, le=5000),
+):
+    """
+    Paradas a menos de `radius_m` metros de un punto, ordenadas por distancia.
+    """
+    return _gtfs_response(
+        request, lambda: _nearby_stops_body(gtfs_loader.within_radius(lat, lon, radius_m))
+    )
 
 
 @router.get("/routes", response_model=List[GtfsRoute])
-def get_routes():
+def get_routes(request: Request):
     """
     Lista de rutas/líneas disponibles en el GTFS.
     """
-    routes_raw = gtfs_loader.list_routes()
-    return [
-        GtfsRoute(
-            id=r["route_id"],
-            short_name=r.get("short_name"),
-            long_name=r.get("long_name"),
-            desc=r.get("desc"),
-            type=r.get("type"),
-            agency_id=r.get("agency_id"),
-            color=r.get("color"),
-            text_color=r.get("text_color"),
-        )
-        for r in routes_raw
-    ]
+    return _gtfs_response(request, lambda: _routes_body(gtfs_loader.dataset_version()))
 
 
 @router.get("/routes/{route_id}", response_model=RouteDetails)
-def get_route_details(route_id: str):
+def get_route_details(route_id: str, request: Request):
     """
     Detalle de una ruta:
     - Metadatos de la ruta
     - Paradas ordenadas (de un viaje representativo)
     - Geometría aproximada (shape) si existe
     """
-    try:
-        route_raw, stops_raw, geometry_raw = gtfs_loader.get_route_with_stops(route_id)
-    except KeyError:
+    if route_id not in gtfs_loader.GTFS_DATA.routes:
         raise HTTPException(status_code=404, detail="Route not found")
-
-    route = GtfsRoute(
-        id=route_raw["route_id"],
-        short_name=route_raw.get("short_name"),
-        long_name=route_raw.get("long_name"),
-        desc=route_raw.get("desc"),
-        type=route_raw.get("type"),
-        agency_id=route_raw.get("agency_id"),
-        color=route_raw.get("color"),
-        text_color=route_raw.get("text_color"),
+    return _gtfs_response(
+        request, lambda: _route_details_body(gtfs_loader.dataset_version(), route_id)
     )
 
-    stops = [
-        RouteStop(
-            id=s["stop_id"],
-            name=s["name"],
-            desc=s["desc"],
-            lat=s["lat"],
-            lon=s["lon"],
-            sequence=s["sequence"],
-        )
-        for s in stops_raw
-    ]
-
-    shape = None
-    if geometry_raw:
-        shape = [Point(lat=p["lat"], lon=p["lon"]) for p in geometry_raw]
 
-    return RouteDetails(route=route, stops=stops, shape=shape)
+@router.get("/tiles/{z}/{x}/{y}.json", response_model=GtfsTile)
+def get_tile(z: int, x: int, y: int, request: Request):
+    """
+    Tesela XYZ con las paradas y los trozos de shapes que caen en ella,
+    simplificados y aclarados según el zoom.
+    """
+    if not 0 <= z <= gtfs_tiles.TILE_MAX_ZOOM or not (0 <= x < 2**z and 0 <= y < 2**z):
+        raise HTTPException(status_code=404, detail="Tesela fuera de rango")
+    return _gtfs_response(request, lambda: gtfs_tiles.tile(z, x, y))
 
 
 @router.get("/routes/{route_id}/schedule", response_model=RouteSchedule)
 def get_route_schedule(
     route_id: str,
+    request: Request,
     date: Optional[str] = Query(
         None,
         description="Fecha en formato YYYY-MM-DD. Si se omite, se usa la fecha actual del servidor.",
@@ -204,26 +416,191 @@ def get_route_schedule(
                 status_code=400,
                 detail="Formato de fecha inválido, usa YYYY-MM-DD",
             )
+    if route_id not in gtfs_loader.GTFS_DATA.routes:
+        raise HTTPException(status_code=404, detail="Route not found")
 
-    try:
+    def render() -> bytes:
         raw = gtfs_loader.get_route_schedule(route_id, target_date)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Route not found")
+        directions = [
+            DirectionSchedule(
+                direction_id=d.get("direction_id"),
+                headsign=d.get("headsign"),
+                trip_count=d.get("trip_count", 0),
+                first_departure=d.get("first_departure"),
+                last_departure=d.get("last_departure"),
+                departures=d.get("departures") or [],
+            )
+            for d in raw.get("directions", [])
+        ]
+        schedule = RouteSchedule(route_id=raw["route_id"], date=raw["date"], directions=directions)
+        return fast_json.dumps(schedule.model_dump(mode="json"))
+
+    # Sin fecha, el horario es el de hoy: la fecha forma parte de la clave
+    return _gtfs_response(request, render, target_date.isoformat(), uses_now=date is None)
+
+
+@router.get("/stops/{stop_id}/departures", response_model=StopDepartures)
+def get_stop_departures(
+    stop_id: str,
+    request: Request,
+    date: Optional[str] = Query(None, description="Fecha YYYY-MM-DD; por defecto, hoy."),
+    from_time: Optional[str] = Query(
+        None, alias="from", description="Hora HH:MM[:SS]; por defecto, ahora."
+    ),
+    limit: int = Query(20, ge=1, le=500),
+):
+    """
+    Próximas salidas desde una parada (todas las líneas), ordenadas por hora.
+    """
+    stop = gtfs_loader.GTFS_DATA.stops.get(stop_id)
+    if stop is None:
+        raise HTTPException(status_code=404, detail="Stop not found")
+    when = _departure(date, from_time).replace(microsecond=0)
+
+    def render() -> bytes:
+        t = when.time()
+        departures = gtfs_loader.stop_departures(
+            stop_id, when.date(), t.hour * 3600 + t.minute * 60 + t.second, limit
+        )
+        return fast_json.dumps(
+            {
+                "stop_id": stop_id,
+                "stop_name": stop["name"],
+                "date": when.date().isoformat(),
+                "time": t.isoformat(),
+                "departures": departures,
+            }
+        )
+
+    # Sin fecha u hora se usa "ahora": forma parte de la clave, sin
+    # Last-Modified y sin guardar el cuerpo comprimido (cambia cada segundo)
+    uses_now = date is None or from_time is None
+    return _gtfs_response(
+        request, render, when.isoformat(), uses_now=uses_now, cache_body=not uses_now
+    )
+
 
-    directions = [
-        DirectionSchedule(
-            direction_id=d.get("direction_id"),
-            headsign=d.get("headsign"),
-            trip_count=d.get("trip_count", 0),
-            first_departure=d.get("first_departure"),
-            last_departure=d.get("last_departure"),
-            departures=d.get("departures") or [],
+def _departure(date: Optional[str], time: Optional[str]) -> datetime:
+    now = datetime.now()
+    try:
+        day = datetime.fromisoformat(date).date() if date else now.date()
+        at = Time.fromisoformat(time) if time else now.time()
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Formato de fecha u hora inválido, usa YYYY-MM-DD y HH:MM",
+        )
+    return datetime.combine(day, at)
+
+
+@router.post("/plan", response_model=TransitRouteResponse)
+def plan_transit_route(req: GtfsPlanRequest):
+    """
+    Itinerario en transporte público calculado en el propio backend (RAPTOR
+    sobre el GTFS cargado), con la misma respuesta que /api/otp/routes.
+    """
+    itineraries = raptor.plan(
+        req.origin.lat,
+        req.origin.lon,
+        req.destination.lat,
+        req.destination.lon,
+        _departure(req.date, req.time),
+        req.max_transfers,
+    )
+    if not itineraries:
+        raise HTTPException(status_code=404, detail="No se han encontrado rutas")
+
+    return transit_route_response(
+        req.origin,
+        req.destination,
+        build_transit_result(
+            itineraries, req.itinerary_index, req.geometry_format, req.simplify_zoom
+        ),
+    )
+
+
+@router.post("/isochrone", response_model=IsochroneResponse)
+def get_isochrone(req: IsochroneRequest):
+    """
+    Tiempos de viaje en transporte público (más acceso y egreso a pie) desde
+    uno o varios orígenes a todas las paradas y a una rejilla regular, para
+    una salida o para todas las de una ventana (RAPTOR sobre el GTFS).
+    """
+    origins = ([req.origin] if req.origin else []) + req.origins
+    if not origins:
+        raise HTTPException(status_code=400, detail="Indica al menos un origen (origin u origins)")
+    when = _departure(req.date, req.time)
+    n_departures = len(range(0, max(req.window_minutes, 1), req.step_minutes))
+    if len(origins) * n_departures > isochrones.ISOCHRONE_MAX_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Demasiadas combinaciones de origen y hora de salida (máximo {isochrones.ISOCHRONE_MAX_ROWS})",
+        )
+
+    max_s = req.max_minutes * 60
+    raw = isochrones.isochrones(
+        [(p.lat, p.lon) for p in origins],
+        when,
+        window_s=req.window_minutes * 60,
+        step_s=req.step_minutes * 60,
+        max_s=max_s,
+        percentile=req.percentile,
+        max_transfers=req.max_transfers,
+        cell_m=req.cell_m,
+    )
+    grid = raw["grid"]
+    cell_km2 = (grid.cell_m / 1000.0) ** 2
+    data = gtfs_loader.GTFS_DATA
+
+    results = []
+    for origin, res in zip(origins, raw["results"]):
+        stops_travel = res["stops"]["travel_s"]
+        cells_travel = res["cells"]["travel_s"]
+        reached = (stops_travel <= max_s).nonzero()[0]
+        stops = None
+        if req.include_stops:
+            stops = []
+            for s in reached.tolist():
+                stop_id = data.stop_ids[s]
+                meta = data.stops.get(stop_id) or {}
+                worst = int(res["stops"]["max_s"][s])
+                stops.append(
+                    IsochroneStop(
+                        id=stop_id,
+                        name=meta.get("name") or stop_id,
+                        lat=float(data.stop_lat[s]),
+                        lon=float(data.stop_lon[s]),
+                        travel_time_s=int(stops_travel[s]),
+                        min_s=int(res["stops"]["min_s"][s]),
+                        max_s=worst if worst < raptor.INF else None,
+                        share=float(res["stops"]["share"][s]),
+                    )
+                )
+        results.append(
+            OriginIsochrone(
+                origin=origin,
+                reachable_stops=len(reached),
+                reachable_km2=round(float((cells_travel <= max_s).sum()) * cell_km2, 4),
+                profile_stops=res["profile_stops"].tolist(),
+                profile_km2=[round(n * cell_km2, 4) for n in res["profile_cells"].tolist()],
+                stops=stops,
+                grid=[v if v <= max_s else None for v in cells_travel.tolist()] if req.include_grid else None,
+            )
         )
-        for d in raw.get("directions", [])
-    ]
 
-    return RouteSchedule(
-        route_id=raw["route_id"],
-        date=raw["date"],
-        directions=directions,
+    return IsochroneResponse(
+        date=raw["service_day"].isoformat(),
+        departures=[f"{s // 3600:02d}:{s % 3600 // 60:02d}" for s in raw["departures"].tolist()],
+        max_minutes=req.max_minutes,
+        percentile=req.percentile,
+        grid=IsochroneGrid(
+            south=grid.south,
+            west=grid.west,
+            lat_step=grid.lat_step,
+            lon_step=grid.lon_step,
+            rows=grid.rows,
+            cols=grid.cols,
+            cell_m=grid.cell_m,
+        ),
+        results=results,
     )
@@ -1,12 +1,24 @@
-﻿from typing import Literal
+﻿import asyncio
+import hmac
+import os
+from typing import Literal
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel, Field
 
-from app.services.lpmc_inference import run_lpmc_debug_features, run_lpmc_inference
+from app.services.lpmc_inference import (
+    reload_artifacts,
+    run_lpmc_batch,
+    run_lpmc_debug_features,
+    run_lpmc_inference,
+)
 
 router = APIRouter(prefix="/api/lpmc", tags=["lpmc"])
 
+# /admin/reload is only enabled when set, and requires the header
+# X-Admin-Token with this value.
+LPMC_ADMIN_TOKEN = os.environ.get("LPMC_ADMIN_TOKEN")
+
 
 class Point(BaseModel):
     lat: float
@@ -44,12 +56,35 @@ class LpmcPredictResponse(BaseModel):
     probabilities: dict[str, float]
     route_features: dict[str, float | int]
     model_info: dict
+    # Same payload as /debug-features, only when called with ?debug=true.
+    debug: dict | None = None
+
+
+class LpmcBatchRequest(BaseModel):
+    items: list[LpmcPredictRequest] = Field(..., min_length=1, max_length=50000)
+
+
+class LpmcBatchItemResult(BaseModel):
+    # Prediction fields are absent when routing failed for this item's OD pair.
+    predicted_mode: Literal["walk", "cycle", "pt", "drive"] | None = None
+    confidence: float | None = None
+    probabilities: dict[str, float] | None = None
+    route_features: dict[str, float | int] | None = None
+    itinerary_index: int | None = None
+    total_itineraries: int | None = None
+    error: str | None = None
+
+
+class LpmcBatchResponse(BaseModel):
+    results: list[LpmcBatchItemResult]
+    unique_od_pairs: int
+    model_info: dict
 
 
 @router.post("/predict", response_model=LpmcPredictResponse)
-async def predict_lpmc(body: LpmcPredictRequest):
+async def predict_lpmc(body: LpmcPredictRequest, debug: bool = False):
     try:
-        result = await run_lpmc_inference(body.model_dump())
+        result = await run_lpmc_inference(body.model_dump(), debug=debug)
     except FileNotFoundError as exc:
         raise HTTPException(status_code=500, detail=str(exc))
     except RuntimeError as exc:
@@ -70,3 +105,32 @@ async def debug_lpmc_features(body: LpmcPredictRequest):
         raise HTTPException(status_code=502, detail=str(exc))
     except Exception as exc:  # pragma: no cover
         raise HTTPException(status_code=500, detail=f"Error interno en debug LPMC: {exc}")
+
+
+@router.post("/predict-batch", response_model=LpmcBatchResponse)
+async def predict_lpmc_batch(body: LpmcBatchRequest):
+    try:
+        result = await run_lpmc_batch(body.model_dump())
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    except Exception as exc:  # pragma: no cover
+        raise HTTPException(status_code=500, detail=f"Error interno en inferencia LPMC batch: {exc}")
+
+    return LpmcBatchResponse(**result)
+
+
+@router.post("/admin/reload")
+async def reload_lpmc_model(x_admin_token: str | None = Header(default=None)):
+    # Without a configured token the endpoint does not exist
+    if not LPMC_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(
+        x_admin_token.encode("utf-8"), LPMC_ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Token de administracion no valido")
+    try:
+        return await asyncio.to_thread(reload_artifacts)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    except Exception as exc:  # pragma: no cover
+        raise HTTPException(status_code=500, detail=f"Error recargando el modelo LPMC: {exc}")
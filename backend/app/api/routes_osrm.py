@@ -1,9 +1,16 @@
-from typing import List
+import asyncio
+import io
+from typing import List, Literal, Optional, Union
 
-from fastapi import APIRouter
+import httpx
+import numpy as np
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel, Field
 
-from app.services.osrm_client import Profile, get_route
+from app.services import geometry
+from app.services.fast_json import FastJSONResponse
+from app.services.http_clients import BACKENDS, osrm_client_name
+from app.services.osrm_client import Profile, get_route, get_table
 
 router = APIRouter()
 
@@ -17,31 +24,144 @@ class RouteRequest(BaseModel):
     origin: Point
     destination: Point
     profiles: List[Profile] = ["driving", "cycling", "foot"]
+    # Formato de las geometrías (ver app/services/geometry.py) y zoom del
+    # mapa para simplificarlas (sin zoom se devuelven completas)
+    geometry_format: geometry.GeometryFormat = "points"
+    simplify_zoom: Optional[int] = Field(None, ge=0, le=22)
 
 
 class RouteResult(BaseModel):
     profile: Profile
     distance_m: float
     duration_s: float
-    geometry: List[Point]
+    # Lista de puntos, polyline (str) o flat_array según geometry_format
+    geometry: Union[List[Point], str, List[float]]
+
+
+class RouteError(BaseModel):
+    profile: Profile
+    detail: str
 
 
 class RouteResponse(BaseModel):
     origin: Point
     destination: Point
     results: List[RouteResult]
+    # Perfiles que han fallado (instancia OSRM caída, lenta o sin ruta)
+    errors: List[RouteError] = []
 
 
-@router.post("/routes", response_model=RouteResponse)
-async def get_routes(body: RouteRequest):
-    results: List[RouteResult] = []
-    for profile in body.profiles:
-        route = await get_route(
+async def _fetch_profile(profile: Profile, body: RouteRequest) -> dict:
+    # Tope total por perfil: el timeout de httpx es por operación (conectar,
+    # leer...), no para la petición completa.
+    return await asyncio.wait_for(
+        get_route(
             profile,
             body.origin.lon,
             body.origin.lat,
             body.destination.lon,
             body.destination.lat,
-        )
-        results.append(RouteResult(**route))
-    return RouteResponse(origin=body.origin, destination=body.destination, results=results)
+        ),
+        timeout=BACKENDS[osrm_client_name(profile)].timeout_s,
+    )
+
+
+def _describe_error(exc: BaseException) -> str:
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return "Timeout al llamar a OSRM"
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"Error OSRM: {exc.response.status_code}"
+    if isinstance(exc, httpx.RequestError):
+        return f"OSRM no disponible: {exc.__class__.__name__}"
+    if isinstance(exc, (KeyError, IndexError)):
+        return "OSRM no ha devuelto ninguna ruta"
+    return f"Error al llamar a OSRM: {exc}"
+
+
+@router.post("/routes", response_model=RouteResponse)
+async def get_routes(body: RouteRequest):
+    # Los perfiles se piden en paralelo: la latencia es la del más lento, y
+    # si uno falla se devuelven los demás con el error de ese perfil.
+    outcomes = await asyncio.gather(
+        *(_fetch_profile(profile, body) for profile in body.profiles),
+        return_exceptions=True,
+    )
+
+    # La respuesta se serializa directamente desde los dicts de get_route
+    # (mismo JSON que RouteResponse): las geometrías tienen miles de puntos
+    # y no compensa crear un Point por vértice.
+    results: List[dict] = []
+    errors: List[dict] = []
+    for profile, outcome in zip(body.profiles, outcomes):
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            errors.append({"profile": profile, "detail": _describe_error(outcome)})
+        else:
+            results.append(
+                {
+                    "profile": outcome["profile"],
+                    "distance_m": float(outcome["distance_m"]),
+                    "duration_s": float(outcome["duration_s"]),
+                    "geometry": geometry.from_polyline(
+                        outcome["polyline6"], 6, body.geometry_format, body.simplify_zoom
+                    ),
+                }
+            )
+
+    if errors and not results:
+        raise HTTPException(status_code=502, detail=errors)
+
+    return FastJSONResponse(
+        {
+            "origin": body.origin.model_dump(),
+            "destination": body.destination.model_dump(),
+            "results": results,
+            "errors": errors,
+        }
+    )
+
+
+
+class MatrixRequest(BaseModel):
+    profile: Profile = "driving"
+    sources: List[Point] = Field(..., min_length=1, max_length=2000)
+    # Si se omite, matriz cuadrada sobre `sources`
+    destinations: Optional[List[Point]] = Field(None, min_length=1, max_length=2000)
+    # "npz": fichero NumPy (.npz) con los arrays `durations` y `distances`
+    format: Literal["json", "npz"] = "json"
+
+
+class MatrixResponse(BaseModel):
+    profile: Profile
+    # durations[i][j] en segundos y distances[i][j] en metros, de sources[i]
+    # a destinations[j]; null si OSRM no encuentra ruta
+    durations: List[List[Optional[float]]]
+    distances: List[List[Optional[float]]]
+
+
+def _matrix_to_json(matrix: np.ndarray) -> List[List[Optional[float]]]:
+    return np.where(np.isnan(matrix), None, matrix).tolist()
+
+
+@router.post("/matrix", response_model=MatrixResponse)
+async def get_matrix(body: MatrixRequest):
+    sources = [(p.lon, p.lat) for p in body.sources]
+    destinations = (
+        [(p.lon, p.lat) for p in body.destinations] if body.destinations else None
+    )
+    try:
+        table = await get_table(body.profile, sources, destinations)
+    except Exception as exc:
+        raise HTTPException(status_code=502, detail=_describe_error(exc))
+
+    if body.format == "npz":
+        buf = io.BytesIO()
+        np.savez(buf, durations=table["durations"], distances=table["distances"])
+        return Response(content=buf.getvalue(), media_type="application/octet-stream")
+
+    return MatrixResponse(
+        profile=body.profile,
+        durations=_matrix_to_json(table["durations"]),
+        distances=_matrix_to_json(table["distances"]),
+    )
@@ -2,12 +2,16 @@
 
 from datetime import datetime
 import os
-from typing import List, Optional
+from typing import Any, List, Optional, Union
 
-import httpx
-import polyline
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from app.services import geometry
+from app.services.fast_json import FastJSONResponse
+from app.services.http_clients import get_client
+from app.services.route_cache import ROUTE_CACHE, otp_key
+from app.services.single_flight import ROUTE_FLIGHTS
 
 router = APIRouter(prefix="/api/otp", tags=["otp"])
 
@@ -28,13 +32,21 @@ class OtpRouteRequest(BaseModel):
     destination: Point
     # índice de itinerario opcional (para paginar desde el frontend)
     itinerary_index: Optional[int] = None
+    # Formato de las geometrías (ver app/services/geometry.py) y zoom del
+    # mapa para simplificarlas (sin zoom se devuelven completas)
+    geometry_format: geometry.GeometryFormat = "points"
+    simplify_zoom: Optional[int] = Field(None, ge=0, le=22)
+
+
+# Lista de puntos, polyline (str) o flat_array según geometry_format
+Geometry = Union[List[Point], str, List[float]]
 
 
 class TransitSegment(BaseModel):
     mode: str              # WALK, BUS, etc
     distance_m: float
     duration_s: float
-    geometry: List[Point]
+    geometry: Geometry
     route_id: str | None = None
     route_short_name: str | None = None
     route_long_name: str | None = None
@@ -48,7 +60,7 @@ class TransitSegment(BaseModel):
 class TransitResult(BaseModel):
     distance_m: float
     duration_s: float
-    geometry: List[Point]          # ruta completa concatenada
+    geometry: Geometry             # ruta completa concatenada
     segments: List[TransitSegment] # tramos por modo
     itinerary_index: int
     total_itineraries: int
@@ -68,7 +80,7 @@ def _ms_to_hhmm(ms: int | float | None) -> str | None:
     except Exception:
         return None
 
-def _build_otp_params(req: OtpRouteRequest) -> dict:
+def build_otp_params(req: OtpRouteRequest) -> dict:
     now = datetime.now()
     return {
         "fromPlace": f"{req.origin.lat},{req.origin.lon}",
@@ -86,7 +98,7 @@ def _build_otp_params(req: OtpRouteRequest) -> dict:
     }
 
 
-def _pick_itinerary_with_transit(itineraries: list[dict]) -> int:
+def pick_itinerary_with_transit(itineraries: list[dict]) -> int:
     """
     Devuelve el índice de la primera itinerary que tenga al menos un leg
     de transporte público. Si no hay ninguna, devuelve 0.
@@ -108,29 +120,38 @@ def _pick_itinerary_with_transit(itineraries: list[dict]) -> int:
     return 0
 
 
-def _decode_leg_geometry(leg: dict) -> list[Point]:
-    geom = leg.get("legGeometry")
-    if not geom or not geom.get("points"):
-        return []
-    coords = polyline.decode(geom["points"])
-    return [Point(lat=lat, lon=lon) for (lat, lon) in coords]
+def _leg_polyline(leg: dict) -> str:
+    return (leg.get("legGeometry") or {}).get("points") or ""
 
 
-def _build_segments(itinerary: dict) -> List[TransitSegment]:
-    segments: List[TransitSegment] = []
+def _build_segments(
+    itinerary: dict,
+    geometry_format: geometry.GeometryFormat = "points",
+    simplify_zoom: int | None = None,
+) -> List[dict]:
+    # Dicts con los campos de TransitSegment (en su orden): las geometrías
+    # tienen miles de puntos y no compensa crear un modelo por vértice.
+    segments: List[dict] = []
 
     for leg in itinerary.get("legs", []):
-        geometry = _decode_leg_geometry(leg)
-        mode = (leg.get("mode") or "").upper()
-        distance_m = float(leg.get("distance") or 0.0)
-        duration_s = float(leg.get("duration") or 0.0)
-
         # Datos base del segmento
-        seg_kwargs: dict = {
-            "mode": mode,
-            "distance_m": distance_m,
-            "duration_s": duration_s,
-            "geometry": geometry,
+        segment: dict = {
+            "mode": (leg.get("mode") or "").upper(),
+            "distance_m": float(leg.get("distance") or 0.0),
+            "duration_s": float(leg.get("duration") or 0.0),
+            # Las polylines de OTP (5 decimales) se devuelven sin
+            # decodificar si el cliente las acepta tal cual
+            "geometry": geometry.from_polyline(
+                _leg_polyline(leg), 5, geometry_format, simplify_zoom
+            ),
+            "route_id": None,
+            "route_short_name": None,
+            "route_long_name": None,
+            "agency_name": None,
+            "from_stop_name": None,
+            "to_stop_name": None,
+            "departure": None,
+            "arrival": None,
         }
 
         # Si es leg de transporte público, añadimos info de línea, paradas y horas
@@ -138,7 +159,7 @@ def _build_segments(itinerary: dict) -> List[TransitSegment]:
             from_place = leg.get("from") or {}
             to_place = leg.get("to") or {}
 
-            seg_kwargs.update(
+            segment.update(
                 route_id=leg.get("routeId") or leg.get("route"),
                 route_short_name=leg.get("routeShortName"),
                 route_long_name=leg.get("routeLongName"),
@@ -149,70 +170,134 @@ def _build_segments(itinerary: dict) -> List[TransitSegment]:
                 arrival=_ms_to_hhmm(leg.get("endTime")),
             )
 
-        segments.append(TransitSegment(**seg_kwargs))
+        segments.append(segment)
 
     return segments
 
 
 
-@router.post("/routes", response_model=TransitRouteResponse)
-async def get_otp_route(req: OtpRouteRequest) -> TransitRouteResponse:
-    params = _build_otp_params(req)
+def build_transit_result(
+    itineraries: list[dict],
+    itinerary_index: int | None,
+    geometry_format: geometry.GeometryFormat = "points",
+    simplify_zoom: int | None = None,
+) -> dict:
+    """
+    TransitResult (como dict) de uno de los itinerarios (formato OTP,
+    ordenados por duración): el pedido en itinerary_index o, si no, el
+    primero con transporte público. Las geometrías van en geometry_format,
+    simplificadas para simplify_zoom si se indica.
+    """
+    # Elegimos índice de itinerario
+    if itinerary_index is not None and 0 <= itinerary_index < len(itineraries):
+        idx = itinerary_index
+    else:
+        idx = pick_itinerary_with_transit(itineraries)
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(OTP_PLAN_URL, params=params, timeout=20.0)
+    chosen = itineraries[idx]
 
-    if resp.status_code != 200:
-        raise HTTPException(
-            status_code=502,
-            detail=f"Error al llamar a OTP: {resp.status_code}",
+    # duración total en segundos
+    duration_s = float(chosen.get("duration") or 0.0)
+
+    # distancia = suma de distancias de los legs
+    distance_m = float(
+        sum(float(leg.get("distance") or 0.0) for leg in chosen.get("legs", []))
+    )
+
+    segments = _build_segments(chosen, geometry_format, simplify_zoom)
+
+    # geometría completa = concatenación de los segmentos; las polylines no
+    # se pueden concatenar y se vuelven a codificar
+    full_geometry: Any
+    if geometry_format in ("polyline", "polyline6"):
+        full_geometry = geometry.render(
+            geometry.concat(
+                [
+                    geometry.polyline_coords(_leg_polyline(leg), 5, simplify_zoom)
+                    for leg in chosen.get("legs", [])
+                ]
+            ),
+            geometry_format,
         )
+    else:
+        full_geometry = []
+        for seg in segments:
+            full_geometry.extend(seg["geometry"])
+
+    return {
+        "distance_m": distance_m,
+        "duration_s": duration_s,
+        "geometry": full_geometry,
+        "segments": segments,
+        "itinerary_index": idx,
+        "total_itineraries": len(itineraries),
+    }
+
+
+def transit_route_response(origin: Point, destination: Point, result: dict) -> FastJSONResponse:
+    """TransitRouteResponse serializada directamente (sin validar el modelo)."""
+    return FastJSONResponse(
+        {"origin": origin.model_dump(), "destination": destination.model_dump(), "result": result}
+    )
+
+
+class OtpError(RuntimeError):
+    def __init__(self, status_code: int):
+        super().__init__(f"Error OTP: {status_code}")
+        self.status_code = status_code
+
+
+async def fetch_otp_itineraries(params: dict) -> list[dict]:
+    """
+    Llama a /plan de OTP y devuelve los itinerarios ordenados por duración
+    (segundos) de menor a mayor. Cacheado en ROUTE_CACHE por params, con
+    origen y destino redondeados; las consultas idénticas en vuelo comparten
+    una sola llamada.
+    """
+    key = otp_key(params)
+    cached = await ROUTE_CACHE.aget(key)
+    if cached is not None:
+        return cached
+
+    return await ROUTE_FLIGHTS.do(key, lambda: _plan(key, params))
+
+
+async def _plan(key: tuple, params: dict) -> list[dict]:
+    resp = await get_client("otp").get(OTP_PLAN_URL, params=params)
+    if resp.status_code != 200:
+        raise OtpError(resp.status_code)
 
     data = resp.json()
     plan = data.get("plan") or {}
     itineraries: list[dict] = plan.get("itineraries") or []
-
-    if not itineraries:
-        raise HTTPException(status_code=404, detail="OTP no ha encontrado rutas")
-
-    # --- ordenar por duración (segundos) de menor a mayor ---
     itineraries = sorted(
         itineraries,
         key=lambda it: float(it.get("duration") or 1e20)
     )
 
-    # Elegimos índice de itinerario
-    if req.itinerary_index is not None and 0 <= req.itinerary_index < len(itineraries):
-        idx = req.itinerary_index
-    else:
-        idx = _pick_itinerary_with_transit(itineraries)
+    await ROUTE_CACHE.aset(key, itineraries)
+    return itineraries
 
-    chosen = itineraries[idx]
 
-    # duración total en segundos
-    duration_s = float(chosen.get("duration") or 0.0)
+@router.post("/routes", response_model=TransitRouteResponse)
+async def get_otp_route(req: OtpRouteRequest):
+    params = build_otp_params(req)
 
-    # distancia = suma de distancias de los legs
-    distance_m = float(
-        sum(float(leg.get("distance") or 0.0) for leg in chosen.get("legs", []))
-    )
+    try:
+        itineraries = await fetch_otp_itineraries(params)
+    except OtpError as exc:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Error al llamar a OTP: {exc.status_code}",
+        )
+
+    if not itineraries:
+        raise HTTPException(status_code=404, detail="OTP no ha encontrado rutas")
 
-    segments = _build_segments(chosen)
-
-    # geometría completa = concatenación de los segmentos
-    full_geometry: list[Point] = []
-    for seg in segments:
-        full_geometry.extend(seg.geometry)
-
-    return TransitRouteResponse(
-        origin=req.origin,
-        destination=req.destination,
-        result=TransitResult(
-            distance_m=distance_m,
-            duration_s=duration_s,
-            geometry=full_geometry,
-            segments=segments,
-            itinerary_index=idx,
-            total_itineraries=len(itineraries),
+    return transit_route_response(
+        req.origin,
+        req.destination,
+        build_transit_result(
+            itineraries, req.itinerary_index, req.geometry_format, req.simplify_zoom
         ),
     )
@@ -0,0 +1,86 @@
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field, model_validator
+
+from app.api.routes_lpmc import UserProfile
+from app.services import scenarios
+
+router = APIRouter(prefix="/api/scenarios", tags=["scenarios"])
+
+# Every OD pair needs one OTP plan, so the zone system is kept small.
+MAX_ZONES = 200
+
+
+class Zone(BaseModel):
+    id: str
+    lat: float
+    lon: float
+
+
+class OdDemand(BaseModel):
+    origin: str
+    destination: str
+    trips: float = Field(1.0, ge=0.0)
+
+
+class PopulationSegment(BaseModel):
+    # Synthetic population: each segment is a user profile with a weight
+    # (share of travellers) applied to every OD pair.
+    profile: UserProfile = Field(default_factory=UserProfile)
+    weight: float = Field(1.0, ge=0.0)
+
+
+class DurationMultipliers(BaseModel):
+    walk: Optional[float] = Field(None, gt=0.0)
+    cycle: Optional[float] = Field(None, gt=0.0)
+    pt: Optional[float] = Field(None, gt=0.0)
+    drive: Optional[float] = Field(None, gt=0.0)
+
+
+class ScenarioOverrides(BaseModel):
+    cost_transit: Optional[float] = Field(None, ge=0.0)
+    cost_driving_total: Optional[float] = Field(None, ge=0.0)
+    duration_multipliers: DurationMultipliers = Field(default_factory=DurationMultipliers)
+
+
+class ScenarioRequest(BaseModel):
+    name: Optional[str] = None
+    # Zone centroids, or GTFS stops used as zones (one of the two).
+    zones: Optional[List[Zone]] = Field(None, min_length=2, max_length=MAX_ZONES)
+    stop_ids: Optional[List[str]] = Field(None, min_length=2, max_length=MAX_ZONES)
+    # Demand per OD pair; all ordered zone pairs with 1 trip if omitted.
+    od_pairs: Optional[List[OdDemand]] = None
+    segments: List[PopulationSegment] = Field(..., min_length=1, max_length=100)
+    overrides: ScenarioOverrides = Field(default_factory=ScenarioOverrides)
+
+    @model_validator(mode="after")
+    def _one_zone_source(self):
+        if (self.zones is None) == (self.stop_ids is None):
+            raise ValueError("Indica 'zones' o 'stop_ids' (solo uno de los dos)")
+        return self
+
+
+class ScenarioJob(BaseModel):
+    id: str
+    name: Optional[str] = None
+    status: Literal["queued", "running", "done", "failed", "cancelled"]
+    stage: Optional[str] = None
+    stage_progress: Optional[dict] = None
+    created_at: float
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[dict] = None
+
+
+@router.post("", response_model=ScenarioJob, status_code=202)
+async def create_scenario(body: ScenarioRequest):
+    return scenarios.submit(body.model_dump())
+
+
+@router.get("/{job_id}", response_model=ScenarioJob)
+async def get_scenario(job_id: str):
+    job = scenarios.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Escenario no encontrado")
+    return job
@@ -1,12 +1,55 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.routes_osrm import router as osrm_router
 from app.api.routes_gtfs import router as gtfs_router
 from app.api.routes_otp import router as otp_router
 from app.api.routes_lpmc import router as lpmc_router
+from app.api.routes_scenarios import router as scenarios_router
+from app.services import gtfs_loader, http_clients, lpmc_inference, raptor, route_cache, scenarios, single_flight
+
+
+def _warm_up_gtfs() -> None:
+    gtfs_loader.warm_up()
+    # Si las features de transporte público salen de RAPTOR, su red (patrones
+    # y transbordos) también se construye antes de la primera petición.
+    if lpmc_inference.LPMC_TRANSIT_SOURCE == "raptor":
+        raptor.warm_up()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clientes HTTP compartidos (keep-alive) para OSRM y OTP
+    await http_clients.start()
+
+    # Precarga del GTFS en segundo plano: la API acepta tráfico desde el
+    # principio y /health indica qué tablas están ya listas.
+    warmup_task = None
+    if os.environ.get("GTFS_WARMUP", "1") != "0":
+        warmup_task = asyncio.create_task(asyncio.to_thread(_warm_up_gtfs))
+
+    # Modelo LPMC cargado y "calentado" con una predicción de prueba antes de
+    # la primera petición. Con LPMC_WATCH_INTERVAL_S > 0 se recarga solo si
+    # cambian los ficheros del modelo/scaler.
+    background = []
+    if os.environ.get("LPMC_WARMUP", "1") != "0":
+        background.append(asyncio.create_task(asyncio.to_thread(lpmc_inference.warm_up)))
+    watch_interval = float(os.environ.get("LPMC_WATCH_INTERVAL_S", "0"))
+    if watch_interval > 0:
+        background.append(asyncio.create_task(lpmc_inference.watch_artifacts(watch_interval)))
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    for task in background:
+        task.cancel()
+    scenarios.shutdown_pool()
+    await http_clients.close()
 
 
-app = FastAPI(title="Urban Mobility Simulator API", version="0.1.0")
+app = FastAPI(title="Urban Mobility Simulator API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,8 +63,15 @@ app.include_router(osrm_router, prefix="/api/osrm", tags=["osrm"])
 app.include_router(gtfs_router)
 app.include_router(otp_router)
 app.include_router(lpmc_router)
+app.include_router(scenarios_router)
 
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "gtfs": gtfs_loader.table_status(),
+        "lpmc": lpmc_inference.artifacts_status(),
+        "route_cache": route_cache.ROUTE_CACHE.stats(),
+        "route_coalescing": single_flight.ROUTE_FLIGHTS.stats(),
+    }
@@ -0,0 +1,151 @@
+# backend/app/services/fast_json.py
+
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable
+
+from fastapi import Response
+
+# Serialización JSON para respuestas grandes (listas de paradas, geometrías)
+# sin pasar por modelos pydantic: los endpoints construyen dicts/listas y
+# devuelven FastJSONResponse, que FastAPI envía tal cual (sin validar ni
+# volver a serializar con response_model, que queda solo para OpenAPI).
+#
+# Usa orjson (requirements.txt); si no está instalado, json de la stdlib
+# con la misma salida compacta que JSONResponse.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def join_array(items: Iterable[bytes]) -> bytes:
+    """Array JSON a partir de elementos ya serializados."""
+    return b"[" + b",".join(items) + b"]"
+
+
+class FastJSONResponse(Response):
+    """Respuesta JSON; acepta un objeto serializable o bytes ya serializados."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+# -----------------------
+# CLI: benchmark de los endpoints grandes
+# -----------------------
+# bench: p50 de las listas GTFS (el feed cargado) y de /api/osrm/routes y
+# /api/otp/routes con la caché de rutas rellenada con rutas sintéticas
+# (3 perfiles x 1500 vértices; 5 itinerarios OTP de 5 legs), sin compresión.
+
+def _bench_cli(n: int, use_orjson: bool) -> None:
+    import statistics
+    import time
+
+    import numpy as np
+    from fastapi.testclient import TestClient
+
+    from app.api.routes_otp import OtpRouteRequest, Point, build_otp_params
+    from app.main import app
+    from app.services import fast_json, geometry, gtfs_loader
+    from app.services.route_cache import ROUTE_CACHE, osrm_key, otp_key
+
+    if not use_orjson:
+        fast_json.orjson = None
+    rng = np.random.default_rng(1)
+
+    def walk(n_points: int) -> np.ndarray:
+        steps = rng.uniform(-1e-4, 1e-4, (n_points, 2))
+        return np.round(np.array([39.86, -4.03]) + np.cumsum(steps, axis=0), 6)
+
+    origin, destination = {"lat": 39.86, "lon": -4.03}, {"lat": 39.87, "lon": -4.0}
+    for profile in ("driving", "cycling", "foot"):
+        key = osrm_key(profile, origin["lon"], origin["lat"], destination["lon"], destination["lat"])
+        ROUTE_CACHE.set(
+            key,
+            {
+                "profile": profile,
+                "distance_m": 5234.1,
+                "duration_s": 612.3,
+                "polyline6": geometry.encode_polyline(walk(1500), 6),
+            },
+        )
+    legs = []
+    for i in range(5):
+        transit = i % 2 == 1
+        leg = {
+            "mode": "BUS" if transit else "WALK",
+            "transitLeg": transit,
+            "distance": 800.0,
+            "duration": 300.0,
+            "from": {"name": "A"},
+            "to": {"name": "B"},
+            "startTime": 1764583200000,
+            "endTime": 1764583500000,
+            "legGeometry": {"points": geometry.encode_polyline(walk(400 if transit else 60), 5)},
+        }
+        if transit:
+            leg.update(routeId="R1", routeShortName="L1", routeLongName="Linea 1")
+        legs.append(leg)
+    params = build_otp_params(OtpRouteRequest(origin=Point(**origin), destination=Point(**destination)))
+    ROUTE_CACHE.set(otp_key(params), [{"duration": 1500.0 + k, "legs": legs} for k in range(5)])
+
+    data = gtfs_loader.GTFS_DATA
+    lat = float(np.median(data.stop_lat)) if len(data.stop_lat) else origin["lat"]
+    lon = float(np.median(data.stop_lon)) if len(data.stop_lon) else origin["lon"]
+    lat, lon = round(lat, 5), round(lon, 5)
+    all_stops = f"/api/gtfs/stops?limit={len(data.stop_ids)}"
+    bbox = f"&min_lat={lat - 0.05}&max_lat={lat + 0.05}&min_lon={lon - 0.07}&max_lon={lon + 0.07}"
+    route_body = {"origin": origin, "destination": destination}
+    cases = [
+        ("/stops (todas)", "GET", all_stops, None),
+        ("/stops (bbox)", "GET", all_stops + bbox, None),
+        ("/stops/nearest k=100", "GET", f"/api/gtfs/stops/nearest?lat={lat}&lon={lon}&k=100", None),
+        ("/routes", "GET", "/api/gtfs/routes", None),
+        ("/routes/{id}", "GET", f"/api/gtfs/routes/{next(iter(data.routes))}", None),
+        ("/osrm/routes", "POST", "/api/osrm/routes", route_body),
+        ("/otp/routes", "POST", "/api/otp/routes", route_body),
+    ]
+    print(f"{len(data.stop_ids)} paradas, {'orjson' if fast_json.orjson is not None else 'json (stdlib)'}, {n} peticiones por endpoint")
+    with TestClient(app) as client:
+        headers = {"Accept-Encoding": "identity"}
+        for label, method, url, body in cases:
+            if method == "GET":
+                call = lambda: client.get(url, headers=headers)  # noqa: E731
+            else:
+                call = lambda: client.post(url, json=body, headers=headers)  # noqa: E731
+            resp = call()
+            if resp.status_code != 200:
+                print(f"  {label:<22} HTTP {resp.status_code}")
+                continue
+            times = []
+            for _ in range(n):
+                t0 = time.perf_counter()
+                call()
+                times.append((time.perf_counter() - t0) * 1000)
+            print(f"  {label:<22} {len(resp.content) / 1000:9.1f} kB  p50 {statistics.median(times):7.2f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.fast_json")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="p50 de las listas GTFS y de las rutas OSRM/OTP cacheadas")
+    bench.add_argument("-n", type=int, default=30)
+    bench.add_argument("--no-orjson", action="store_true", help="Serializar con json de la stdlib")
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        _bench_cli(args.n, not args.no_orjson)
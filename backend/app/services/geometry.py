@@ -0,0 +1,305 @@
+# backend/app/services/geometry.py
+
+from __future__ import annotations
+
+import math
+import os
+from functools import lru_cache
+from typing import Any, List, Literal, Optional
+
+import numpy as np
+
+# Geometrías de rutas (OSRM, OTP, RAPTOR) como arrays (n, 2) de (lat, lon)
+# y su salida en los formatos que puede pedir el frontend:
+#   points      lista de {"lat", "lon"} (por defecto, el formato de siempre)
+#   polyline    Encoded Polyline de Google con 5 decimales (el de OTP)
+#   polyline6   igual con 6 decimales (el de OSRM)
+#   flat_array  [lat0, lon0, lat1, lon1, ...]
+#
+# Con un zoom, la geometría se simplifica con Douglas-Peucker a una
+# tolerancia de GEOMETRY_SIMPLIFY_PX píxeles a ese zoom: los vértices que no
+# se distinguen en el mapa no se envían.
+#
+# Las geometrías se guardan codificadas (ROUTE_CACHE, itinerarios de OTP) y
+# se convierten al formato pedido en cada respuesta. Las últimas
+# GEOMETRY_CACHE_SIZE conversiones se guardan: crear miles de dicts por
+# petición dispara el recolector de basura sobre todo el heap.
+GEOMETRY_SIMPLIFY_PX = float(os.environ.get("GEOMETRY_SIMPLIFY_PX", "1.0"))
+GEOMETRY_CACHE_SIZE = int(os.environ.get("GEOMETRY_CACHE_SIZE", "64"))
+
+GeometryFormat = Literal["points", "polyline", "polyline6", "flat_array"]
+
+# Metros por píxel a zoom 0 en el ecuador (teselas de 256 px) y metros por
+# grado de latitud
+_M_PER_PX_Z0 = 156543.03392
+_M_PER_DEG = 111320.0
+# Trozos de 5 bits por valor codificado: con 6 decimales, ±180° caben en 6
+_MAX_CHUNKS = 7
+
+_EMPTY = np.empty((0, 2))
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> np.ndarray:
+    """Encoded Polyline -> array (n, 2) de (lat, lon), igual que polyline.decode."""
+    if not encoded:
+        return _EMPTY
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    # Cada valor termina en el primer trozo sin el bit de continuación (0x20)
+    ends = np.flatnonzero(chunks < 0x20)
+    chunks = chunks[: ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = 5 * (np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chunks & 0x1F) << shift, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / float(10**precision)
+
+
+def encode_polyline(coords: np.ndarray, precision: int = 5) -> str:
+    """Array (n, 2) de (lat, lon) -> Encoded Polyline, igual que polyline.encode."""
+    if not len(coords):
+        return ""
+    scaled = np.asarray(coords, dtype=float) * (10**precision)
+    # Redondeo "hacia fuera" en los .5, como el algoritmo original
+    ints = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=0).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    parts = values[:, None] >> (5 * np.arange(_MAX_CHUNKS))
+    used = parts > 0
+    used[:, 0] = True
+    more = np.zeros_like(used)
+    more[:, :-1] = used[:, 1:]
+    chars = (parts & 0x1F) + np.where(more, 0x20 + 63, 63)
+    return chars[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def simplify(coords: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker sobre una proyección equirectangular local: conserva los
+    extremos y los vértices a más de tolerance_m del tramo simplificado.
+    """
+    if len(coords) < 3 or tolerance_m <= 0:
+        return coords
+    return coords[simplify_mask(coords, tolerance_m)]
+
+
+def simplify_mask(
+    coords: np.ndarray, tolerance_m: float, fixed: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Máscara de los vértices que conserva simplify(). `fixed` marca vértices
+    que se conservan siempre: con los extremos de varias líneas
+    concatenadas, se simplifican todas en una sola llamada.
+
+    Se parten todos los tramos abiertos a la vez, un nivel de la recursión
+    por iteración, en lugar de un tramo por iteración.
+    """
+    n = len(coords)
+    if n < 3 or tolerance_m <= 0:
+        return np.ones(n, dtype=bool)
+    cos_lat = math.cos(math.radians(float(coords[:, 0].mean())))
+    x = coords[:, 1] * (cos_lat * _M_PER_DEG)
+    y = coords[:, 0] * _M_PER_DEG
+    tol2 = tolerance_m * tolerance_m
+
+    keep = np.zeros(n, dtype=bool) if fixed is None else fixed.copy()
+    keep[0] = keep[-1] = True
+    # Vértices intermedios de tramos aún por resolver
+    pending = np.flatnonzero(~keep)
+    while len(pending):
+        kept = np.flatnonzero(keep)
+        seg = np.searchsorted(kept, pending)
+        start = kept[seg - 1]
+        ax, ay = x[start], y[start]
+        abx, aby = x[kept[seg]] - ax, y[kept[seg]] - ay
+        px, py = x[pending] - ax, y[pending] - ay
+        # Distancia al segmento (no a la recta): las rutas pueden volver
+        # sobre sí mismas
+        den = abx * abx + aby * aby
+        t = (px * abx + py * aby) / np.where(den > 0, den, 1.0)
+        np.clip(t, 0.0, 1.0, out=t)
+        px -= t * abx
+        py -= t * aby
+        dist2 = px * px + py * py
+
+        # Vértice más lejano de cada tramo (pending está ordenado por tramo)
+        first = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+        far = np.maximum.reduceat(dist2, first)
+        split = far > tol2
+        if not split.any():
+            break
+        counts = np.diff(np.r_[first, len(seg)])
+        # Primer vértice que alcanza el máximo en cada tramo
+        cand = np.flatnonzero(dist2 == np.repeat(far, counts))
+        cand = cand[np.r_[True, seg[cand[1:]] != seg[cand[:-1]]]]
+        keep[pending[cand[split]]] = True
+        # Los tramos sin vértices fuera de tolerancia quedan resueltos
+        pending = pending[np.repeat(split, counts) & ~keep[pending]]
+    return keep
+
+
+def zoom_tolerance_m(zoom: int, lat: float) -> float:
+    """Tolerancia de simplificación (m) a un zoom del mapa y una latitud."""
+    return GEOMETRY_SIMPLIFY_PX * _M_PER_PX_Z0 * math.cos(math.radians(lat)) / 2**zoom
+
+
+def simplify_for_zoom(coords: np.ndarray, zoom: Optional[int]) -> np.ndarray:
+    if zoom is None or len(coords) < 3:
+        return coords
+    return simplify(coords, zoom_tolerance_m(zoom, float(coords[:, 0].mean())))
+
+
+def render(coords: np.ndarray, fmt: GeometryFormat = "points") -> Any:
+    """Geometría en el formato de salida pedido (objeto serializable a JSON)."""
+    if fmt == "polyline":
+        return encode_polyline(coords, 5)
+    if fmt == "polyline6":
+        return encode_polyline(coords, 6)
+    if fmt == "flat_array":
+        return coords.ravel().tolist()
+    return [{"lat": lat, "lon": lon} for lat, lon in coords.tolist()]
+
+
+def concat(parts: List[np.ndarray]) -> np.ndarray:
+    return np.concatenate(parts) if parts else _EMPTY
+
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def polyline_coords(encoded: str, precision: int = 5, zoom: Optional[int] = None) -> np.ndarray:
+    """Coordenadas de una polyline, simplificadas para zoom (solo lectura)."""
+    coords = simplify_for_zoom(decode_polyline(encoded, precision), zoom)
+    coords.flags.writeable = False
+    return coords
+
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def from_polyline(
+    encoded: str,
+    precision: int = 5,
+    fmt: GeometryFormat = "points",
+    zoom: Optional[int] = None,
+) -> Any:
+    """
+    Polyline convertida a fmt (compartida entre peticiones: no modificar).
+    Si ya está en ese formato y no hay que simplificar, se devuelve tal cual.
+    """
+    if zoom is None and fmt == ("polyline" if precision == 5 else f"polyline{precision}"):
+        return encoded
+    return render(polyline_coords(encoded, precision, zoom), fmt)
+
+
+# -----------------------
+# CLI: benchmark de formatos y simplificación
+# -----------------------
+# bench: tamaño y p50 de /api/osrm/routes y /api/otp/routes en cada formato
+# y zoom, con la caché de rutas rellenada con rutas sintéticas (coche, bici
+# y a pie de 10000/4000/1500 vértices; 5 itinerarios OTP de 5 legs), más el
+# coste sin caché de convertir la ruta más larga.
+
+def _road(rng: np.random.Generator, n: int, lat: float = 39.86, lon: float = -4.03) -> np.ndarray:
+    """Recorrido suave (rumbo con deriva) de n vértices separados ~25 m."""
+    heading = np.cumsum(rng.normal(0, 0.08, n)) + 0.6
+    dlat = 25.0 * np.cos(heading) / _M_PER_DEG
+    dlon = 25.0 * np.sin(heading) / (_M_PER_DEG * math.cos(math.radians(lat)))
+    return np.round(np.column_stack((lat + np.cumsum(dlat), lon + np.cumsum(dlon))), 6)
+
+
+def _timed_ms(fn, n: int) -> float:
+    import statistics
+    import time
+
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def _bench_cli(n: int, seed: int) -> None:
+    import json
+
+    from fastapi.testclient import TestClient
+
+    from app.api.routes_otp import OtpRouteRequest, Point, build_otp_params
+    from app.main import app
+    from app.services.route_cache import ROUTE_CACHE, osrm_key, otp_key
+
+    rng = np.random.default_rng(seed)
+    origin, destination = {"lat": 39.86, "lon": -4.03}, {"lat": 38.99, "lon": -1.86}
+    longest = None
+    for profile, n_points in (("driving", 10000), ("cycling", 4000), ("foot", 1500)):
+        coords = _road(rng, n_points)
+        longest = coords if longest is None else longest
+        key = osrm_key(profile, origin["lon"], origin["lat"], destination["lon"], destination["lat"])
+        ROUTE_CACHE.set(
+            key,
+            {"profile": profile, "distance_m": 250123.4, "duration_s": 9012.3, "polyline6": encode_polyline(coords, 6)},
+        )
+    legs = []
+    for i in range(5):
+        transit = i % 2 == 1
+        leg = {
+            "mode": "BUS" if transit else "WALK",
+            "transitLeg": transit,
+            "distance": 800.0,
+            "duration": 300.0,
+            "from": {"name": "A"},
+            "to": {"name": "B"},
+            "startTime": 1764583200000,
+            "endTime": 1764583500000,
+            "legGeometry": {"points": encode_polyline(_road(rng, 1200 if transit else 80), 5)},
+        }
+        if transit:
+            leg.update(routeId="R1", routeShortName="L1", routeLongName="Linea 1")
+        legs.append(leg)
+    params = build_otp_params(OtpRouteRequest(origin=Point(**origin), destination=Point(**destination)))
+    ROUTE_CACHE.set(otp_key(params), [{"duration": 1500.0 + k, "legs": legs} for k in range(5)])
+
+    variants = [{"geometry_format": f} for f in ("points", "polyline", "polyline6", "flat_array")]
+    variants += [{"geometry_format": f, "simplify_zoom": z} for f in ("points", "polyline6") for z in (16, 13, 10)]
+    with TestClient(app) as client:
+        for url in ("/api/osrm/routes", "/api/otp/routes"):
+            print(url)
+            for extra in variants:
+                body = {"origin": origin, "destination": destination, **extra}
+                resp = client.post(url, json=body, headers={"Accept-Encoding": "identity"})
+                if resp.status_code != 200:
+                    print(f"  {extra}: HTTP {resp.status_code}")
+                    continue
+                p50 = _timed_ms(lambda: client.post(url, json=body, headers={"Accept-Encoding": "identity"}), n)
+                label = extra["geometry_format"] + (f", zoom {extra['simplify_zoom']}" if "simplify_zoom" in extra else "")
+                print(f"  {label:<20} {len(resp.content) / 1000:8.1f} kB  p50 {p50:6.2f} ms")
+
+    print(f"Conversión sin caché de la ruta de {len(longest)} vértices (p50)")
+    for fmt in ("points", "polyline", "flat_array"):
+        print(f"  {fmt:<20} {_timed_ms(lambda: render(longest, fmt), n):6.2f} ms")
+    for zoom in (16, 13, 10):
+        print(f"  simplificar zoom {zoom:<3} {_timed_ms(lambda: simplify_for_zoom(longest, zoom), n):6.2f} ms")
+
+    # Respuesta de OSRM: geometría GeoJSON (antes) frente a polyline6
+    lonlat = longest[:, ::-1].tolist()
+    geojson_body = json.dumps({"routes": [{"geometry": {"type": "LineString", "coordinates": lonlat}}]})
+    polyline_body = json.dumps({"routes": [{"geometry": encode_polyline(longest, 6)}]})
+
+    def parse_geojson():
+        coords = json.loads(geojson_body)["routes"][0]["geometry"]["coordinates"]
+        return [{"lat": lat, "lon": lon} for lon, lat in coords]
+
+    print("Cuerpo de /route de OSRM")
+    print(f"  geojson   {len(geojson_body) / 1000:8.1f} kB  parse + points {_timed_ms(parse_geojson, n):6.2f} ms")
+    print(f"  polyline6 {len(polyline_body) / 1000:8.1f} kB  parse {_timed_ms(lambda: json.loads(polyline_body), n):6.2f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.geometry")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Tamaño y latencia de cada formato de geometría y zoom")
+    bench.add_argument("-n", type=int, default=30)
+    bench.add_argument("--seed", type=int, default=7)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        _bench_cli(args.n, args.seed)
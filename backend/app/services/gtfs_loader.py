@@ -2,62 +2,233 @@
 
 from __future__ import annotations
 
+import argparse
 import csv
-from dataclasses import dataclass
-from datetime import date as Date
+import hashlib
+import json
+import math
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from dataclasses import dataclass, fields
+from datetime import date as Date, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Set
+from typing import Dict, Iterator, List, Optional, Tuple, Set
+
+import numpy as np
 
 
 DEFAULT_GTFS_DIR = (
     Path(__file__).resolve().parents[2] / "data" / "gtfs" / "GTFS_Urbano_Toledo_2026"
 )
 
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+# Paradas por celda (en media) del índice espacial
+STOP_GRID_TARGET_PER_CELL = 4
+# Nº de horarios (ruta, fecha) que se mantienen en caché
+SCHEDULE_CACHE_SIZE = int(os.environ.get("GTFS_SCHEDULE_CACHE_SIZE", "4096"))
+
 
 @dataclass
 class GtfsData:
     stops: Dict[str, dict]
     routes: Dict[str, dict]
-    trips_by_route: Dict[str, List[dict]]
-    stop_times_by_trip: Dict[str, List[dict]]
-    shapes_by_id: Dict[str, List[Tuple[float, float, int]]]
     # índice parada -> lista de rutas (sin duplicados)
     stop_routes: Dict[str, List[dict]]
     # calendario: service_id -> fechas con servicio / sin servicio (YYYYMMDD)
     service_added_dates: Dict[str, Set[str]]
     service_removed_dates: Dict[str, Set[str]]
+    # Índice día -> servicios activos (calendar.txt + calendar_dates.txt).
+    # La fila d corresponde al ordinal service_first_day + d; los servicios
+    # sin ningún dato de calendario operan todos los días (service_always).
+    service_first_day: int
+    service_days: np.ndarray  # bool [n_días, len(service_ids)]
+    service_always: np.ndarray  # bool [len(service_ids)]
 
+    # -----------------------
+    # Almacén columnar
+    # -----------------------
+    # Ids internados: posición en la lista <-> id GTFS original.
+    # stop_ids incluye también paradas referenciadas en stop_times.txt
+    # que no aparecen en stops.txt.
+    stop_ids: List[str]
+    stop_index: Dict[str, int]
+    route_ids: List[str]
+    route_index: Dict[str, int]
+    trip_ids: List[str]
+    trip_index: Dict[str, int]
+    service_ids: List[str]
+    service_index: Dict[str, int]
+    shape_ids: List[str]
+    shape_index: Dict[str, int]
+
+    # Trips (una posición por trip_id, en orden de trips.txt).
+    # -1 significa "sin valor" en todas las columnas enteras.
+    trip_route: np.ndarray  # int32 -> route_ids
+    trip_service: np.ndarray  # int32 -> service_ids
+    trip_direction: np.ndarray  # int8
+    trip_shape: np.ndarray  # int32 -> shape_ids
+    trip_headsign: np.ndarray  # int32 -> headsigns
+    headsigns: List[str]
+
+    # CSR ruta -> trips (en orden de trips.txt)
+    route_trip_offsets: np.ndarray  # int64, len(route_ids) + 1
+    route_trips: np.ndarray  # int32 -> trip_ids
+
+    # CSR trip -> stop_times, ordenados por stop_sequence
+    trip_stop_offsets: np.ndarray  # int64, len(trip_ids) + 1
+    st_stop: np.ndarray  # int32 -> stop_ids
+    st_sequence: np.ndarray  # int32
+    st_arrival: np.ndarray  # int32 -> time_strings (-1 si vacío)
+    st_departure: np.ndarray  # int32 -> time_strings (-1 si vacío)
+    st_arrival_s: np.ndarray  # int32, segundos desde medianoche (-1 si vacío)
+    st_departure_s: np.ndarray  # int32, segundos desde medianoche (-1 si vacío)
+    st_pickup_type: np.ndarray  # int8
+    st_drop_off_type: np.ndarray  # int8
+    # Horas tal y como vienen en el fichero (para devolverlas sin reformatear)
+    time_strings: List[str]
+
+    # Salidas de cada trip (primera parada, departure o arrival), agrupadas
+    # por ruta (CSR) y, dentro de cada ruta, ordenadas por dirección, hora y
+    # orden de trips.txt. Solo trips con hora en su primera parada.
+    route_dep_offsets: np.ndarray  # int64, len(route_ids) + 1
+    route_dep_trips: np.ndarray  # int32 -> trip_ids
+    route_dep_seconds: np.ndarray  # int32
+    route_dep_times: np.ndarray  # int32 -> time_strings
+
+    # Salidas por parada: filas de stop_times en las que se puede subir (con
+    # hora, sin pickup_type 1 y que no son la última parada del trip),
+    # agrupadas por parada (CSR) y, dentro de cada parada, ordenadas por hora
+    # y orden de trips.txt.
+    stop_dep_offsets: np.ndarray  # int64, len(stop_ids) + 1
+    stop_dep_trips: np.ndarray  # int32 -> trip_ids
+    stop_dep_seconds: np.ndarray  # int32
+    stop_dep_times: np.ndarray  # int32 -> time_strings
+
+    # CSR shape -> puntos, ordenados por shape_pt_sequence
+    shape_offsets: np.ndarray  # int64, len(shape_ids) + 1
+    shape_lat: np.ndarray  # float64
+    shape_lon: np.ndarray  # float64
+    shape_seq: np.ndarray  # int32
+
+    # Índice espacial de paradas (rejilla uniforme, CSR por celda). Cubre las
+    # paradas de stops.txt, que ocupan las primeras posiciones de stop_ids.
+    stop_lat: np.ndarray  # float64
+    stop_lon: np.ndarray  # float64
+    # [lat0, lon0, dlat, dlon, ny, nx, metros por grado de lon (mínimo)]
+    stop_grid: np.ndarray  # float64
+    stop_grid_offsets: np.ndarray  # int64, ny * nx + 1
+    stop_grid_stops: np.ndarray  # int32 -> stop_ids, agrupadas por celda
+
+    def trip_stop_slice(self, trip_idx: int) -> slice:
+        """Rango de filas de stop_times (st_*) de un trip."""
+        return slice(
+            int(self.trip_stop_offsets[trip_idx]),
+            int(self.trip_stop_offsets[trip_idx + 1]),
+        )
 
-def _read_csv(path: Path) -> List[dict]:
+    def route_trip_indices(self, route_id: str) -> np.ndarray:
+        """Índices de trips de una ruta, en el orden de trips.txt."""
+        ridx = self.route_index.get(route_id)
+        if ridx is None:
+            return self.route_trips[:0]
+        return self.route_trips[
+            self.route_trip_offsets[ridx] : self.route_trip_offsets[ridx + 1]
+        ]
+
+    def shape_points(self, shape_id: str) -> Optional[List[Tuple[float, float, int]]]:
+        """Puntos (lat, lon, seq) de un shape, o None si no existe."""
+        sidx = self.shape_index.get(shape_id)
+        if sidx is None:
+            return None
+        lo = int(self.shape_offsets[sidx])
+        hi = int(self.shape_offsets[sidx + 1])
+        if lo == hi:
+            # shape_id referenciado en trips.txt pero sin puntos en shapes.txt
+            return None
+        return list(
+            zip(
+                self.shape_lat[lo:hi].tolist(),
+                self.shape_lon[lo:hi].tolist(),
+                self.shape_seq[lo:hi].tolist(),
+            )
+        )
+
+
+def _iter_csv(path: Path) -> Iterator[dict]:
     if not path.exists():
         raise FileNotFoundError(f"GTFS file not found: {path}")
     with path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+        yield from csv.DictReader(f)
 
 
-def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
+def _read_csv(path: Path) -> List[dict]:
+    return list(_iter_csv(path))
+
+
+def _intern(index: Dict[str, int], values: List[str], key: str) -> int:
+    idx = index.get(key)
+    if idx is None:
+        idx = len(values)
+        index[key] = idx
+        values.append(key)
+    return idx
+
+
+def _optional_int(value: Optional[str], default: int) -> int:
+    if value in (None, "", " "):
+        return default
+    return int(value)
+
+
+def _time_to_seconds(t: str) -> int:
     """
-    Carga el GTFS estático en memoria (formato tipo Toledo).
+    Convierte 'HH:MM:SS' (incluso con horas >24) a segundos.
     """
-    base = gtfs_dir or DEFAULT_GTFS_DIR
+    h, m, s = t.split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
 
-    stops_raw = _read_csv(base / "stops.txt")
-    routes_raw = _read_csv(base / "routes.txt")
-    trips_raw = _read_csv(base / "trips.txt")
-    stop_times_raw = _read_csv(base / "stop_times.txt")
-    shapes_raw = _read_csv(base / "shapes.txt")
-    try:
-        calendar_dates_raw = _read_csv(base / "calendar_dates.txt")
-    except FileNotFoundError:
-        calendar_dates_raw = []
 
-    # -----------------------
-    # Stops por stop_id
-    # -----------------------
+def haversine_m(
+    lat: float, lon: float, lats: np.ndarray, lons: np.ndarray
+) -> np.ndarray:
+    """Distancia en metros desde (lat, lon) a cada punto (lats, lons)."""
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlmb = np.radians(lons) - math.radians(lon)
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _csr_offsets(group: np.ndarray, n_groups: int) -> np.ndarray:
+    """Offsets CSR para un array de grupos ya ordenado."""
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(group, minlength=n_groups), out=offsets[1:])
+    return offsets
+
+
+# -----------------------
+# Carga por tablas
+# -----------------------
+# Cada cargador lee un fichero GTFS y devuelve los campos de GtfsData que le
+# corresponden. Los que dependen de otras tablas las reciben ya cargadas
+# (p. ej. trips necesita el índice de rutas) y pueden ampliar sus ids
+# internados con referencias que no aparecen en el fichero original.
+
+def _load_stops(base: Path) -> dict:
+    stop_ids: List[str] = []
+    stop_index: Dict[str, int] = {}
     stops: Dict[str, dict] = {}
-    for row in stops_raw:
+    for row in _iter_csv(base / "stops.txt"):
         stop_id = row["stop_id"]
+        _intern(stop_index, stop_ids, stop_id)
         stops[stop_id] = {
             "stop_id": stop_id,
             "name": row.get("stop_name"),
@@ -71,13 +242,69 @@ def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
                 else None
             ),
         }
+    stop_lat = np.array([stops[sid]["lat"] for sid in stop_ids], dtype=np.float64)
+    stop_lon = np.array([stops[sid]["lon"] for sid in stop_ids], dtype=np.float64)
+    return {
+        "stops": stops,
+        "stop_ids": stop_ids,
+        "stop_index": stop_index,
+        "stop_lat": stop_lat,
+        "stop_lon": stop_lon,
+        **_build_stop_grid(stop_lat, stop_lon),
+    }
 
-    # -----------------------
-    # Rutas por route_id
-    # -----------------------
+
+def _build_stop_grid(lat: np.ndarray, lon: np.ndarray) -> dict:
+    """
+    Rejilla uniforme sobre las paradas, con celdas aproximadamente cuadradas
+    en metros y dimensionadas para ~STOP_GRID_TARGET_PER_CELL paradas por
+    celda. Las paradas quedan agrupadas por celda (fila a fila), de modo que
+    un rango de columnas de una fila es un único tramo contiguo.
+    """
+    n = len(lat)
+    if n == 0:
+        return {
+            "stop_grid": np.array([0.0, 0.0, 1.0, 1.0, 1, 1, METERS_PER_DEGREE]),
+            "stop_grid_offsets": np.zeros(2, dtype=np.int64),
+            "stop_grid_stops": np.zeros(0, dtype=np.int32),
+        }
+
+    lat0, lon0 = float(lat.min()), float(lon.min())
+    span_lat = max(float(lat.max()) - lat0, 1e-6)
+    span_lon = max(float(lon.max()) - lon0, 1e-6)
+    max_abs_lat = min(max(abs(lat0), abs(lat0 + span_lat)), 89.0)
+    m_per_deg_lon = METERS_PER_DEGREE * math.cos(math.radians(max_abs_lat))
+    cos_mid = math.cos(math.radians(lat0 + span_lat / 2))
+
+    area_m2 = span_lat * METERS_PER_DEGREE * span_lon * METERS_PER_DEGREE * cos_mid
+    cell_m = max(math.sqrt(area_m2 * STOP_GRID_TARGET_PER_CELL / n), 50.0)
+    while True:
+        dlat = cell_m / METERS_PER_DEGREE
+        dlon = cell_m / (METERS_PER_DEGREE * cos_mid)
+        ny = int(span_lat // dlat) + 1
+        nx = int(span_lon // dlon) + 1
+        # Feeds degenerados (paradas casi alineadas): limitamos nº de celdas
+        if ny * nx <= 4 * n + 16:
+            break
+        cell_m *= 2
+
+    iy = np.minimum(((lat - lat0) / dlat).astype(np.int64), ny - 1)
+    ix = np.minimum(((lon - lon0) / dlon).astype(np.int64), nx - 1)
+    cell = iy * nx + ix
+    return {
+        "stop_grid": np.array([lat0, lon0, dlat, dlon, ny, nx, m_per_deg_lon]),
+        "stop_grid_offsets": _csr_offsets(np.sort(cell), ny * nx),
+        "stop_grid_stops": np.argsort(cell, kind="stable").astype(np.int32),
+    }
+
+
+def _load_routes(base: Path) -> dict:
+    route_ids: List[str] = []
+    route_index: Dict[str, int] = {}
     routes: Dict[str, dict] = {}
-    for row in routes_raw:
+    for row in _iter_csv(base / "routes.txt"):
         route_id = row["route_id"]
+        _intern(route_index, route_ids, route_id)
         routes[route_id] = {
             "route_id": route_id,
             "short_name": row.get("route_short_name") or None,
@@ -88,83 +315,169 @@ def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
             "color": row.get("route_color") or None,
             "text_color": row.get("route_text_color") or None,
         }
+    return {"routes": routes, "route_ids": route_ids, "route_index": route_index}
 
-    # -----------------------
-    # Trips agrupados por route_id
-    # -----------------------
-    trips_by_route: Dict[str, List[dict]] = {}
-    for row in trips_raw:
-        route_id = row["route_id"]
-        trips_by_route.setdefault(route_id, []).append(
-            {
-                "trip_id": row["trip_id"],
-                "route_id": route_id,
-                "service_id": row.get("service_id") or None,
-                "headsign": row.get("trip_headsign") or None,
-                "direction_id": int(row["direction_id"])
-                if row.get("direction_id") not in (None, "", " ")
-                else None,
-                "shape_id": row.get("shape_id") or None,
-            }
-        )
 
-    # -----------------------
-    # Stop times agrupados por trip_id
-    # -----------------------
-    stop_times_by_trip: Dict[str, List[dict]] = {}
-    for row in stop_times_raw:
+def _load_trips(base: Path, routes: dict) -> dict:
+    route_ids: List[str] = routes["route_ids"]
+    route_index: Dict[str, int] = routes["route_index"]
+
+    trip_ids: List[str] = []
+    trip_index: Dict[str, int] = {}
+    service_ids: List[str] = []
+    service_index: Dict[str, int] = {}
+    shape_ids: List[str] = []
+    shape_index: Dict[str, int] = {}
+    headsigns: List[str] = []
+    headsign_index: Dict[str, int] = {}
+
+    trip_route = array("i")
+    trip_service = array("i")
+    trip_direction = array("b")
+    trip_shape = array("i")
+    trip_headsign = array("i")
+
+    for row in _iter_csv(base / "trips.txt"):
         trip_id = row["trip_id"]
-        seq = int(row["stop_sequence"])
-        stop_times_by_trip.setdefault(trip_id, []).append(
-            {
-                "trip_id": trip_id,
-                "arrival_time": row.get("arrival_time") or None,
-                "departure_time": row.get("departure_time") or None,
-                "stop_id": row["stop_id"],
-                "sequence": seq,
-                "pickup_type": int(row["pickup_type"])
-                if row.get("pickup_type") not in (None, "", " ")
-                else 0,
-                "drop_off_type": int(row["drop_off_type"])
-                if row.get("drop_off_type") not in (None, "", " ")
-                else 0,
-            }
+        if trip_id in trip_index:
+            continue
+        _intern(trip_index, trip_ids, trip_id)
+        trip_route.append(_intern(route_index, route_ids, row["route_id"]))
+        service_id = row.get("service_id")
+        trip_service.append(
+            _intern(service_index, service_ids, service_id) if service_id else -1
+        )
+        trip_direction.append(_optional_int(row.get("direction_id"), -1))
+        shape_id = row.get("shape_id")
+        trip_shape.append(_intern(shape_index, shape_ids, shape_id) if shape_id else -1)
+        headsign = row.get("trip_headsign")
+        trip_headsign.append(
+            _intern(headsign_index, headsigns, headsign) if headsign else -1
         )
 
-    # Ordenamos stop_times por secuencia
-    for trip_id, lst in stop_times_by_trip.items():
-        lst.sort(key=lambda x: x["sequence"])
+    trip_route_arr = np.frombuffer(trip_route, dtype=np.int32).copy()
 
-    # -----------------------
-    # Índice stop -> rutas (sin duplicados)
-    # -----------------------
-    # trip_id -> route_id para lookup rápido
-    trip_to_route: Dict[str, str] = {}
-    for route_id, trip_list in trips_by_route.items():
-        for trip in trip_list:
-            trip_to_route[trip["trip_id"]] = route_id
-
-    # stop_id -> dict(route_id -> route_meta)
-    stop_routes_map: Dict[str, Dict[str, dict]] = {}
-
-    for trip_id, st_list in stop_times_by_trip.items():
-        route_id = trip_to_route.get(trip_id)
-        if not route_id:
-            continue
+    return {
+        "trip_ids": trip_ids,
+        "trip_index": trip_index,
+        "service_ids": service_ids,
+        "service_index": service_index,
+        "shape_ids": shape_ids,
+        "shape_index": shape_index,
+        "headsigns": headsigns,
+        "trip_route": trip_route_arr,
+        "trip_service": np.frombuffer(trip_service, dtype=np.int32).copy(),
+        "trip_direction": np.frombuffer(trip_direction, dtype=np.int8).copy(),
+        "trip_shape": np.frombuffer(trip_shape, dtype=np.int32).copy(),
+        "trip_headsign": np.frombuffer(trip_headsign, dtype=np.int32).copy(),
+        # CSR ruta -> trips (orden estable = orden de trips.txt)
+        "route_trips": np.argsort(trip_route_arr, kind="stable").astype(np.int32),
+        "route_trip_offsets": _csr_offsets(trip_route_arr, len(route_ids)),
+    }
 
-        route_meta = routes.get(route_id)
-        if not route_meta:
+
+def _load_stop_times(base: Path, stops: dict, routes: dict, trips: dict) -> dict:
+    """stop_times agrupados por trip y ordenados por secuencia, más stop_routes."""
+    stop_ids: List[str] = stops["stop_ids"]
+    stop_index: Dict[str, int] = stops["stop_index"]
+    trip_index: Dict[str, int] = trips["trip_index"]
+    n_trips = len(trips["trip_ids"])
+
+    time_strings: List[str] = []
+    time_index: Dict[str, int] = {}
+    time_seconds = array("i")
+
+    def _time_code(value: Optional[str]) -> int:
+        if not value:
+            return -1
+        code = time_index.get(value)
+        if code is None:
+            code = _intern(time_index, time_strings, value)
+            time_seconds.append(_time_to_seconds(value))
+        return code
+
+    st_trip = array("i")
+    st_stop = array("i")
+    st_sequence = array("i")
+    st_arrival = array("i")
+    st_departure = array("i")
+    st_pickup = array("b")
+    st_drop_off = array("b")
+
+    for row in _iter_csv(base / "stop_times.txt"):
+        tidx = trip_index.get(row["trip_id"])
+        if tidx is None:
+            # stop_times de trips que no existen en trips.txt: no son
+            # alcanzables desde ninguna ruta.
             continue
+        st_trip.append(tidx)
+        st_stop.append(_intern(stop_index, stop_ids, row["stop_id"]))
+        st_sequence.append(int(row["stop_sequence"]))
+        st_arrival.append(_time_code(row.get("arrival_time")))
+        st_departure.append(_time_code(row.get("departure_time")))
+        st_pickup.append(_optional_int(row.get("pickup_type"), 0))
+        st_drop_off.append(_optional_int(row.get("drop_off_type"), 0))
+
+    st_trip_arr = np.frombuffer(st_trip, dtype=np.int32)
+    st_sequence_arr = np.frombuffer(st_sequence, dtype=np.int32)
+    # lexsort es estable: a igual secuencia se respeta el orden del fichero
+    st_order = np.lexsort((st_sequence_arr, st_trip_arr))
+    st_trip_sorted = st_trip_arr[st_order]
+
+    seconds_table = np.append(np.frombuffer(time_seconds, dtype=np.int32), np.int32(-1))
+    st_arrival_arr = np.frombuffer(st_arrival, dtype=np.int32)[st_order]
+    st_departure_arr = np.frombuffer(st_departure, dtype=np.int32)[st_order]
+
+    trip_stop_offsets = _csr_offsets(st_trip_sorted, n_trips)
+    st_stop_arr = np.frombuffer(st_stop, dtype=np.int32)[st_order]
+    st_pickup_arr = np.frombuffer(st_pickup, dtype=np.int8)[st_order]
 
-        for st in st_list:
-            sid = st["stop_id"]
-            if sid not in stop_routes_map:
-                stop_routes_map[sid] = {}
+    # -----------------------
+    # Índice stop -> rutas (sin duplicados)
+    # -----------------------
+    # El orden de inserción de la versión basada en dicts era: trips en orden
+    # de primera aparición en stop_times.txt y, dentro de cada trip, por
+    # secuencia. Lo reproducimos con un rango por fila para que el desempate
+    # del sort estable por nombre sea idéntico.
+    route_ids: List[str] = routes["route_ids"]
+    route_meta_by_id: Dict[str, dict] = routes["routes"]
+    n_st = len(st_order)
+    first_seen = np.full(n_trips, n_st, dtype=np.int64)
+    np.minimum.at(first_seen, st_trip_arr, np.arange(n_st, dtype=np.int64))
+    trip_rank = np.argsort(np.argsort(first_seen, kind="stable"), kind="stable")
+    st_rank = trip_rank[st_trip_sorted] * (n_st + 1) + (
+        np.arange(n_st, dtype=np.int64) - trip_stop_offsets[st_trip_sorted]
+    )
+    st_route = trips["trip_route"][st_trip_sorted]
 
-            if route_id in stop_routes_map[sid]:
-                continue
+    known_routes = np.array(
+        [route_id in route_meta_by_id for route_id in route_ids], dtype=bool
+    )
+    mask = known_routes[st_route]
+    pair_stop = st_stop_arr[mask]
+    pair_route = st_route[mask]
+    pair_rank = st_rank[mask]
+
+    # Primer encuentro de cada par (stop, route)
+    order = np.lexsort((pair_rank, pair_route, pair_stop))
+    pair_stop = pair_stop[order]
+    pair_route = pair_route[order]
+    pair_rank = pair_rank[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (pair_stop[1:] != pair_stop[:-1]) | (pair_route[1:] != pair_route[:-1])
+    pair_stop = pair_stop[keep]
+    pair_route = pair_route[keep]
+    pair_rank = pair_rank[keep]
+    # Los rangos son únicos por fila: ordenar por rango conserva tanto el
+    # orden de rutas dentro de cada parada como el orden de claves del dict.
+    order = np.argsort(pair_rank, kind="stable")
 
-            stop_routes_map[sid][route_id] = {
+    stop_routes: Dict[str, List[dict]] = {}
+    for sidx, ridx in zip(pair_stop[order].tolist(), pair_route[order].tolist()):
+        route_id = route_ids[ridx]
+        route_meta = route_meta_by_id[route_id]
+        stop_routes.setdefault(stop_ids[sidx], []).append(
+            {
                 "id": route_id,
                 "short_name": route_meta.get("short_name"),
                 "long_name": route_meta.get("long_name"),
@@ -172,32 +485,119 @@ def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
                 "color": route_meta.get("color"),
                 "text_color": route_meta.get("text_color"),
             }
+        )
 
-    stop_routes: Dict[str, List[dict]] = {}
-    for sid, rmap in stop_routes_map.items():
-        lst = list(rmap.values())
+    for lst in stop_routes.values():
         lst.sort(
             key=lambda r: (r.get("short_name") or r.get("long_name") or r["id"])
         )
-        stop_routes[sid] = lst
 
     # -----------------------
-    # Shapes agrupados por shape_id
+    # Salidas por ruta y dirección
     # -----------------------
-    shapes_by_id: Dict[str, List[Tuple[float, float, int]]] = {}
-    for row in shapes_raw:
-        shape_id = row["shape_id"]
-        lat = float(row["shape_pt_lat"])
-        lon = float(row["shape_pt_lon"])
-        seq = int(row["shape_pt_sequence"])
-        shapes_by_id.setdefault(shape_id, []).append((lat, lon, seq))
-
-    for shape_id, pts in shapes_by_id.items():
-        pts.sort(key=lambda p: p[2])
+    has_stops = trip_stop_offsets[1:] > trip_stop_offsets[:-1]
+    dep_trips = np.flatnonzero(has_stops).astype(np.int32)
+    first_row = trip_stop_offsets[dep_trips]
+    dep_codes = st_departure_arr[first_row]
+    dep_codes = np.where(dep_codes >= 0, dep_codes, st_arrival_arr[first_row])
+    timed = dep_codes >= 0
+    dep_trips, dep_codes = dep_trips[timed], dep_codes[timed]
+    dep_seconds = seconds_table[dep_codes]
+    dep_route = trips["trip_route"][dep_trips]
+    dep_order = np.lexsort(
+        (dep_trips, dep_seconds, trips["trip_direction"][dep_trips], dep_route)
+    )
 
     # -----------------------
-    # Calendario (calendar_dates.txt)
+    # Salidas por parada
     # -----------------------
+    board_codes = np.where(st_departure_arr >= 0, st_departure_arr, st_arrival_arr)
+    last_row = np.zeros(n_st, dtype=bool)
+    last_row[trip_stop_offsets[1:][has_stops] - 1] = True
+    board_rows = np.flatnonzero((board_codes >= 0) & ~last_row & (st_pickup_arr != 1))
+    board_stop = st_stop_arr[board_rows]
+    board_trips = st_trip_sorted[board_rows]
+    board_codes = board_codes[board_rows]
+    board_seconds = seconds_table[board_codes]
+    board_order = np.lexsort((board_trips, board_seconds, board_stop))
+
+    return {
+        "route_dep_offsets": _csr_offsets(dep_route[dep_order], len(route_ids)),
+        "route_dep_trips": dep_trips[dep_order],
+        "route_dep_seconds": dep_seconds[dep_order],
+        "route_dep_times": dep_codes[dep_order],
+        "stop_dep_offsets": _csr_offsets(board_stop[board_order], len(stop_ids)),
+        "stop_dep_trips": board_trips[board_order],
+        "stop_dep_seconds": board_seconds[board_order],
+        "stop_dep_times": board_codes[board_order],
+        "trip_stop_offsets": trip_stop_offsets,
+        "st_stop": st_stop_arr,
+        "st_sequence": st_sequence_arr[st_order],
+        "st_arrival": st_arrival_arr,
+        "st_departure": st_departure_arr,
+        # El código -1 cae en el último elemento de seconds_table (-1)
+        "st_arrival_s": seconds_table[st_arrival_arr],
+        "st_departure_s": seconds_table[st_departure_arr],
+        "st_pickup_type": st_pickup_arr,
+        "st_drop_off_type": np.frombuffer(st_drop_off, dtype=np.int8)[st_order],
+        "time_strings": time_strings,
+        "stop_routes": stop_routes,
+    }
+
+
+def _load_shapes(base: Path, trips: dict) -> dict:
+    shape_ids: List[str] = trips["shape_ids"]
+    shape_index: Dict[str, int] = trips["shape_index"]
+
+    shp_idx = array("i")
+    shp_lat = array("d")
+    shp_lon = array("d")
+    shp_seq = array("i")
+    for row in _iter_csv(base / "shapes.txt"):
+        shp_idx.append(_intern(shape_index, shape_ids, row["shape_id"]))
+        shp_lat.append(float(row["shape_pt_lat"]))
+        shp_lon.append(float(row["shape_pt_lon"]))
+        shp_seq.append(int(row["shape_pt_sequence"]))
+
+    shp_idx_arr = np.frombuffer(shp_idx, dtype=np.int32)
+    shp_seq_arr = np.frombuffer(shp_seq, dtype=np.int32)
+    shp_order = np.lexsort((shp_seq_arr, shp_idx_arr))
+    return {
+        "shape_offsets": _csr_offsets(shp_idx_arr[shp_order], len(shape_ids)),
+        "shape_lat": np.frombuffer(shp_lat, dtype=np.float64)[shp_order],
+        "shape_lon": np.frombuffer(shp_lon, dtype=np.float64)[shp_order],
+        "shape_seq": shp_seq_arr[shp_order],
+    }
+
+
+_WEEKDAY_COLUMNS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+
+def _ymd_to_date(date_ymd: str) -> Date:
+    return Date(int(date_ymd[:4]), int(date_ymd[4:6]), int(date_ymd[6:8]))
+
+
+def _load_calendar(base: Path, trips: dict) -> dict:
+    service_ids: List[str] = trips["service_ids"]
+    service_index: Dict[str, int] = trips["service_index"]
+
+    try:
+        calendar_raw = _read_csv(base / "calendar.txt")
+    except FileNotFoundError:
+        calendar_raw = []
+    try:
+        calendar_dates_raw = _read_csv(base / "calendar_dates.txt")
+    except FileNotFoundError:
+        calendar_dates_raw = []
+
     service_added_dates: Dict[str, Set[str]] = {}
     service_removed_dates: Dict[str, Set[str]] = {}
 
@@ -211,26 +611,552 @@ def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
         elif exception_type == "2":  # servicio eliminado ese día
             service_removed_dates.setdefault(service_id, set()).add(date_ymd)
 
-    return GtfsData(
-        stops=stops,
-        routes=routes,
-        trips_by_route=trips_by_route,
-        stop_times_by_trip=stop_times_by_trip,
-        shapes_by_id=shapes_by_id,
-        stop_routes=stop_routes,
-        service_added_dates=service_added_dates,
-        service_removed_dates=service_removed_dates,
-    )
+    # -----------------------
+    # Índice día -> servicios activos
+    # -----------------------
+    # calendar.txt: (servicio, días de la semana, inicio, fin) como ordinales
+    weekly: List[Tuple[int, List[bool], int, int]] = []
+    for row in calendar_raw:
+        sidx = _intern(service_index, service_ids, row["service_id"])
+        weekly.append(
+            (
+                sidx,
+                [row.get(col, "0").strip() == "1" for col in _WEEKDAY_COLUMNS],
+                _ymd_to_date(row["start_date"]).toordinal(),
+                _ymd_to_date(row["end_date"]).toordinal(),
+            )
+        )
+    exceptions: List[Tuple[int, int, bool]] = []
+    for dates, added in ((service_added_dates, True), (service_removed_dates, False)):
+        for service_id, ymds in dates.items():
+            sidx = _intern(service_index, service_ids, service_id)
+            exceptions.extend(
+                (sidx, _ymd_to_date(ymd).toordinal(), added) for ymd in ymds
+            )
+
+    n_services = len(service_ids)
+    days = [start for _, _, start, _ in weekly] + [end for _, _, _, end in weekly]
+    days += [day for _, day, _ in exceptions]
+    first_day = min(days) if days else 0
+    n_days = max(days) - first_day + 1 if days else 0
+
+    service_days = np.zeros((n_days, n_services), dtype=bool)
+    service_always = np.ones(n_services, dtype=bool)
+    if n_days:
+        weekday = (np.arange(first_day, first_day + n_days) - 1) % 7  # lunes = 0
+        for sidx, flags, start, end in weekly:
+            service_always[sidx] = False
+            rows = slice(start - first_day, end - first_day + 1)
+            service_days[rows, sidx] = np.asarray(flags)[weekday[rows]]
+        for sidx, _day, _added in exceptions:
+            service_always[sidx] = False
+        # Primero los añadidos y luego los eliminados: si una fecha aparece
+        # en ambos, gana la eliminación.
+        for sidx, day, added in sorted(exceptions, key=lambda e: e[2], reverse=True):
+            service_days[day - first_day, sidx] = added
+
+    return {
+        "service_added_dates": service_added_dates,
+        "service_removed_dates": service_removed_dates,
+        "service_first_day": first_day,
+        "service_days": service_days,
+        "service_always": service_always,
+    }
 
 
-# Cargamos una única vez al arrancar el backend
-GTFS_DATA = load_gtfs_data()
+# tabla -> (cargador, tablas de las que depende), en orden de carga
+_TABLE_LOADERS = {
+    "stops": (_load_stops, ()),
+    "routes": (_load_routes, ()),
+    "trips": (_load_trips, ("routes",)),
+    "calendar": (_load_calendar, ("trips",)),
+    "stop_times": (_load_stop_times, ("stops", "routes", "trips")),
+    "shapes": (_load_shapes, ("trips",)),
+}
+
+
+def load_gtfs_data(gtfs_dir: Optional[Path] = None) -> GtfsData:
+    """
+    Carga el GTFS estático en memoria (formato tipo Toledo).
+
+    Las tablas pequeñas (stops, routes, calendario) se guardan como dicts;
+    trips, stop_times y shapes se guardan en arrays NumPy con ids internados
+    y offsets tipo CSR por trip y por shape.
+    """
+    base = gtfs_dir or DEFAULT_GTFS_DIR
+
+    tables: Dict[str, dict] = {}
+    for name, (loader, deps) in _TABLE_LOADERS.items():
+        tables[name] = loader(base, *(tables[d] for d in deps))
+
+    values: Dict[str, object] = {}
+    for part in tables.values():
+        values.update(part)
+    return GtfsData(**values)
+
+
+# -----------------------
+# Snapshot binario
+# -----------------------
+# Formato (little-endian):
+#   magic (8 bytes) | versión (u32) | longitud cabecera (u32) | cabecera JSON
+#   | arrays NumPy alineados a _SNAPSHOT_ALIGN bytes
+# La cabecera guarda la huella de los ficheros fuente, las tablas pequeñas
+# (stops, routes, calendario...) y el dtype/shape/offset de cada array, que
+# al cargar se mapean con mmap sin copiarlos.
+
+SNAPSHOT_MAGIC = b"GTFSSNAP"
+SNAPSHOT_VERSION = 4
+_SNAPSHOT_ALIGN = 64
+# Espera máxima de un worker a que otro publique el snapshot (modo compartido)
+SHARED_LOCK_TIMEOUT_S = float(os.environ.get("GTFS_SHARED_LOCK_TIMEOUT_S", "300"))
+
+# Índices id -> posición: se reconstruyen a partir de las listas de ids
+_INDEX_FIELDS = {
+    "stop_index": "stop_ids",
+    "route_index": "route_ids",
+    "trip_index": "trip_ids",
+    "service_index": "service_ids",
+    "shape_index": "shape_ids",
+}
+_SET_FIELDS = ("service_added_dates", "service_removed_dates")
+
+
+def snapshot_path(gtfs_dir: Optional[Path] = None) -> Path:
+    """
+    Ruta del snapshot asociado a un directorio GTFS (junto a él).
+    GTFS_SNAPSHOT_PATH permite moverlo, p. ej. a /dev/shm en Linux.
+    """
+    override = os.environ.get("GTFS_SNAPSHOT_PATH")
+    if override:
+        return Path(override)
+    base = gtfs_dir or DEFAULT_GTFS_DIR
+    return base.parent / f"{base.name}.gtfssnap"
+
+
+def source_fingerprint(gtfs_dir: Optional[Path] = None) -> str:
+    """
+    Huella de los ficheros GTFS (nombre, tamaño y mtime de cada .txt).
+    Cambia en cuanto se sustituye o modifica cualquier fichero del feed.
+    """
+    base = gtfs_dir or DEFAULT_GTFS_DIR
+    h = hashlib.sha256()
+    for path in sorted(base.glob("*.txt")):
+        st = path.stat()
+        h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def source_last_modified(gtfs_dir: Optional[Path] = None) -> float:
+    """mtime (epoch) del fichero .txt más reciente del feed."""
+    base = gtfs_dir or DEFAULT_GTFS_DIR
+    return max((path.stat().st_mtime for path in base.glob("*.txt")), default=0.0)
+
+
+def write_snapshot(
+    data: GtfsData, fingerprint: str, path: Optional[Path] = None
+) -> Path:
+    """Escribe el snapshot de forma atómica (fichero temporal + replace)."""
+    path = path or snapshot_path()
+
+    tables: Dict[str, object] = {}
+    arrays: Dict[str, np.ndarray] = {}
+    for f in fields(GtfsData):
+        if f.name in _INDEX_FIELDS:
+            continue
+        value = getattr(data, f.name)
+        if isinstance(value, np.ndarray):
+            arrays[f.name] = np.ascontiguousarray(value)
+        elif f.name in _SET_FIELDS:
+            tables[f.name] = {k: sorted(v) for k, v in value.items()}
+        else:
+            tables[f.name] = value
+
+    array_meta: Dict[str, dict] = {}
+    offset = 0
+    for name, arr in arrays.items():
+        offset = -(-offset // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+        array_meta[name] = {
+            "dtype": arr.dtype.str,
+            "shape": list(arr.shape),
+            "offset": offset,
+        }
+        offset += arr.nbytes
+
+    header = json.dumps(
+        {"fingerprint": fingerprint, "tables": tables, "arrays": array_meta},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    prefix_len = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    data_start = -(-prefix_len // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as fh:
+        fh.write(SNAPSHOT_MAGIC)
+        fh.write(struct.pack("<II", SNAPSHOT_VERSION, len(header)))
+        fh.write(header)
+        fh.write(b"\0" * (data_start - prefix_len))
+        for name, arr in arrays.items():
+            fh.seek(data_start + array_meta[name]["offset"])
+            fh.write(arr.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def read_snapshot(path: Path, fingerprint: Optional[str] = None) -> Optional[GtfsData]:
+    """
+    Carga un snapshot mapeando sus arrays en memoria (solo lectura).
+    Devuelve None si no existe, si la versión no coincide o si la huella
+    no corresponde a `fingerprint` (snapshot obsoleto).
+    """
+    if not path.exists():
+        return None
+
+    with path.open("rb") as fh:
+        if fh.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            return None
+        version, header_len = struct.unpack("<II", fh.read(8))
+        if version != SNAPSHOT_VERSION:
+            return None
+        header = json.loads(fh.read(header_len).decode("utf-8"))
+        if fingerprint is not None and header["fingerprint"] != fingerprint:
+            return None
+        prefix_len = len(SNAPSHOT_MAGIC) + 8 + header_len
+        data_start = -(-prefix_len // _SNAPSHOT_ALIGN) * _SNAPSHOT_ALIGN
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    values: Dict[str, object] = dict(header["tables"])
+    for name in _SET_FIELDS:
+        values[name] = {k: set(v) for k, v in values[name].items()}
+    for index_name, ids_name in _INDEX_FIELDS.items():
+        values[index_name] = {key: i for i, key in enumerate(values[ids_name])}
+    for name, meta in header["arrays"].items():
+        dtype = np.dtype(meta["dtype"])
+        shape = tuple(meta["shape"])
+        count = int(np.prod(shape))
+        values[name] = np.frombuffer(
+            buf, dtype=dtype, count=count, offset=data_start + meta["offset"]
+        ).reshape(shape)
+
+    return GtfsData(**values)
+
+
+def _publish_snapshot(base: Path, path: Path, fingerprint: str) -> Optional[GtfsData]:
+    """
+    Publica el snapshot una sola vez aunque arranquen varios workers a la vez.
+
+    El primer proceso que consigue crear el fichero de bloqueo parsea los CSV
+    y escribe el snapshot; el resto espera a que aparezca y lo mapea. Si la
+    espera supera SHARED_LOCK_TIMEOUT_S (p. ej. un worker murió con el lock
+    cogido), se retira el lock y se devuelve None para cargar desde CSV.
+    """
+    lock = path.with_name(path.name + ".lock")
+    deadline = time.monotonic() + SHARED_LOCK_TIMEOUT_S
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            data = read_snapshot(path, fingerprint)
+            if data is not None:
+                return data
+            if time.monotonic() > deadline:
+                lock.unlink(missing_ok=True)
+                return None
+            time.sleep(0.2)
+            continue
+
+        try:
+            os.close(fd)
+            # Otro worker pudo publicarlo entre nuestra lectura y el lock
+            data = read_snapshot(path, fingerprint)
+            if data is None:
+                write_snapshot(load_gtfs_data(base), fingerprint, path)
+                data = read_snapshot(path, fingerprint)
+            return data
+        finally:
+            lock.unlink(missing_ok=True)
+
+
+def _load_fresh_snapshot(base: Path) -> Optional[GtfsData]:
+    """
+    Devuelve el snapshot de `base` si está al día, o None para cargar desde
+    CSV. Con GTFS_SNAPSHOT=0 se ignora el snapshot.
+
+    Con GTFS_SHARED=1 (varios workers de uvicorn), un snapshot ausente u
+    obsoleto se publica una única vez y todos los workers mapean el mismo
+    fichero: los arrays grandes (stop_times, shapes, trips) se comparten
+    entre procesos a través de la caché de páginas en lugar de copiarse.
+    """
+    if os.environ.get("GTFS_SNAPSHOT", "1") == "0":
+        return None
+    path = snapshot_path(base)
+    fingerprint = source_fingerprint(base)
+    data = read_snapshot(path, fingerprint)
+    if data is None and os.environ.get("GTFS_SHARED") == "1":
+        data = _publish_snapshot(base, path, fingerprint)
+    return data
+
+
+def load_gtfs(gtfs_dir: Optional[Path] = None) -> GtfsData:
+    """
+    Carga el GTFS completo desde el snapshot binario si está al día; si falta
+    o está obsoleto, parsea los CSV.
+    """
+    base = gtfs_dir or DEFAULT_GTFS_DIR
+    data = _load_fresh_snapshot(base)
+    if data is not None:
+        return data
+    return load_gtfs_data(base)
+
+
+# -----------------------
+# Carga perezosa
+# -----------------------
+
+# tabla -> campos de GtfsData que produce su cargador
+_TABLE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "stops": (
+        "stops",
+        "stop_ids",
+        "stop_index",
+        "stop_lat",
+        "stop_lon",
+        "stop_grid",
+        "stop_grid_offsets",
+        "stop_grid_stops",
+    ),
+    "routes": ("routes", "route_ids", "route_index"),
+    "calendar": (
+        "service_added_dates",
+        "service_removed_dates",
+        "service_first_day",
+        "service_days",
+        "service_always",
+    ),
+    "trips": (
+        "trip_ids",
+        "trip_index",
+        "service_ids",
+        "service_index",
+        "shape_ids",
+        "shape_index",
+        "headsigns",
+        "trip_route",
+        "trip_service",
+        "trip_direction",
+        "trip_shape",
+        "trip_headsign",
+        "route_trips",
+        "route_trip_offsets",
+    ),
+    "stop_times": (
+        "trip_stop_offsets",
+        "st_stop",
+        "st_sequence",
+        "st_arrival",
+        "st_departure",
+        "st_arrival_s",
+        "st_departure_s",
+        "st_pickup_type",
+        "st_drop_off_type",
+        "time_strings",
+        "stop_routes",
+        "route_dep_offsets",
+        "route_dep_trips",
+        "route_dep_seconds",
+        "route_dep_times",
+        "stop_dep_offsets",
+        "stop_dep_trips",
+        "stop_dep_seconds",
+        "stop_dep_times",
+    ),
+    "shapes": ("shape_offsets", "shape_lat", "shape_lon", "shape_seq"),
+}
+_FIELD_TABLE = {f: table for table, names in _TABLE_FIELDS.items() for f in names}
+
+
+class LazyGtfsData(GtfsData):
+    """
+    GtfsData que carga cada tabla GTFS la primera vez que se accede a uno de
+    sus campos (y, antes, las tablas de las que depende).
+
+    Si hay un snapshot al día se mapea entero en el primer acceso, porque es
+    casi gratis; si no, cada tabla se parsea desde CSV por separado.
+    """
+
+    def __init__(self, gtfs_dir: Optional[Path] = None) -> None:
+        # No llamamos al __init__ del dataclass: los campos se rellenan al
+        # cargar cada tabla y, mientras tanto, __getattr__ los resuelve.
+        self._base = gtfs_dir or DEFAULT_GTFS_DIR
+        self._locks = {name: threading.Lock() for name in _TABLE_LOADERS}
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_checked = False
+        self._source: Optional[str] = None
+        self._fingerprint: Optional[str] = None
+        self._last_modified: Optional[float] = None
+        self._status: Dict[str, dict] = {
+            name: {"state": "pending", "load_ms": None} for name in _TABLE_LOADERS
+        }
+
+    def __getattr__(self, name: str):
+        table = _FIELD_TABLE.get(name)
+        if table is None:
+            raise AttributeError(name)
+        self.ensure(table)
+        return self.__dict__[name]
+
+    def _check_snapshot(self) -> None:
+        if self._snapshot_checked:
+            return
+        with self._snapshot_lock:
+            if self._snapshot_checked:
+                return
+            t0 = time.perf_counter()
+            self._fingerprint = source_fingerprint(self._base)
+            self._last_modified = source_last_modified(self._base)
+            data = _load_fresh_snapshot(self._base)
+            if data is not None:
+                load_ms = round((time.perf_counter() - t0) * 1000, 1)
+                self.__dict__.update(vars(data))
+                self._source = "snapshot"
+                for status in self._status.values():
+                    status.update(state="ready", load_ms=load_ms)
+            else:
+                self._source = "csv"
+            self._snapshot_checked = True
+
+    def ensure(self, table: str) -> None:
+        """Carga `table` (y sus dependencias) si aún no está cargada."""
+        if self._status[table]["state"] == "ready":
+            return
+        self._check_snapshot()
+
+        loader, deps = _TABLE_LOADERS[table]
+        for dep in deps:
+            self.ensure(dep)
+
+        with self._locks[table]:
+            status = self._status[table]
+            if status["state"] == "ready":
+                return
+            status["state"] = "loading"
+            t0 = time.perf_counter()
+            try:
+                values = loader(
+                    self._base,
+                    *({f: self.__dict__[f] for f in _TABLE_FIELDS[d]} for d in deps),
+                )
+            except Exception:
+                status["state"] = "error"
+                raise
+            self.__dict__.update(values)
+            status.update(
+                state="ready", load_ms=round((time.perf_counter() - t0) * 1000, 1)
+            )
+
+    def warm_up(self) -> None:
+        """Carga todas las tablas, de las más ligeras a las más pesadas."""
+        for table in _TABLE_LOADERS:
+            self.ensure(table)
+
+    def fingerprint(self) -> str:
+        """Huella de los ficheros GTFS tal como estaban al cargarlos."""
+        self._check_snapshot()
+        return self._fingerprint
+
+    def last_modified(self) -> float:
+        """mtime (epoch) del fichero GTFS más reciente al cargarlos."""
+        self._check_snapshot()
+        return self._last_modified
+
+    def status(self) -> dict:
+        """Estado de carga por tabla, para /health."""
+        return {
+            "source": self._source,
+            "tables": {name: dict(st) for name, st in self._status.items()},
+        }
+
+
+# Nada se carga al importar el módulo: cada tabla se lee en su primer uso
+# (o en el warm-up que lanza el lifespan de la app).
+GTFS_DATA = LazyGtfsData()
+
+
+def warm_up() -> None:
+    GTFS_DATA.warm_up()
+
+
+def table_status() -> dict:
+    return GTFS_DATA.status()
+
+
+def dataset_version() -> str:
+    """
+    Versión del GTFS cargado en este proceso (source_fingerprint en el
+    momento de la carga): clave para cachear respuestas derivadas del feed.
+    """
+    return GTFS_DATA.fingerprint()
+
+
+def dataset_last_modified() -> float:
+    """Fecha (epoch) de la versión cargada, para Last-Modified."""
+    return GTFS_DATA.last_modified()
 
 
 # -----------------------
 # Funciones auxiliares
 # -----------------------
 
+def _grid_cells(
+    grid: np.ndarray, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+) -> Optional[Tuple[int, int, int, int]]:
+    """Rango de celdas (y0, y1, x0, x1) que cubre un bbox, o None si no hay."""
+    lat0, lon0, dlat, dlon, ny, nx = grid[:6].tolist()
+    y0 = max(math.floor((min_lat - lat0) / dlat), 0)
+    y1 = min(math.floor((max_lat - lat0) / dlat), int(ny) - 1)
+    x0 = max(math.floor((min_lon - lon0) / dlon), 0)
+    x1 = min(math.floor((max_lon - lon0) / dlon), int(nx) - 1)
+    if y0 > y1 or x0 > x1:
+        return None
+    return y0, y1, x0, x1
+
+
+def grid_candidates(
+    data: GtfsData, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+) -> np.ndarray:
+    """Índices de paradas de las celdas que tocan el bbox (sin filtrar)."""
+    cells = _grid_cells(data.stop_grid, min_lat, max_lat, min_lon, max_lon)
+    if cells is None:
+        return data.stop_grid_stops[:0]
+    y0, y1, x0, x1 = cells
+    nx = int(data.stop_grid[5])
+    offsets = data.stop_grid_offsets
+    # Dentro de una fila, las celdas x0..x1 son un tramo contiguo
+    chunks = [
+        data.stop_grid_stops[offsets[iy * nx + x0] : offsets[iy * nx + x1 + 1]]
+        for iy in range(y0, y1 + 1)
+    ]
+    return np.concatenate(chunks)
+
+
+def stops_in_bbox(
+    data: GtfsData, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+) -> np.ndarray:
+    """Índices de paradas dentro del bbox, en el orden de stops.txt."""
+    idx = grid_candidates(data, min_lat, max_lat, min_lon, max_lon)
+    lat = data.stop_lat[idx]
+    lon = data.stop_lon[idx]
+    mask = (min_lat <= lat) & (lat <= max_lat) & (min_lon <= lon) & (lon <= max_lon)
+    return np.sort(idx[mask])
+
+
+def _with_distance(data: GtfsData, idx: np.ndarray, dist: np.ndarray) -> List[dict]:
+    return [
+        {**data.stops[data.stop_ids[i]], "distance_m": d}
+        for i, d in zip(idx.tolist(), dist.tolist())
+    ]
+
+
 def list_stops(
     limit: Optional[int] = None,
     bbox: Optional[Tuple[float, float, float, float]] = None,
@@ -239,16 +1165,14 @@ def list_stops(
     Devuelve una lista de paradas, opcionalmente filtradas por bounding-box:
     bbox = (min_lat, max_lat, min_lon, max_lon)
     """
-    stops = list(GTFS_DATA.stops.values())
-
-    if bbox is not None:
-        min_lat, max_lat, min_lon, max_lon = bbox
-        stops = [
-            s
-            for s in stops
-            if (min_lat <= s["lat"] <= max_lat)
-            and (min_lon <= s["lon"] <= max_lon)
-        ]
+    if bbox is None:
+        stops = list(GTFS_DATA.stops.values())
+    else:
+        data = GTFS_DATA
+        idx = stops_in_bbox(data, *bbox)
+        if limit is not None:
+            idx = idx[:limit]
+        stops = [data.stops[data.stop_ids[i]] for i in idx.tolist()]
 
     if limit is not None:
         stops = stops[:limit]
@@ -256,6 +1180,75 @@ def list_stops(
     return stops
 
 
+def nearest(lat: float, lon: float, k: int = 5) -> List[dict]:
+    """
+    Las k paradas más cercanas a (lat, lon), ordenadas por distancia.
+    Cada parada incluye "distance_m" (haversine).
+
+    Busca en ventanas de celdas cada vez mayores alrededor del punto y se
+    detiene cuando la k-ésima distancia es menor que el radio que la ventana
+    garantiza cubrir por completo.
+    """
+    data = GTFS_DATA
+    lat0, lon0, dlat, dlon, ny, nx, m_per_deg_lon = data.stop_grid.tolist()
+    k = min(k, len(data.stop_lat))
+    if k <= 0:
+        return []
+
+    cy = math.floor((lat - lat0) / dlat)
+    cx = math.floor((lon - lon0) / dlon)
+    # Distancia mínima del punto al borde de su celda, en metros
+    inner = min(
+        (lat - (lat0 + cy * dlat)) * METERS_PER_DEGREE,
+        (lat0 + (cy + 1) * dlat - lat) * METERS_PER_DEGREE,
+        (lon - (lon0 + cx * dlon)) * m_per_deg_lon,
+        (lon0 + (cx + 1) * dlon - lon) * m_per_deg_lon,
+    )
+    cell_m = min(dlat * METERS_PER_DEGREE, dlon * m_per_deg_lon)
+
+    r = 0
+    while True:
+        y0, y1, x0, x1 = cy - r, cy + r, cx - r, cx + r
+        covers_all = y0 <= 0 and x0 <= 0 and y1 >= ny - 1 and x1 >= nx - 1
+        idx = grid_candidates(
+            data,
+            lat0 + (y0 + 0.5) * dlat,
+            lat0 + (y1 + 0.5) * dlat,
+            lon0 + (x0 + 0.5) * dlon,
+            lon0 + (x1 + 0.5) * dlon,
+        )
+        if len(idx) >= k or covers_all:
+            dist = haversine_m(lat, lon, data.stop_lat[idx], data.stop_lon[idx])
+            if len(idx) > k:
+                part = np.argpartition(dist, k - 1)[:k]
+            else:
+                part = np.arange(len(idx))
+            order = part[np.argsort(dist[part], kind="stable")]
+            # Todo lo que está a menos de `guaranteed` metros cae en la ventana
+            guaranteed = inner + r * cell_m
+            if covers_all or dist[order[-1]] <= guaranteed:
+                return _with_distance(data, idx[order], dist[order])
+        r = 2 * r + 1
+
+
+def within_radius(lat: float, lon: float, meters: float) -> List[dict]:
+    """
+    Paradas a menos de `meters` metros de (lat, lon), ordenadas por
+    distancia. Cada parada incluye "distance_m" (haversine).
+    """
+    data = GTFS_DATA
+    dlat = meters / METERS_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 1e-6)
+    dlon = meters / (METERS_PER_DEGREE * cos_lat)
+
+    idx = grid_candidates(data, lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+    dist = haversine_m(lat, lon, data.stop_lat[idx], data.stop_lon[idx])
+    mask = dist <= meters
+    idx, dist = idx[mask], dist[mask]
+    order = np.argsort(dist, kind="stable")
+    return _with_distance(data, idx[order], dist[order])
+
+
 def list_routes() -> List[dict]:
     """Devuelve todas las rutas del GTFS."""
     return list(GTFS_DATA.routes.values())
@@ -272,19 +1265,21 @@ def get_route_with_stops(route_id: str) -> Tuple[dict, List[dict], Optional[List
     if not route:
         raise KeyError(f"Route not found: {route_id}")
 
-    trips = GTFS_DATA.trips_by_route.get(route_id) or []
-    if not trips:
+    data = GTFS_DATA
+    trips = data.route_trip_indices(route_id)
+    if not len(trips):
         return route, [], None
 
-    trip = trips[0]
-    trip_id = trip["trip_id"]
-    shape_id = trip.get("shape_id")
+    trip_idx = int(trips[0])
+    shape_idx = int(data.trip_shape[trip_idx])
 
-    stop_times = GTFS_DATA.stop_times_by_trip.get(trip_id) or []
+    st_slice = data.trip_stop_slice(trip_idx)
+    stop_idxs = data.st_stop[st_slice].tolist()
+    sequences = data.st_sequence[st_slice].tolist()
 
     route_stops: List[dict] = []
-    for st in stop_times:
-        stop = GTFS_DATA.stops.get(st["stop_id"])
+    for sidx, seq in zip(stop_idxs, sequences):
+        stop = data.stops.get(data.stop_ids[sidx])
         if not stop:
             continue
         route_stops.append(
@@ -294,47 +1289,46 @@ def get_route_with_stops(route_id: str) -> Tuple[dict, List[dict], Optional[List
                 "desc": stop["desc"],
                 "lat": stop["lat"],
                 "lon": stop["lon"],
-                "sequence": st["sequence"],
+                "sequence": seq,
             }
         )
 
     geometry: Optional[List[dict]] = None
-    if shape_id and shape_id in GTFS_DATA.shapes_by_id:
-        pts = GTFS_DATA.shapes_by_id[shape_id]
-        geometry = [{"lat": lat, "lon": lon} for (lat, lon, _seq) in pts]
+    if shape_idx >= 0:
+        pts = data.shape_points(data.shape_ids[shape_idx])
+        if pts is not None:
+            geometry = [{"lat": lat, "lon": lon} for (lat, lon, _seq) in pts]
 
     return route, route_stops, geometry
 
 
 # --------- calendario + horarios ---------
 
+def active_services(for_date: Date) -> np.ndarray:
+    """
+    Máscara booleana (por índice de service_ids) de los servicios que operan
+    en una fecha, según calendar.txt y calendar_dates.txt. Los servicios sin
+    datos de calendario se consideran activos todos los días.
+    """
+    data = GTFS_DATA
+    day = for_date.toordinal() - data.service_first_day
+    if 0 <= day < len(data.service_days):
+        return data.service_days[day] | data.service_always
+    return data.service_always
+
+
 def _service_runs_on_date(service_id: Optional[str], date_ymd: str) -> bool:
     """
     Determina si un service_id opera en una fecha concreta (YYYYMMDD).
-    Si solo hay calendar_dates, tomamos exception_type=1 como "días con servicio".
     """
     if not service_id:
         # Si el GTFS no define service_id para un trip, asumimos que opera siempre.
         return True
 
-    added = GTFS_DATA.service_added_dates.get(service_id, set())
-    removed = GTFS_DATA.service_removed_dates.get(service_id, set())
-
-    if added or removed:
-        if date_ymd in removed:
-            return False
-        return date_ymd in added
-
-    # Sin info en calendar_dates, asumimos que opera todos los días.
-    return True
-
-
-def _time_to_seconds(t: str) -> int:
-    """
-    Convierte 'HH:MM:SS' (incluso con horas >24) a segundos.
-    """
-    h, m, s = t.split(":")
-    return int(h) * 3600 + int(m) * 60 + int(s)
+    sidx = GTFS_DATA.service_index.get(service_id)
+    if sidx is None:
+        return True
+    return bool(active_services(_ymd_to_date(date_ymd))[sidx])
 
 
 def get_route_schedule(route_id: str, for_date: Date) -> dict:
@@ -356,51 +1350,78 @@ def get_route_schedule(route_id: str, for_date: Date) -> dict:
         ...
       ]
     }
+
+    Las respuestas se cachean por (route_id, fecha): el resultado es
+    compartido y no debe modificarse.
     """
     if route_id not in GTFS_DATA.routes:
         raise KeyError(f"Route not found: {route_id}")
+    return _route_schedule_cached(route_id, for_date)
 
-    date_ymd = for_date.strftime("%Y%m%d")
-    trips = GTFS_DATA.trips_by_route.get(route_id) or []
 
-    # direction_id -> {"times": [str], "headsign": Optional[str]}
-    dir_data: Dict[Optional[int], dict] = {}
-
-    for trip in trips:
-        service_id = trip.get("service_id")
-        if not _service_runs_on_date(service_id, date_ymd):
-            continue
-
-        trip_id = trip["trip_id"]
-        stop_times = GTFS_DATA.stop_times_by_trip.get(trip_id) or []
-        if not stop_times:
-            continue
-
-        first_st = stop_times[0]
-        t = first_st.get("departure_time") or first_st.get("arrival_time")
-        if not t:
-            continue
-
-        direction_id = trip.get("direction_id")
-        info = dir_data.setdefault(
-            direction_id,
-            {"times": [], "headsign": None},
-        )
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _route_schedule_cached(route_id: str, for_date: Date) -> dict:
+    return {
+        "route_id": route_id,
+        "date": for_date.isoformat(),
+        "directions": _route_directions(route_id, service_pattern(for_date)),
+    }
 
-        if not info["headsign"] and trip.get("headsign"):
-            info["headsign"] = trip["headsign"]
 
-        info["times"].append(t)
+@lru_cache(maxsize=1024)
+def service_pattern(for_date: Date) -> bytes:
+    """
+    Servicios activos en una fecha, empaquetados como clave hashable. Los
+    días con el mismo patrón (p. ej. todos los laborables) comparten clave,
+    así que el horario de una ruta se calcula una vez por patrón y no por día.
+    """
+    return np.packbits(active_services(for_date)).tobytes()
+
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _route_directions(route_id: str, pattern: bytes) -> List[dict]:
+    data = GTFS_DATA
+    ridx = data.route_index[route_id]
+    lo = int(data.route_dep_offsets[ridx])
+    hi = int(data.route_dep_offsets[ridx + 1])
+    service_active = np.unpackbits(
+        np.frombuffer(pattern, dtype=np.uint8), count=len(data.service_ids)
+    ).astype(bool)
+
+    # Salidas de la ruta ya ordenadas por (dirección, hora, orden de trips.txt)
+    trips = data.route_dep_trips[lo:hi]
+    services = data.trip_service[trips]
+    active = np.ones(len(trips), dtype=bool)
+    with_service = services >= 0
+    active[with_service] = service_active[services[with_service]]
+
+    trips = trips[active]
+    times = data.route_dep_times[lo:hi][active]
+    directions_arr = data.trip_direction[trips]
+
+    # Las direcciones salen en el orden en que aparece su primer trip activo
+    # en trips.txt, igual que al recorrer los trips de la ruta uno a uno.
+    groups = []
+    bounds = (np.flatnonzero(np.diff(directions_arr)) + 1).tolist()
+    starts = [0, *bounds] if len(trips) else []
+    for g_lo, g_hi in zip(starts, [*bounds, len(trips)]):
+        g_trips = trips[g_lo:g_hi]
+        headsign_idx = data.trip_headsign[g_trips]
+        with_headsign = g_trips[headsign_idx >= 0]
+        headsign = None
+        if len(with_headsign):
+            headsign = data.headsigns[int(data.trip_headsign[with_headsign.min()])]
+        groups.append((int(g_trips.min()), g_lo, g_hi, headsign))
+    groups.sort()
 
     directions: List[dict] = []
-    for direction_id, info in dir_data.items():
-        if not info["times"]:
-            continue
-        times_sorted = sorted(info["times"], key=_time_to_seconds)
+    for _first_trip, g_lo, g_hi, headsign in groups:
+        direction = int(directions_arr[g_lo])
+        times_sorted = [data.time_strings[c] for c in times[g_lo:g_hi].tolist()]
         directions.append(
             {
-                "direction_id": direction_id,
-                "headsign": info["headsign"],
+                "direction_id": direction if direction >= 0 else None,
+                "headsign": headsign,
                 "trip_count": len(times_sorted),
                 "first_departure": times_sorted[0],
                 "last_departure": times_sorted[-1],
@@ -408,8 +1429,269 @@ def get_route_schedule(route_id: str, for_date: Date) -> dict:
             }
         )
 
-    return {
-        "route_id": route_id,
-        "date": for_date.isoformat(),
-        "directions": directions,
-    }
+    return directions
+
+
+# --------- salidas por parada ---------
+
+_DAY_S = 24 * 3600
+
+
+def _active_stop_departures(
+    lo: int, hi: int, from_s: int, service_active: np.ndarray, limit: int
+) -> np.ndarray:
+    """
+    Posiciones (en stop_dep_*) de las primeras `limit` salidas de una parada
+    desde from_s cuyo servicio está activo. La primera se busca por bisección
+    y a partir de ahí se filtra por bloques, sin recorrer toda la parada.
+    """
+    data = GTFS_DATA
+    i = lo + int(np.searchsorted(data.stop_dep_seconds[lo:hi], from_s))
+    found: List[np.ndarray] = []
+    n_found = 0
+    block = max(limit, 32)
+    while i < hi and n_found < limit:
+        j = min(hi, i + block)
+        services = data.trip_service[data.stop_dep_trips[i:j]]
+        # Los trips sin service_id operan siempre
+        active = np.ones(len(services), dtype=bool)
+        with_service = services >= 0
+        active[with_service] = service_active[services[with_service]]
+        found.append(i + np.flatnonzero(active))
+        n_found += len(found[-1])
+        i = j
+        block *= 2
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(found)[:limit]
+
+
+def stop_departures(stop_id: str, for_date: Date, from_s: int, limit: int = 20) -> List[dict]:
+    """
+    Próximas salidas desde una parada a partir de la hora from_s (segundos
+    desde medianoche) de una fecha, ordenadas por hora:
+
+    [
+      {
+        "trip_id": "...",
+        "route_id": "...",
+        "route_short_name": "L5",
+        "headsign": "CASCO HISTÓRICO",
+        "direction_id": 0,
+        "service_date": "YYYY-MM-DD",
+        "departure_time": "25:10:00"
+      },
+      ...
+    ]
+
+    Incluye los trips del día de servicio anterior que pasan de medianoche
+    (horas de 24:00:00 en adelante): departure_time es la hora GTFS,
+    relativa a service_date.
+    """
+    data = GTFS_DATA
+    sidx = data.stop_index.get(stop_id)
+    if sidx is None or stop_id not in data.stops:
+        raise KeyError(f"Stop not found: {stop_id}")
+    lo = int(data.stop_dep_offsets[sidx])
+    hi = int(data.stop_dep_offsets[sidx + 1])
+
+    candidates = []
+    for day_offset in (1, 0):
+        service_date = for_date - timedelta(days=day_offset)
+        positions = _active_stop_departures(
+            lo, hi, from_s + day_offset * _DAY_S, active_services(service_date), limit
+        )
+        for pos in positions.tolist():
+            seconds = int(data.stop_dep_seconds[pos]) - day_offset * _DAY_S
+            candidates.append((seconds, -day_offset, pos, service_date))
+    candidates.sort()
+
+    departures: List[dict] = []
+    for _seconds, _day, pos, service_date in candidates[:limit]:
+        tidx = int(data.stop_dep_trips[pos])
+        route_id = data.route_ids[int(data.trip_route[tidx])]
+        headsign = int(data.trip_headsign[tidx])
+        direction = int(data.trip_direction[tidx])
+        departures.append(
+            {
+                "trip_id": data.trip_ids[tidx],
+                "route_id": route_id,
+                "route_short_name": data.routes.get(route_id, {}).get("short_name"),
+                "headsign": data.headsigns[headsign] if headsign >= 0 else None,
+                "direction_id": direction if direction >= 0 else None,
+                "service_date": service_date.isoformat(),
+                "departure_time": data.time_strings[int(data.stop_dep_times[pos])],
+            }
+        )
+    return departures
+
+
+# -----------------------
+# CLI
+# -----------------------
+
+def _build_snapshot_cli(gtfs_dir: Path) -> None:
+    t0 = time.perf_counter()
+    data = load_gtfs_data(gtfs_dir)
+    t_csv = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    path = write_snapshot(data, source_fingerprint(gtfs_dir), snapshot_path(gtfs_dir))
+    t_write = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    read_snapshot(path, source_fingerprint(gtfs_dir))
+    t_snapshot = time.perf_counter() - t0
+
+    print(f"Snapshot escrito en {path} ({path.stat().st_size / 2**20:.1f} MB)")
+    print(f"  carga CSV:      {t_csv * 1000:.0f} ms")
+    print(f"  escritura:      {t_write * 1000:.0f} ms")
+    print(f"  carga snapshot: {t_snapshot * 1000:.0f} ms")
+
+
+def _naive_stop_departures(stop_id: str, for_date: Date, from_s: int, limit: int) -> List[tuple]:
+    """stop_departures recorriendo todos los stop_times (referencia del bench)."""
+    data = GTFS_DATA
+    rows = np.flatnonzero(data.st_stop == data.stop_index[stop_id])
+    trips = np.searchsorted(data.trip_stop_offsets, rows, side="right") - 1
+    codes = np.where(data.st_departure[rows] >= 0, data.st_departure[rows], data.st_arrival[rows])
+    seconds = np.where(data.st_departure_s[rows] >= 0, data.st_departure_s[rows], data.st_arrival_s[rows])
+    boardable = (
+        (codes >= 0)
+        & (rows != data.trip_stop_offsets[trips + 1] - 1)
+        & (data.st_pickup_type[rows] != 1)
+    )
+    services = data.trip_service[trips]
+    found = []
+    for day_offset in (1, 0):
+        service_date = for_date - timedelta(days=day_offset)
+        active = np.ones(len(rows), dtype=bool)
+        with_service = services >= 0
+        active[with_service] = active_services(service_date)[services[with_service]]
+        mask = boardable & active & (seconds >= from_s + day_offset * _DAY_S)
+        for t, sec, code in zip(trips[mask].tolist(), seconds[mask].tolist(), codes[mask].tolist()):
+            found.append(
+                (sec - day_offset * _DAY_S, -day_offset, t, service_date.isoformat(), data.time_strings[code])
+            )
+    found.sort()
+    return [(data.trip_ids[t], day, time_str) for _s, _d, t, day, time_str in found[:limit]]
+
+
+def _departures_bench_cli(n: int, limit: int, day: Optional[Date], seed: int) -> None:
+    data = GTFS_DATA
+    data.warm_up()
+    if day is None:
+        # Un día en mitad del calendario del feed
+        day = Date.fromordinal(data.service_first_day + len(data.service_days) // 2)
+    rng = random.Random(seed)
+    stop_ids = list(data.stops)
+    queries = [(rng.choice(stop_ids), rng.randrange(0, _DAY_S)) for _ in range(n)]
+
+    def _timed(fn) -> Tuple[list, float, float]:
+        results, latencies = [], []
+        for stop_id, from_s in queries:
+            t0 = time.perf_counter()
+            results.append(fn(stop_id, day, from_s, limit))
+            latencies.append(time.perf_counter() - t0)
+        p50, p90 = (np.percentile(latencies, [50, 90]) * 1000).tolist()
+        return results, p50, p90
+
+    indexed, index_p50, index_p90 = _timed(stop_departures)
+    naive, naive_p50, naive_p90 = _timed(_naive_stop_departures)
+    mismatches = sum(
+        [(d["trip_id"], d["service_date"], d["departure_time"]) for d in a] != b
+        for a, b in zip(indexed, naive)
+    )
+    print(f"GTFS: {len(data.stops)} paradas, {len(data.trip_ids)} trips, {len(data.st_stop)} stop_times")
+    print(f"{n} consultas el {day.isoformat()} (limit={limit}):")
+    print(f"  índice por parada:       p50 {index_p50:.3f} ms, p90 {index_p90:.3f} ms")
+    print(f"  recorrido de stop_times: p50 {naive_p50:.3f} ms, p90 {naive_p90:.3f} ms")
+    print(f"  resultados distintos: {mismatches}")
+
+
+def _stops_bench_cli(sizes: List[int], n: int, seed: int) -> None:
+    """
+    Índice espacial de paradas sobre feeds sintéticos (solo stops.txt) de
+    cada tamaño; el área crece con el nº de paradas para mantener la
+    densidad, y los bbox son de ~1 km.
+    """
+    import tempfile
+
+    global GTFS_DATA
+    rng = random.Random(seed)
+
+    def _mean_us(fn, queries) -> float:
+        t0 = time.perf_counter()
+        for q in queries:
+            fn(*q)
+        return (time.perf_counter() - t0) / len(queries) * 1e6
+
+    print(f"{n} consultas por caso (media por consulta):")
+    print(f"  {'paradas':>8}  {'bbox recorrido':>14}  {'bbox índice':>11}  {'nearest k=10':>12}  {'within 500 m':>12}")
+    for size in sizes:
+        side = 0.06 * math.sqrt(size / 1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            with (Path(tmp) / "stops.txt").open("w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stop_id", "stop_name", "stop_lat", "stop_lon"])
+                for i in range(size):
+                    writer.writerow(
+                        [f"S{i}", f"Parada {i}", 39.8 + rng.random() * side, -4.1 + rng.random() * side]
+                    )
+            GTFS_DATA = LazyGtfsData(Path(tmp))
+            GTFS_DATA.ensure("stops")
+
+        points = [(39.8 + rng.random() * side, -4.1 + rng.random() * side) for _ in range(n)]
+        boxes = [((lat, lat + 0.01, lon, lon + 0.012),) for lat, lon in points]
+        stops = list(GTFS_DATA.stops.values())
+
+        def scan(bbox):
+            min_lat, max_lat, min_lon, max_lon = bbox
+            return [
+                s for s in stops
+                if min_lat <= s["lat"] <= max_lat and min_lon <= s["lon"] <= max_lon
+            ]
+
+        # El recorrido completo es lento con muchas paradas: basta una muestra
+        t_scan = _mean_us(scan, boxes[: max(n // 10, 1)])
+        t_bbox = _mean_us(lambda bbox: list_stops(bbox=bbox), boxes)
+        t_nearest = _mean_us(lambda lat, lon: nearest(lat, lon, 10), points)
+        t_within = _mean_us(lambda lat, lon: within_radius(lat, lon, 500.0), points)
+        mismatches = sum(list_stops(bbox=b) != scan(b) for (b,) in boxes[: max(n // 10, 1)])
+        print(
+            f"  {size:>8}  {t_scan:>11.0f} us  {t_bbox:>8.0f} us  {t_nearest:>9.0f} us  {t_within:>9.0f} us"
+            + (f"  ({mismatches} bbox distintos)" if mismatches else "")
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.services.gtfs_loader")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser(
+        "build-snapshot", help="Compila el GTFS a un snapshot binario mmap-able"
+    )
+    build.add_argument("--gtfs-dir", type=Path, default=DEFAULT_GTFS_DIR)
+    bench = sub.add_parser(
+        "departures-bench",
+        help="Compara /stops/{id}/departures (índice) con un recorrido de todos los stop_times",
+    )
+    bench.add_argument("-n", type=int, default=1000)
+    bench.add_argument("--limit", type=int, default=20)
+    bench.add_argument("--date", default=None, help="YYYY-MM-DD (por defecto, mitad del calendario)")
+    bench.add_argument("--seed", type=int, default=1)
+    stops_bench = sub.add_parser(
+        "stops-bench",
+        help="bbox, nearest y within con el índice espacial, sobre feeds sintéticos de 1000 a 100000 paradas",
+    )
+    stops_bench.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    stops_bench.add_argument("-n", type=int, default=1000)
+    stops_bench.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "build-snapshot":
+        _build_snapshot_cli(args.gtfs_dir)
+    elif args.command == "departures-bench":
+        day_arg = Date.fromisoformat(args.date) if args.date else None
+        _departures_bench_cli(args.n, args.limit, day_arg, args.seed)
+    elif args.command == "stops-bench":
+        _stops_bench_cli(args.sizes, args.n, args.seed)
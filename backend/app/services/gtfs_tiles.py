@@ -0,0 +1,211 @@
+# backend/app/services/gtfs_tiles.py
+
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services import fast_json, geometry
+from app.services.gtfs_loader import GTFS_DATA, stops_in_bbox, dataset_version
+
+# Teselas XYZ (las de Leaflet/OSM, 256 px) con las paradas y los shapes del
+# GTFS cargado, en JSON compacto: el mapa pide solo lo que se ve en lugar de
+# /stops?limit=5000 y los shapes línea a línea.
+#
+# - Los shapes se simplifican una vez por zoom (Douglas-Peucker a la
+#   tolerancia de GEOMETRY_SIMPLIFY_PX a ese zoom) y se recortan a la
+#   tesela más un margen de TILE_BUFFER_PX. Cada trozo va como polyline
+#   (5 decimales).
+# - Por debajo de TILE_ALL_STOPS_ZOOM se deja una parada por celda de
+#   TILE_STOP_SPACING_PX píxeles: la que más líneas tiene.
+# - Las teselas se generan bajo demanda y se guardan ya serializadas, por
+#   versión del GTFS (las últimas TILE_CACHE_SIZE).
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", "4096"))
+TILE_BUFFER_PX = float(os.environ.get("TILE_BUFFER_PX", "8"))
+TILE_STOP_SPACING_PX = float(os.environ.get("TILE_STOP_SPACING_PX", "24"))
+TILE_ALL_STOPS_ZOOM = int(os.environ.get("TILE_ALL_STOPS_ZOOM", "15"))
+TILE_MAX_ZOOM = 22
+
+_TILE_PX = 256
+
+
+def _tile_lat(z: int, y: float) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / 2**z))))
+
+
+def tile_bounds(z: int, x: int, y: int, buffer_px: float = 0.0) -> Tuple[float, float, float, float]:
+    """(min_lat, max_lat, min_lon, max_lon) de la tesela, con un margen en píxeles."""
+    b = buffer_px / _TILE_PX
+    n = 2**z
+    return (
+        _tile_lat(z, y + 1 + b),
+        _tile_lat(z, y - b),
+        (x - b) / n * 360.0 - 180.0,
+        (x + 1 + b) / n * 360.0 - 180.0,
+    )
+
+
+def _world_px(lat: np.ndarray, lon: np.ndarray, z: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Coordenadas en píxeles (Web Mercator) a un zoom."""
+    scale = _TILE_PX * 2.0**z
+    s = np.sin(np.radians(lat))
+    return (
+        (lon + 180.0) / 360.0 * scale,
+        (0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)) * scale,
+    )
+
+
+@lru_cache(maxsize=2)
+def _stop_rank(version: str) -> np.ndarray:
+    """Nº de líneas por parada (para elegir cuál se queda al aclarar)."""
+    data = GTFS_DATA
+    return np.array(
+        [len(data.stop_routes.get(data.stop_ids[i], ())) for i in range(len(data.stop_lat))],
+        dtype=np.int32,
+    )
+
+
+@lru_cache(maxsize=2 * (TILE_MAX_ZOOM + 1))
+def _visible_stops(version: str, z: int) -> np.ndarray:
+    """Máscara (por índice de parada) de las paradas que se dibujan a zoom z."""
+    data = GTFS_DATA
+    n = len(data.stop_lat)
+    if z >= TILE_ALL_STOPS_ZOOM:
+        return np.ones(n, dtype=bool)
+    px, py = _world_px(data.stop_lat, data.stop_lon, z)
+    cols = math.ceil(_TILE_PX * 2**z / TILE_STOP_SPACING_PX) + 1
+    cell = (py // TILE_STOP_SPACING_PX).astype(np.int64) * cols + (px // TILE_STOP_SPACING_PX).astype(np.int64)
+    # Por celda, la parada con más líneas (y, a igualdad, la primera)
+    order = np.lexsort((np.arange(n), -_stop_rank(version), cell))
+    first = np.r_[True, cell[order[1:]] != cell[order[:-1]]]
+    visible = np.zeros(n, dtype=bool)
+    visible[order[first]] = True
+    return visible
+
+
+@dataclass
+class _ShapeLayer:
+    shape_ids: List[str]
+    route_ids: List[str]
+    # Puntos simplificados de todos los shapes, concatenados (CSR por shape)
+    offsets: np.ndarray  # int64, len(shape_ids) + 1
+    coords: np.ndarray  # (n, 2) lat, lon
+    bbox: np.ndarray  # (len(shape_ids), 4) min_lat, max_lat, min_lon, max_lon
+
+
+@lru_cache(maxsize=2 * (TILE_MAX_ZOOM + 1))
+def _shape_layer(version: str, z: int) -> _ShapeLayer:
+    """Shapes usados por algún trip (con su ruta), simplificados para zoom z."""
+    data = GTFS_DATA
+    with_shape = data.trip_shape >= 0
+    shapes, first = np.unique(data.trip_shape[with_shape], return_index=True)
+    routes = data.trip_route[with_shape][first]
+    lo = data.shape_offsets[shapes]
+    hi = data.shape_offsets[shapes + 1]
+    drawable = hi - lo >= 2
+    shapes, routes, lo, hi = shapes[drawable], routes[drawable], lo[drawable], hi[drawable]
+
+    # Todos los shapes en una sola simplificación, con sus extremos fijos
+    sizes = hi - lo
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    idx = np.repeat(lo - starts[:-1], sizes) + np.arange(starts[-1])
+    coords = np.column_stack((data.shape_lat[idx], data.shape_lon[idx]))
+    fixed = np.zeros(len(coords), dtype=bool)
+    fixed[starts[:-1]] = True
+    fixed[starts[1:] - 1] = True
+    if len(coords):
+        tolerance = geometry.zoom_tolerance_m(z, float(coords[:, 0].mean()))
+        keep = geometry.simplify_mask(coords, tolerance, fixed)
+    else:
+        keep = fixed
+    coords = coords[keep]
+    offsets = np.concatenate(([0], np.cumsum(np.add.reduceat(keep, starts[:-1]) if len(sizes) else [])))
+    offsets = offsets.astype(np.int64)
+
+    bbox = np.empty((len(shapes), 4))
+    if len(shapes):
+        bbox[:, 0] = np.minimum.reduceat(coords[:, 0], offsets[:-1])
+        bbox[:, 1] = np.maximum.reduceat(coords[:, 0], offsets[:-1])
+        bbox[:, 2] = np.minimum.reduceat(coords[:, 1], offsets[:-1])
+        bbox[:, 3] = np.maximum.reduceat(coords[:, 1], offsets[:-1])
+    return _ShapeLayer(
+        shape_ids=[data.shape_ids[i] for i in shapes.tolist()],
+        route_ids=[data.route_ids[i] for i in routes.tolist()],
+        offsets=offsets,
+        coords=coords,
+        bbox=bbox,
+    )
+
+
+def _clipped_shapes(
+    layer: _ShapeLayer, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+) -> List[dict]:
+    """
+    Trozos de cada shape con segmentos que tocan el bbox. Se comprueba el
+    bbox de cada segmento: sobra algo en diagonal, pero no se pierde ninguno.
+    """
+    b = layer.bbox
+    cand = np.flatnonzero(
+        (b[:, 0] <= max_lat) & (b[:, 1] >= min_lat) & (b[:, 2] <= max_lon) & (b[:, 3] >= min_lon)
+    )
+    if not len(cand):
+        return []
+    # Segmentos (punto k -> k + 1) de los shapes candidatos
+    lo, hi = layer.offsets[cand], layer.offsets[cand + 1] - 1
+    starts = np.concatenate(([0], np.cumsum(hi - lo)))
+    seg = np.repeat(lo - starts[:-1], hi - lo) + np.arange(starts[-1])
+    lat, lon = layer.coords[:, 0], layer.coords[:, 1]
+    hit = (
+        (np.minimum(lat[seg], lat[seg + 1]) <= max_lat)
+        & (np.maximum(lat[seg], lat[seg + 1]) >= min_lat)
+        & (np.minimum(lon[seg], lon[seg + 1]) <= max_lon)
+        & (np.maximum(lon[seg], lon[seg + 1]) >= min_lon)
+    )
+    # Tramos de segmentos seguidos que tocan el bbox, sin pasar de un shape
+    # al siguiente
+    first_seg = np.zeros(len(seg), dtype=bool)
+    first_seg[starts[:-1]] = True
+    last_seg = np.zeros(len(seg), dtype=bool)
+    last_seg[starts[1:] - 1] = True
+    run_start = np.flatnonzero(hit & (first_seg | ~np.r_[False, hit[:-1]]))
+    run_end = np.flatnonzero(hit & (last_seg | ~np.r_[hit[1:], False]))
+    owner = cand[np.searchsorted(starts, run_start, side="right") - 1]
+
+    shapes: List[dict] = []
+    by_shape: dict = {}
+    for c, s, e in zip(owner.tolist(), seg[run_start].tolist(), seg[run_end].tolist()):
+        if c not in by_shape:
+            by_shape[c] = {"shape_id": layer.shape_ids[c], "route_id": layer.route_ids[c], "paths": []}
+            shapes.append(by_shape[c])
+        by_shape[c]["paths"].append(geometry.encode_polyline(layer.coords[s : e + 2]))
+    return shapes
+
+
+def _render(version: str, z: int, x: int, y: int) -> dict:
+    data = GTFS_DATA
+    min_lat, max_lat, min_lon, max_lon = tile_bounds(z, x, y, TILE_BUFFER_PX)
+
+    idx = stops_in_bbox(data, min_lat, max_lat, min_lon, max_lon)
+    idx = idx[_visible_stops(version, z)[idx]]
+    stops = []
+    for i in idx.tolist():
+        s = data.stops[data.stop_ids[i]]
+        stops.append({"id": s["stop_id"], "name": s["name"], "lat": float(s["lat"]), "lon": float(s["lon"])})
+
+    shapes = _clipped_shapes(_shape_layer(version, z), min_lat, max_lat, min_lon, max_lon)
+    return {"stops": stops, "shapes": shapes}
+
+
+@lru_cache(maxsize=TILE_CACHE_SIZE)
+def _tile(version: str, z: int, x: int, y: int) -> bytes:
+    return fast_json.dumps(_render(version, z, x, y))
+
+
+def tile(z: int, x: int, y: int) -> bytes:
+    """JSON de la tesela z/x/y del GTFS cargado."""
+    return _tile(dataset_version(), z, x, y)
@@ -0,0 +1,280 @@
+# backend/app/services/http_cache.py
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.services.fast_json import FastJSONResponse
+
+# Caché HTTP para respuestas que solo cambian cuando cambian sus datos de
+# origen (p. ej. el GTFS cargado):
+#
+# - ETag fuerte a partir de la versión de los datos y de la petición, sin
+#   mirar el cuerpo, y Last-Modified con la fecha de esa versión. Si el
+#   cliente ya tiene la respuesta se devuelve 304 antes de generar ni
+#   serializar nada.
+# - Cache-Control: no-cache, para que el navegador revalide siempre.
+# - Cuerpos de más de HTTP_COMPRESS_MIN_BYTES comprimidos con brotli (si
+#   está instalado y el cliente lo acepta) o gzip. Cada codificación tiene
+#   su propio ETag (sufijo -br / -gzip). Los cuerpos comprimidos se guardan
+#   (hasta HTTP_COMPRESS_CACHE_MB) para no recomprimir en cada petición.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_COMPRESS_CACHE_MB = float(os.environ.get("HTTP_COMPRESS_CACHE_MB", "64"))
+HTTP_GZIP_LEVEL = int(os.environ.get("HTTP_GZIP_LEVEL", "6"))
+HTTP_BROTLI_QUALITY = int(os.environ.get("HTTP_BROTLI_QUALITY", "5"))
+
+_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+class _EncodedBodies:
+    """LRU (por bytes) de cuerpos comprimidos, por (etag, codificación)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key: Tuple[str, str], body: bytes) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+_ENCODED = _EncodedBodies(int(HTTP_COMPRESS_CACHE_MB * 1024 * 1024))
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+def _accepted_encoding(header: str) -> Optional[str]:
+    """La codificación preferida (según _ENCODINGS) entre las que acepta el cliente."""
+    accepted: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in _ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _matching_tag(request: Request, tag: str) -> Optional[str]:
+    """
+    El ETag de If-None-Match que corresponde a `tag` (en cualquier
+    codificación), o None. Comparación débil, como pide RFC 9110 para
+    If-None-Match.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return f'"{tag}"'
+        opaque = candidate.removeprefix("W/").strip('"')
+        if opaque == tag or opaque in (f"{tag}-{e}" for e in ("br", "gzip")):
+            return candidate
+    return None
+
+
+def _not_modified_since(request: Request, last_modified: Optional[float]) -> bool:
+    header = request.headers.get("if-modified-since")
+    if last_modified is None or not header or "if-none-match" in request.headers:
+        return False
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(last_modified) <= since
+
+
+def cached_json(
+    request: Request,
+    version: str,
+    key: Hashable,
+    render: Callable[[], bytes],
+    last_modified: Optional[float] = None,
+    cache_body: bool = True,
+) -> Response:
+    """
+    Respuesta JSON con ETag/Last-Modified, 304 y compresión.
+
+    `version` es la versión de los datos de origen y `key` todo lo demás de
+    lo que depende el cuerpo (ruta, parámetros...). `render` devuelve el
+    JSON ya serializado y solo se llama si hace falta enviarlo.
+
+    Si el cuerpo depende de algo más que los datos (p. ej. de la hora
+    actual), `last_modified` debe ser None: sin Last-Modified ni
+    If-Modified-Since, solo el ETag (con esa hora en `key`) decide el 304.
+    Con `cache_body=False` el cuerpo comprimido no se guarda (respuestas de
+    un solo uso).
+    """
+    tag = hashlib.sha1(repr((version, key)).encode("utf-8")).hexdigest()[:32]
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    matched = _matching_tag(request, tag)
+    if matched is not None or _not_modified_since(request, last_modified):
+        headers["ETag"] = matched or f'"{tag}"'
+        return Response(status_code=304, headers=headers)
+
+    encoding = _accepted_encoding(request.headers.get("accept-encoding", ""))
+    body = _ENCODED.get((tag, encoding)) if encoding else None
+    if body is None:
+        body = render()
+        if encoding and len(body) >= HTTP_COMPRESS_MIN_BYTES:
+            body = _compress(body, encoding)
+            if cache_body:
+                _ENCODED.set((tag, encoding), body)
+        else:
+            encoding = None
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = f'"{tag}-{encoding}"'
+    else:
+        headers["ETag"] = f'"{tag}"'
+    return FastJSONResponse(body, headers=headers)
+
+
+# -----------------------
+# CLI: benchmark de una carga de página
+# -----------------------
+# bench: bytes enviados y CPU del servidor por "página" (lista de paradas
+# completa, rutas, detalle y horario de una ruta) llamando a la app ASGI
+# directamente: sin compresión, con gzip/br y revalidando (304).
+
+async def _asgi_get(app, url: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], int]:
+    """GET directo a la app ASGI: (status, cabeceras, bytes del cuerpo)."""
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()] + [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+    out = {"status": 0, "headers": {}, "bytes": 0}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+            out["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            out["bytes"] += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return out["status"], out["headers"], out["bytes"]
+
+
+async def _bench(n: int, day: str) -> None:
+    import time
+
+    from app.main import app
+    from app.services import gtfs_loader
+
+    data = gtfs_loader.GTFS_DATA
+    gtfs_loader.warm_up()
+    route_id = next(iter(data.routes))
+    page = [
+        f"/api/gtfs/stops?limit={len(data.stop_ids)}",
+        "/api/gtfs/routes",
+        f"/api/gtfs/routes/{route_id}",
+        f"/api/gtfs/routes/{route_id}/schedule?date={day}",
+    ]
+
+    async def load(headers_for) -> list:
+        return [(url, *await _asgi_get(app, url, headers_for(url))) for url in page]
+
+    async def measure(label: str, headers_for) -> list:
+        await load(headers_for)
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        for _ in range(n):
+            results = await load(headers_for)
+        cpu = (time.process_time() - cpu0) / n * 1000
+        wall = (time.perf_counter() - wall0) / n * 1000
+        total = sum(size for _url, _status, _headers, size in results)
+        statuses = [status for _url, status, _headers, _size in results]
+        print(f"  {label:<30} {total / 1000:8.1f} kB  CPU {cpu:5.2f} ms/página  ({wall:5.2f} ms)  {statuses}")
+        return results
+
+    t0 = time.perf_counter()
+    await _asgi_get(app, page[0], {"accept-encoding": "gzip"})
+    first_gzip = (time.perf_counter() - t0) * 1000
+    print(f"{len(data.stop_ids)} paradas, {n} cargas de página ({', '.join(page)})")
+    await measure("sin compresión", lambda url: {"accept-encoding": "identity"})
+    compressed = await measure("Accept-Encoding: gzip, br", lambda url: {"accept-encoding": "gzip, deflate, br"})
+    tags = {url: headers.get("etag", "") for url, _status, headers, _size in compressed}
+    dates = {url: headers.get("last-modified", "") for url, _status, headers, _size in compressed}
+    await measure(
+        "If-None-Match (304)",
+        lambda url: {"accept-encoding": "gzip, deflate, br", "if-none-match": tags[url]},
+    )
+    await measure(
+        "If-Modified-Since (304)",
+        lambda url: {"accept-encoding": "gzip, deflate, br", "if-modified-since": dates[url]},
+    )
+    print(f"  primera petición comprimida de {page[0]} (genera y comprime): {first_gzip:.0f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from datetime import date
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.http_cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Bytes y CPU por carga de página: identity, gzip/br y 304")
+    bench.add_argument("-n", type=int, default=200)
+    bench.add_argument("--date", default=date.today().isoformat(), help="Fecha del horario (YYYY-MM-DD)")
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        asyncio.run(_bench(args.n, args.date))
@@ -0,0 +1,100 @@
+# backend/app/services/http_clients.py
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Dict
+
+import httpx
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+@dataclass(frozen=True)
+class BackendConfig:
+    timeout_s: float
+    max_connections: int
+    max_keepalive: int
+
+
+# Un cliente por backend (cada perfil OSRM es una instancia distinta).
+# Todo se puede ajustar por variable de entorno, p. ej. OSRM_DRIVING_TIMEOUT_S
+# u OTP_MAX_CONNECTIONS.
+BACKENDS: Dict[str, BackendConfig] = {
+    name: BackendConfig(
+        timeout_s=_env_float(f"{prefix}_TIMEOUT_S", timeout),
+        max_connections=_env_int(f"{prefix}_MAX_CONNECTIONS", 50),
+        max_keepalive=_env_int(f"{prefix}_MAX_KEEPALIVE", 20),
+    )
+    for name, prefix, timeout in (
+        ("osrm-driving", "OSRM_DRIVING", 10.0),
+        ("osrm-cycling", "OSRM_CYCLING", 10.0),
+        ("osrm-foot", "OSRM_FOOT", 10.0),
+        ("otp", "OTP", 20.0),
+    )
+}
+
+# HTTP/2 solo si se pide y está instalado `h2` (pip install "httpx[http2]").
+# Solo se negocia sobre TLS, así que es útil con backends remotos (https).
+HTTP2_ENABLED = os.environ.get("HTTP2", "0") == "1"
+
+_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    cfg = BACKENDS[name]
+    return httpx.AsyncClient(
+        timeout=cfg.timeout_s,
+        limits=httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive,
+            keepalive_expiry=30.0,
+        ),
+        http2=_http2_available(),
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Cliente compartido (pool de conexiones keep-alive) para un backend.
+
+    Normalmente los crea start() en el lifespan de la app; si se llama fuera
+    de la app (scripts, consola) se crea bajo demanda.
+    """
+    client = _CLIENTS.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _CLIENTS[name] = client
+    return client
+
+
+def osrm_client_name(profile: str) -> str:
+    return f"osrm-{profile}"
+
+
+async def start() -> None:
+    for name in BACKENDS:
+        get_client(name)
+
+
+async def close() -> None:
+    while _CLIENTS:
+        _name, client = _CLIENTS.popitem()
+        await client.aclose()
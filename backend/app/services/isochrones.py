@@ -0,0 +1,297 @@
+# backend/app/services/isochrones.py
+
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services import raptor
+from app.services.gtfs_loader import GTFS_DATA, haversine_m, METERS_PER_DEGREE
+from app.services.raptor import INF
+
+# Isócronas y accesibilidad en transporte público a partir de RAPTOR.
+#
+# Cada par (origen, hora de salida) es una fila de una búsqueda RAPTOR
+# vectorizada (raptor.earliest_arrivals), así que un barrido de todo el
+# día cada minuto, o una rejilla de orígenes para un mapa de calor, se
+# resuelve en unas pocas llamadas NumPy por bloque de filas en lugar de
+# cientos de consultas /plan.
+#
+# Las paradas llevan su etiqueta RAPTOR: llegada en vehículo, a pie tras
+# bajar en otra parada a menos de RAPTOR_TRANSFER_M, o a pie desde el
+# origen. Las celdas de la rejilla se miden como en raptor.plan(): bajar en
+# alguna parada a menos de RAPTOR_ACCESS_M y caminar, o ir a pie desde el
+# origen si el trayecto no supera RAPTOR_MAX_WALK_M. Como allí, también se
+# busca en los trips del día de servicio anterior que pasan de medianoche
+# (otra búsqueda con las horas desplazadas 24 h) y se toma el mínimo.
+ISOCHRONE_BLOCK_SIZE = int(os.environ.get("ISOCHRONE_BLOCK_SIZE", "4000000"))  # filas x columnas por bloque
+ISOCHRONE_MAX_ROWS = int(os.environ.get("ISOCHRONE_MAX_ROWS", "20000"))  # orígenes x horas de salida
+
+_DAY_S = 24 * 3600
+
+
+@dataclass
+class _Targets:
+    """Puntos de destino (paradas o celdas) y tramos a pie parada -> destino."""
+
+    lat: np.ndarray  # float64
+    lon: np.ndarray  # float64
+    # Tramos a pie agrupados por destino; pair_targets / pair_starts:
+    # destinos con alguna parada cerca y dónde empiezan sus tramos
+    pair_stop: np.ndarray  # int64 -> stop_ids
+    pair_s: np.ndarray  # int32
+    pair_targets: np.ndarray  # int64
+    pair_starts: np.ndarray  # int64
+
+
+@dataclass
+class _Grid:
+    """Rejilla regular (celdas de cell_m metros) sobre la zona de las paradas."""
+
+    south: float
+    west: float
+    lat_step: float
+    lon_step: float
+    rows: int
+    cols: int
+    cell_m: float
+    targets: _Targets  # centros de celda, fila a fila desde el sur
+
+
+def _egress(lat: np.ndarray, lon: np.ndarray) -> _Targets:
+    data = GTFS_DATA
+    stop_parts, s_parts, counts = [], [], []
+    for t in range(len(lat)):
+        stops, walk_s = raptor.nearby_stops(data, float(lat[t]), float(lon[t]), raptor.RAPTOR_ACCESS_M)
+        stop_parts.append(stops)
+        s_parts.append(walk_s)
+        counts.append(len(stops))
+    counts_arr = np.array(counts, dtype=np.int64)
+    offsets = np.zeros(len(counts_arr) + 1, dtype=np.int64)
+    np.cumsum(counts_arr, out=offsets[1:])
+    with_stops = np.flatnonzero(counts_arr > 0)
+    return _Targets(
+        lat=np.asarray(lat, dtype=np.float64),
+        lon=np.asarray(lon, dtype=np.float64),
+        pair_stop=np.concatenate(stop_parts) if stop_parts else np.zeros(0, dtype=np.int64),
+        pair_s=(np.concatenate(s_parts) if s_parts else np.zeros(0)).astype(np.int32),
+        pair_targets=with_stops.astype(np.int64),
+        pair_starts=offsets[with_stops],
+    )
+
+
+@lru_cache(maxsize=1)
+def _stop_targets() -> _Targets:
+    """Cada parada desde sí misma y desde los transbordos a pie de la red RAPTOR."""
+    data = GTFS_DATA
+    net = raptor.network()
+    n_located = len(data.stop_lat)
+    located = np.arange(n_located, dtype=np.int64)
+    keep = net.fp_to < n_located
+    pair_stop = np.concatenate([located, net.fp_from[keep]])
+    pair_to = np.concatenate([located, net.fp_to[keep]])
+    pair_s = np.concatenate([np.zeros(n_located, dtype=np.int64), net.fp_s[keep]])
+    order = np.argsort(pair_to, kind="stable")
+    pair_to = pair_to[order]
+    starts = np.flatnonzero(np.r_[True, pair_to[1:] != pair_to[:-1]]) if len(pair_to) else pair_to[:0]
+    return _Targets(
+        lat=data.stop_lat,
+        lon=data.stop_lon,
+        pair_stop=pair_stop[order],
+        pair_s=pair_s[order].astype(np.int32),
+        pair_targets=pair_to[starts],
+        pair_starts=starts.astype(np.int64),
+    )
+
+
+@lru_cache(maxsize=8)
+def _grid(cell_m: float) -> _Grid:
+    data = GTFS_DATA
+    pad = raptor.RAPTOR_ACCESS_M
+    lat_step = cell_m / METERS_PER_DEGREE
+    if len(data.stop_lat):
+        min_lat, max_lat = float(data.stop_lat.min()), float(data.stop_lat.max())
+        min_lon, max_lon = float(data.stop_lon.min()), float(data.stop_lon.max())
+    else:
+        min_lat = max_lat = min_lon = max_lon = 0.0
+    cos_lat = max(math.cos(math.radians((min_lat + max_lat) / 2)), 1e-6)
+    lon_step = lat_step / cos_lat
+    south = min_lat - pad / METERS_PER_DEGREE
+    west = min_lon - pad / (METERS_PER_DEGREE * cos_lat)
+    rows = int(math.ceil((max_lat + pad / METERS_PER_DEGREE - south) / lat_step))
+    cols = int(math.ceil((max_lon + pad / (METERS_PER_DEGREE * cos_lat) - west) / lon_step))
+
+    iy, ix = np.divmod(np.arange(rows * cols, dtype=np.int64), cols)
+    return _Grid(
+        south=south,
+        west=west,
+        lat_step=lat_step,
+        lon_step=lon_step,
+        rows=rows,
+        cols=cols,
+        cell_m=cell_m,
+        targets=_egress(south + (iy + 0.5) * lat_step, west + (ix + 0.5) * lon_step),
+    )
+
+
+def _direct_walk_s(targets: _Targets, lat: float, lon: float) -> np.ndarray:
+    """Segundos a pie desde el origen a cada destino (INF si supera RAPTOR_MAX_WALK_M)."""
+    meters = haversine_m(lat, lon, targets.lat, targets.lon)
+    walk_s = np.ceil(raptor.walk_seconds(meters))
+    return np.where(meters * raptor.RAPTOR_WALK_DETOUR <= raptor.RAPTOR_MAX_WALK_M, walk_s, INF).astype(np.int64)
+
+
+def _target_arrivals(targets: _Targets, by_stop: np.ndarray, direct: np.ndarray) -> np.ndarray:
+    """
+    Llegada a cada destino por fila: desde la mejor parada de bajada o a pie
+    desde el origen. `by_stop` son las llegadas en vehículo por parada
+    (n_paradas, n_filas) en int32: cada tramo copia y reduce una fila
+    contigua, y en int32 se mueve la mitad de memoria (las horas < INF
+    caben de sobra).
+    """
+    out = direct.copy()
+    if len(targets.pair_targets):
+        best = np.minimum.reduceat(by_stop[targets.pair_stop] + targets.pair_s[:, None], targets.pair_starts, axis=0)
+        out[:, targets.pair_targets] = np.minimum(out[:, targets.pair_targets], best.T)
+    return out
+
+
+def _percentile(travel: np.ndarray, q: float) -> np.ndarray:
+    """Percentil por columna sin interpolar (las filas INF cuentan como no alcanzadas)."""
+    return np.quantile(travel, q / 100.0, axis=0, method="higher")
+
+
+def _summarize(travel: np.ndarray, max_s: int, percentile: float) -> dict:
+    """Resumen a lo largo de las horas de salida: percentil, mínimo, máximo y fracción <= max_s."""
+    within = travel <= max_s
+    return {
+        "travel_s": _percentile(travel, percentile),
+        "min_s": travel.min(axis=0),
+        "max_s": travel.max(axis=0),
+        "share": within.mean(axis=0),
+        "per_departure": within.sum(axis=1),
+    }
+
+
+def isochrones(
+    origins: List[Tuple[float, float]],
+    when: datetime,
+    window_s: int = 0,
+    step_s: int = 60,
+    max_s: int = 1800,
+    percentile: float = 50.0,
+    max_transfers: Optional[int] = None,
+    cell_m: float = 250.0,
+) -> dict:
+    """
+    Tiempos de viaje en transporte público (más acceso y egreso a pie) desde
+    cada origen (lat, lon) a todas las paradas y a una rejilla de celdas de
+    `cell_m` metros, para las salidas de `when` a `when + window_s` cada
+    `step_s` segundos (una sola salida si window_s es 0).
+
+    Por origen, `stops` y `cells` resumen las salidas: `travel_s` es el
+    percentil `percentile` del tiempo de viaje (INF si no se alcanza),
+    `min_s` / `max_s` los extremos y `share` la fracción de salidas que
+    llegan en `max_s` o menos. `profile_stops` / `profile_cells` cuentan, por
+    salida, las paradas y celdas alcanzadas en `max_s`.
+    """
+    data = GTFS_DATA
+    net = raptor.network()
+    service_day = when.date()
+    day = raptor.service_day_network(service_day)
+    grid = _grid(float(cell_m))
+    kinds = {"stops": _stop_targets(), "cells": grid.targets}
+
+    t0 = when.hour * 3600 + when.minute * 60 + when.second
+    departs = np.arange(t0, t0 + max(window_s, 1), step_s, dtype=np.int64)
+    n_dep = len(departs)
+    # (red, desplazamiento): el día anterior solo si tiene trips después de
+    # la primera salida desplazada 24 h
+    searches = [(day, 0)]
+    prev = raptor.service_day_network(service_day - timedelta(days=1))
+    if prev.last_dep >= t0 + _DAY_S:
+        searches.append((prev, _DAY_S))
+    rounds = (raptor.RAPTOR_MAX_TRANSFERS if max_transfers is None else max_transfers) + 1
+
+    access = [raptor.nearby_stops(data, lat, lon, raptor.RAPTOR_ACCESS_M) for lat, lon in origins]
+    direct = {
+        kind: [_direct_walk_s(targets, lat, lon) for lat, lon in origins] for kind, targets in kinds.items()
+    }
+
+    # Filas (origen, salida), con las salidas de cada origen de la más tardía
+    # a la más temprana: las llegadas de la última fila de un origen acotan
+    # las de su siguiente bloque (range RAPTOR). Cada bloque cabe en
+    # ISOCHRONE_BLOCK_SIZE.
+    width = max(
+        *(len(network.pos_stop) for network, _shift in searches),
+        len(net.fp_from),
+        *(len(targets.pair_stop) for targets in kinds.values()),
+        1,
+    )
+    block = max(1, ISOCHRONE_BLOCK_SIZE // width)
+    row_origin = np.repeat(np.arange(len(origins)), n_dep)
+    row_dep = np.tile(np.arange(n_dep)[::-1], len(origins))
+
+    results: List[dict] = []
+    travel: dict = {}
+    # (búsqueda, origen) -> llegadas por ronda de su última salida calculada
+    later: dict = {}
+    for lo in range(0, len(row_origin), block):
+        hi = min(lo + block, len(row_origin))
+        rows_o, rows_d = row_origin[lo:hi].tolist(), row_dep[lo:hi]
+        start = np.full((len(data.stop_ids), hi - lo), INF, dtype=np.int64)
+        for i, (o, d) in enumerate(zip(rows_o, rows_d.tolist())):
+            stops, walk_s = access[o]
+            np.minimum.at(start[:, i], stops, departs[d] + walk_s)
+        by_stop = None
+        for k, (network, shift) in enumerate(searches):
+            bounds = None
+            for i, o in enumerate(rows_o):
+                if (k, o) in later:
+                    if bounds is None:
+                        bounds = np.full((rounds, len(data.stop_ids), hi - lo), INF, dtype=np.int64)
+                    bounds[:, :, i] = later[(k, o)]
+            shifted = np.where(start < INF, start + shift, INF) if shift else start
+            by_round = raptor.earliest_arrivals(network, net, shifted, rounds, bounds)
+            for i, o in enumerate(rows_o):
+                later[(k, o)] = by_round[:, :, i]
+            arrivals = by_round[-1]
+            if shift:
+                arrivals = np.where(arrivals < INF, arrivals - shift, INF)
+            by_stop = arrivals if by_stop is None else np.minimum(by_stop, arrivals)
+        by_stop = by_stop.astype(np.int32)
+
+        block_travel = {}
+        for kind, targets in kinds.items():
+            walk = np.stack([direct[kind][o] for o in rows_o])
+            arrive = _target_arrivals(targets, by_stop, departs[rows_d][:, None] + walk)
+            block_travel[kind] = np.where(arrive < INF, arrive - departs[rows_d][:, None], INF)
+
+        for i, (o, d) in enumerate(zip(rows_o, rows_d.tolist())):
+            for kind, targets in kinds.items():
+                if d == n_dep - 1:
+                    travel[kind] = np.empty((n_dep, len(targets.lat)), dtype=np.int64)
+                travel[kind][d] = block_travel[kind][i]
+            if d == 0:
+                for k in range(len(searches)):
+                    later.pop((k, o), None)
+                summaries = {kind: _summarize(travel[kind], max_s, percentile) for kind in kinds}
+                results.append({
+                    "origin": origins[o],
+                    **summaries,
+                    "profile_stops": summaries["stops"].pop("per_departure"),
+                    "profile_cells": summaries["cells"].pop("per_departure"),
+                })
+
+    return {
+        "service_day": service_day,
+        "departures": departs,
+        "grid": grid,
+        "results": results,
+    }
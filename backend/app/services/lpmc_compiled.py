@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+# Bump when the .npz layout changes; older files are recompiled.
+COMPILED_FORMAT_VERSION = 1
+
+# Rows evaluated together by CompiledModel.predict_margin.
+PREDICT_BLOCK_ROWS = int(os.environ.get("LPMC_PREDICT_BLOCK_ROWS", "256"))
+
+_MULTICLASS_OBJECTIVES = ("multi:softprob", "multi:softmax")
+_BINARY_OBJECTIVES = ("binary:logistic", "reg:logistic")
+
+
+@dataclass
+class CompiledModel:
+    """
+    XGBoost classifier + StandardScaler flattened into NumPy arrays.
+
+    All trees share one node table. Leaves point to themselves, so a batch is
+    evaluated by stepping every (row, tree) pair max_depth times. The scaler
+    is folded into mean/scale vectors over the full feature row, so
+    predict_proba takes the raw (unscaled) feature matrix.
+    """
+
+    feature_names: list[str]
+    scaled_features: list[str]
+    mean: np.ndarray  # float64 (F,), 0 for unscaled columns
+    scale: np.ndarray  # float64 (F,), 1 for unscaled columns
+    roots: np.ndarray  # int32 (T,) global index of each tree's root
+    tree_class: np.ndarray  # int32 (T,) output class of each tree
+    split_feature: np.ndarray  # int32 (nodes,)
+    threshold: np.ndarray  # float32 (nodes,)
+    left: np.ndarray  # int32 (nodes,), self for leaves
+    right: np.ndarray  # int32 (nodes,), self for leaves
+    default_left: np.ndarray  # bool (nodes,), branch taken on NaN
+    leaf_value: np.ndarray  # float32 (nodes,), 0 for inner nodes
+    base_margin: np.ndarray  # float64 (K,)
+    max_depth: int
+    objective: str
+    source: str = ""
+
+    def __post_init__(self) -> None:
+        # children[2 * i] / children[2 * i + 1]: left / right child of node i.
+        self._children = np.stack([self.left, self.right], axis=1).ravel()
+        # (T, K) one-hot of each tree's class, to sum leaf values per class.
+        self._class_matrix = np.zeros((len(self.roots), len(self.base_margin)), dtype=np.float64)
+        self._class_matrix[np.arange(len(self.roots)), self.tree_class] = 1.0
+
+    @property
+    def n_classes(self) -> int:
+        return 2 if self.objective in _BINARY_OBJECTIVES else len(self.base_margin)
+
+    def transform(self, x: np.ndarray) -> np.ndarray:
+        """Same result as applying the fitted scaler to the scaled columns."""
+        return (np.asarray(x, dtype=np.float64) - self.mean) / self.scale
+
+    def predict_margin(self, x_scaled: np.ndarray) -> np.ndarray:
+        # XGBoost compares float32 feature values against float32 thresholds.
+        xf = np.ascontiguousarray(x_scaled, dtype=np.float32)
+        n, n_features = xf.shape
+        margin = np.empty((n, len(self.base_margin)), dtype=np.float64)
+        # Rows are processed in blocks so the (rows x trees) index arrays stay
+        # in cache; one block of PREDICT_BLOCK_ROWS rows is also the fast path
+        # for single-row requests.
+        for start in range(0, n, PREDICT_BLOCK_ROWS):
+            block = xf[start : start + PREDICT_BLOCK_ROWS]
+            margin[start : start + len(block)] = self._block_margin(block, n_features)
+        return margin
+
+    def _block_margin(self, xf: np.ndarray, n_features: int) -> np.ndarray:
+        flat = xf.ravel()
+        row_base = (np.arange(len(xf), dtype=np.int32) * n_features)[:, None]
+        has_nan = bool(np.isnan(flat).any())
+        node = np.broadcast_to(self.roots, (len(xf), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            v = flat[row_base + self.split_feature[node]]
+            # v >= threshold is False for NaN, which then follows default_left.
+            go_right = v >= self.threshold[node]
+            if has_nan:
+                go_right |= np.isnan(v) & ~self.default_left[node]
+            node = self._children[2 * node + go_right]
+        return self.leaf_value[node] @ self._class_matrix + self.base_margin
+
+    def predict_proba(self, x: np.ndarray) -> np.ndarray:
+        margin = self.predict_margin(self.transform(x))
+        if self.objective in _BINARY_OBJECTIVES:
+            p = 1.0 / (1.0 + np.exp(-margin[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        margin -= margin.max(axis=1, keepdims=True)
+        e = np.exp(margin)
+        return e / e.sum(axis=1, keepdims=True)
+
+    def save(self, path: Path) -> None:
+        meta = {
+            "version": COMPILED_FORMAT_VERSION,
+            "feature_names": self.feature_names,
+            "scaled_features": self.scaled_features,
+            "max_depth": self.max_depth,
+            "objective": self.objective,
+            "source": self.source,
+        }
+        tmp = Path(f"{path}.tmp.npz")
+        np.savez(
+            tmp,
+            meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+            mean=self.mean,
+            scale=self.scale,
+            roots=self.roots,
+            tree_class=self.tree_class,
+            split_feature=self.split_feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            default_left=self.default_left,
+            leaf_value=self.leaf_value,
+            base_margin=self.base_margin,
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CompiledModel":
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode())
+            if meta.get("version") != COMPILED_FORMAT_VERSION:
+                raise ValueError(f"Formato de modelo compilado no soportado: {path}")
+            arrays = {name: data[name] for name in data.files if name != "meta"}
+        return cls(
+            feature_names=meta["feature_names"],
+            scaled_features=meta["scaled_features"],
+            max_depth=meta["max_depth"],
+            objective=meta["objective"],
+            source=meta.get("source", ""),
+            **arrays,
+        )
+
+
+def source_fingerprint(model_path: Path, scaler_path: Path) -> str:
+    parts = []
+    for path in (model_path, scaler_path):
+        st = os.stat(path)
+        parts.append(f"{Path(path).resolve()}:{st.st_size}:{st.st_mtime_ns}")
+    return ";".join(parts)
+
+
+def _parse_base_score(raw: str) -> np.ndarray:
+    raw = raw.strip()
+    if raw.startswith("["):
+        return np.array([float(v) for v in raw.strip("[]").split(",")], dtype=np.float64)
+    return np.array([float(raw)], dtype=np.float64)
+
+
+def compile_model(
+    model,
+    feature_names: list[str],
+    scaler,
+    scaled_features: list[str],
+    source: str = "",
+) -> CompiledModel:
+    """Export a fitted XGBClassifier (gbtree) and StandardScaler to arrays."""
+    booster = model.get_booster()
+    dump = json.loads(booster.save_raw("json"))
+    learner = dump["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in _MULTICLASS_OBJECTIVES + _BINARY_OBJECTIVES:
+        raise ValueError(f"Objetivo XGBoost no soportado: {objective}")
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree":
+        raise ValueError(f"Booster XGBoost no soportado: {gbm['name']}")
+
+    trees = gbm["model"]["trees"]
+    tree_info = gbm["model"]["tree_info"]
+
+    # predict_proba in the sklearn wrapper stops at best_iteration when the
+    # model was trained with early stopping.
+    try:
+        best_iteration = model.best_iteration
+    except AttributeError:
+        best_iteration = None
+    if best_iteration is not None:
+        indptr = gbm["model"].get("iteration_indptr")
+        if indptr:
+            n_trees = int(indptr[best_iteration + 1])
+        else:
+            per_round = int(gbm["model"]["gbtree_model_param"]["num_parallel_tree"]) * max(
+                int(learner["learner_model_param"].get("num_class", "0")), 1
+            )
+            n_trees = (best_iteration + 1) * per_round
+        trees, tree_info = trees[:n_trees], tree_info[:n_trees]
+
+    roots, split_feature, threshold, left, right, default_left, leaf_value = ([] for _ in range(7))
+    max_depth = 0
+    offset = 0
+    for tree in trees:
+        if any(int(t) != 0 for t in tree.get("split_type", [])):
+            raise ValueError("Splits categoricos no soportados en el modelo compilado")
+        lc = np.asarray(tree["left_children"], dtype=np.int64)
+        rc = np.asarray(tree["right_children"], dtype=np.int64)
+        cond = np.asarray(tree["split_conditions"], dtype=np.float32)
+        n_nodes = len(lc)
+        is_leaf = lc == -1
+        own = np.arange(n_nodes)
+
+        roots.append(offset)
+        split_feature.append(np.where(is_leaf, 0, tree["split_indices"]))
+        threshold.append(np.where(is_leaf, 0, cond).astype(np.float32))
+        left.append(np.where(is_leaf, own, lc) + offset)
+        right.append(np.where(is_leaf, own, rc) + offset)
+        default_left.append(np.asarray(tree["default_left"], dtype=bool))
+        leaf_value.append(np.where(is_leaf, cond, 0).astype(np.float32))
+
+        depth = np.zeros(n_nodes, dtype=np.int64)
+        for i in range(n_nodes):  # parents always precede children
+            if not is_leaf[i]:
+                depth[lc[i]] = depth[rc[i]] = depth[i] + 1
+        max_depth = max(max_depth, int(depth.max()))
+        offset += n_nodes
+
+    # base_score is stored on the probability scale for logistic objectives
+    # and on the margin scale for softmax.
+    base = _parse_base_score(learner["learner_model_param"]["base_score"])
+    if objective in _BINARY_OBJECTIVES:
+        base = np.log(base / (1.0 - base))
+    else:
+        n_classes = int(learner["learner_model_param"]["num_class"])
+        if len(base) == 1:
+            base = np.repeat(base, n_classes)
+
+    mean = np.zeros(len(feature_names), dtype=np.float64)
+    scale = np.ones(len(feature_names), dtype=np.float64)
+    # StandardScaler.transform: X -= mean_ (with_mean); X /= scale_ (with_std).
+    scaler_mean = scaler.mean_ if getattr(scaler, "with_mean", True) else None
+    scaler_scale = scaler.scale_ if getattr(scaler, "with_std", True) else None
+    present = []
+    for j, name in enumerate(scaled_features):
+        if name not in feature_names:
+            continue
+        present.append(name)
+        i = feature_names.index(name)
+        if scaler_mean is not None:
+            mean[i] = scaler_mean[j]
+        if scaler_scale is not None:
+            scale[i] = scaler_scale[j]
+
+    return CompiledModel(
+        feature_names=list(feature_names),
+        scaled_features=present,
+        mean=mean,
+        scale=scale,
+        roots=np.asarray(roots, dtype=np.int32),
+        tree_class=np.asarray(tree_info, dtype=np.int32),
+        split_feature=np.concatenate(split_feature).astype(np.int32),
+        threshold=np.concatenate(threshold),
+        left=np.concatenate(left).astype(np.int32),
+        right=np.concatenate(right).astype(np.int32),
+        default_left=np.concatenate(default_left),
+        leaf_value=np.concatenate(leaf_value),
+        base_margin=base,
+        max_depth=max_depth,
+        objective=objective,
+        source=source,
+    )
+
+
+# -----------------------
+# CLI
+# -----------------------
+
+def _export_cli() -> None:
+    from app.services.lpmc_inference import _compiled_path, _load_compiled, _resolve_model_paths
+
+    model_path, scaler_path = _resolve_model_paths()
+    path = _compiled_path(model_path)
+    if path.exists():
+        path.unlink()
+
+    t0 = time.perf_counter()
+    compiled = _load_compiled(model_path, scaler_path)
+    t_compile = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    CompiledModel.load(path)
+    t_load = time.perf_counter() - t0
+
+    print(f"Modelo compilado escrito en {path} ({path.stat().st_size / 2**10:.0f} KB)")
+    print(f"  arboles: {len(compiled.roots)}, nodos: {len(compiled.left)}, profundidad: {compiled.max_depth}")
+    print(f"  exportacion: {t_compile * 1000:.0f} ms")
+    print(f"  carga .npz:  {t_load * 1000:.1f} ms")
+
+
+def _both_predictors() -> tuple[dict, dict]:
+    """Artifacts of the configured LPMC model for the xgboost and numpy predictors."""
+    from app.services.lpmc_inference import _read_artifacts, _resolve_model_paths
+
+    model_path, scaler_path = _resolve_model_paths()
+    return (
+        _read_artifacts(model_path, scaler_path, "xgboost"),
+        _read_artifacts(model_path, scaler_path, "numpy"),
+    )
+
+
+def _random_rows(compiled: CompiledModel, n: int, seed: int) -> np.ndarray:
+    """Raw feature rows spread over the scaler range (and around 0 for
+    unscaled columns), with 2% missing values."""
+    rng = np.random.default_rng(seed)
+    x = compiled.mean + compiled.scale * rng.normal(0.0, 2.0, (n, len(compiled.feature_names)))
+    x[rng.random(x.shape) < 0.02] = np.nan
+    return x
+
+
+def _verify_cli(n: int, tolerance: float, seed: int) -> None:
+    from app.services.lpmc_inference import predict_proba_matrix
+
+    xgb, compiled = _both_predictors()
+    x = _random_rows(compiled["compiled"], n, seed)
+    p_xgb = predict_proba_matrix(x, xgb)
+    p_numpy = predict_proba_matrix(x, compiled)
+    diff = float(np.abs(p_numpy - p_xgb).max())
+    same_class = float((p_numpy.argmax(axis=1) == p_xgb.argmax(axis=1)).mean())
+    print(f"{n} filas: max|p_numpy - p_xgb| = {diff:.2e} (tolerancia {tolerance:.0e}), misma clase: {same_class:.2%}")
+    if not diff <= tolerance:
+        raise SystemExit(1)
+
+
+def _bench_cli(n: int, batch_rows: int, seed: int) -> None:
+    from app.services.lpmc_inference import predict_proba_matrix
+
+    xgb, compiled = _both_predictors()
+    x = _random_rows(compiled["compiled"], batch_rows, seed)
+    print(f"{len(compiled['compiled'].roots)} arboles, {len(compiled['compiled'].feature_names)} features")
+    for name, artifacts in (("xgboost + sklearn", xgb), ("numpy compilado", compiled)):
+        row = x[:1]
+        for _ in range(20):
+            predict_proba_matrix(row, artifacts)
+        latencies = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            predict_proba_matrix(row, artifacts)
+            latencies.append(time.perf_counter() - t0)
+        p50, p90 = (np.percentile(latencies, [50, 90]) * 1e6).tolist()
+
+        predict_proba_matrix(x, artifacts)
+        t0 = time.perf_counter()
+        for _ in range(5):
+            predict_proba_matrix(x, artifacts)
+        t_batch = (time.perf_counter() - t0) / 5
+        print(
+            f"  {name}: 1 fila p50 {p50:.0f} us, p90 {p90:.0f} us; "
+            f"{batch_rows} filas {t_batch * 1000:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.services.lpmc_compiled")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="Exporta el modelo LPMC (joblib) a arrays NumPy (.npz)")
+
+    verify = sub.add_parser(
+        "verify", help="Compara las probabilidades del modelo compilado con las de XGBoost"
+    )
+    verify.add_argument("-n", type=int, default=10000)
+    verify.add_argument("--tolerance", type=float, default=1e-6)
+    verify.add_argument("--seed", type=int, default=1)
+
+    bench = sub.add_parser("bench", help="Latencia de 1 fila y de un lote, XGBoost frente a NumPy")
+    bench.add_argument("-n", type=int, default=1000, help="Repeticiones de la prediccion de 1 fila")
+    bench.add_argument("--batch-rows", type=int, default=10000)
+    bench.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        _export_cli()
+    elif args.command == "verify":
+        _verify_cli(args.n, args.tolerance, args.seed)
+    elif args.command == "bench":
+        _bench_cli(args.n, args.batch_rows, args.seed)
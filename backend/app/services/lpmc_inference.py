@@ -2,19 +2,21 @@
 
 import asyncio
 import os
+import threading
+import time
 from pathlib import Path
 from typing import Any
 
-import httpx
-
 from app.api.routes_otp import (
-    OTP_PLAN_URL,
     OtpRouteRequest,
     Point,
-    _build_otp_params,
-    _pick_itinerary_with_transit,
+    build_otp_params,
+    pick_itinerary_with_transit,
+    fetch_otp_itineraries,
 )
 from app.services.osrm_client import get_route
+from app.services.route_cache import RouteCache, snap
+from app.services.single_flight import SingleFlight
 
 MODE_LABELS = {
     0: "walk",
@@ -27,7 +29,43 @@ MODE_LABELS = {
 PURPOSE_VALUES = ["B", "HBE", "HBO", "HBW", "NHBO"]
 FUELTYPE_VALUES = ["Average", "Diesel", "Hybrid", "Petrol"]
 
+# Max OD pairs whose routing features are fetched at once in batch mode.
+LPMC_BATCH_CONCURRENCY = int(os.environ.get("LPMC_BATCH_CONCURRENCY", "8"))
+
+# Short-lived cache of route features per OD pair, so /predict, /debug-features
+# and /predict-batch share one OSRM + OTP fan-out for the same OD.
+LPMC_FEATURE_CACHE_SIZE = int(os.environ.get("LPMC_FEATURE_CACHE_SIZE", "1024"))
+LPMC_FEATURE_CACHE_TTL_S = float(os.environ.get("LPMC_FEATURE_CACHE_TTL_S", "120"))
+
+# Source of the transit itinerary behind the dur_pt_* features: "otp"
+# (default) asks the OTP server; "raptor" plans in-process over the loaded
+# GTFS (app.services.raptor) with the same date/time as the OTP request.
+LPMC_TRANSIT_SOURCE = os.environ.get("LPMC_TRANSIT_SOURCE", "otp").strip().lower()
+
+
+
+class NoItineraryError(RuntimeError):
+    """The transit planner answered, but without any itinerary for the OD pair."""
+
+
+_FEATURE_CACHE = RouteCache(LPMC_FEATURE_CACHE_SIZE, LPMC_FEATURE_CACHE_TTL_S, path=None)
+_FEATURE_FLIGHTS = SingleFlight()
+
 _ARTIFACTS_CACHE: dict[str, Any] | None = None
+# Serializes loads/reloads; readers just take the current _ARTIFACTS_CACHE.
+_ARTIFACTS_LOCK = threading.RLock()
+_ARTIFACTS_STATUS: dict[str, Any] = {
+    "loaded": False,
+    "model_path": None,
+    "scaler_path": None,
+    "predictor": None,
+    "fingerprint": None,
+    "loaded_at": None,
+    "load_ms": None,
+    "warmup_ms": None,
+    "loads": 0,
+    "last_error": None,
+}
 
 
 def _project_root() -> Path:
@@ -35,6 +73,25 @@ def _project_root() -> Path:
     return Path(__file__).resolve().parents[4]
 
 
+def _model_variant() -> tuple[str, str]:
+    """
+    LPMC_MODEL_VARIANT -> (artifacts, predictor).
+
+    The artifacts part ("nohh", default, or "legacy") picks the joblib files.
+    A "-numpy" suffix ("nohh-numpy", "legacy-numpy"; plain "numpy" means
+    "nohh-numpy") scores them with the compiled NumPy-only predictor
+    (app.services.lpmc_compiled) instead of XGBoost + scikit-learn. The
+    compiled model is read from LPMC_COMPILED_PATH (default:
+    <model>.compiled.npz next to the model) and recompiled from the joblib
+    artifacts if missing or stale.
+    """
+    variant = os.environ.get("LPMC_MODEL_VARIANT", "nohh").strip().lower()
+    artifacts, _, predictor = variant.partition("-")
+    if artifacts == "numpy":
+        return "nohh", "numpy"
+    return artifacts, "numpy" if predictor == "numpy" else "xgboost"
+
+
 def _resolve_model_paths() -> tuple[Path, Path]:
     model_override = os.environ.get("LPMC_MODEL_PATH")
     scaler_override = os.environ.get("LPMC_SCALER_PATH")
@@ -43,7 +100,7 @@ def _resolve_model_paths() -> tuple[Path, Path]:
         return Path(model_override), Path(scaler_override)
 
     models_dir = _project_root() / "lpmc" / "models"
-    variant = os.environ.get("LPMC_MODEL_VARIANT", "nohh").strip().lower()
+    variant, _predictor = _model_variant()
     if variant == "legacy":
         model_candidates = [
             models_dir / "xgb_lpmc_tuned.joblib",
@@ -81,60 +138,231 @@ def _resolve_model_paths() -> tuple[Path, Path]:
     return model_path, scaler_path
 
 
-def _load_artifacts() -> dict[str, Any]:
-    global _ARTIFACTS_CACHE
-    if _ARTIFACTS_CACHE is not None:
-        return _ARTIFACTS_CACHE
+def _compiled_path(model_path: Path) -> Path:
+    override = os.environ.get("LPMC_COMPILED_PATH")
+    if override:
+        return Path(override)
+    return model_path.with_suffix(".compiled.npz")
+
+
+def _load_compiled(model_path: Path, scaler_path: Path):
+    from app.services.lpmc_compiled import CompiledModel, compile_model, source_fingerprint
+
+    path = _compiled_path(model_path)
+    fingerprint = source_fingerprint(model_path, scaler_path)
+    if path.exists():
+        try:
+            compiled = CompiledModel.load(path)
+        except (OSError, ValueError, KeyError):
+            compiled = None
+        if compiled is not None and compiled.source == fingerprint:
+            return compiled
+
+    import joblib
+
+    model_bundle = joblib.load(model_path)
+    scaler_bundle = joblib.load(scaler_path)
+    compiled = compile_model(
+        model_bundle["model"],
+        model_bundle["feature_names"],
+        scaler_bundle["scaler"],
+        scaler_bundle["scaled_features"],
+        source=fingerprint,
+    )
+    try:
+        compiled.save(path)
+    except OSError:
+        # Read-only models dir: keep the in-memory compiled model.
+        pass
+    return compiled
+
+
+def _read_artifacts(
+    model_path: Path, scaler_path: Path, predictor: str | None = None
+) -> dict[str, Any]:
+    if (predictor or _model_variant()[1]) == "numpy":
+        compiled = _load_compiled(model_path, scaler_path)
+        return {
+            "model": None,
+            "compiled": compiled,
+            "feature_names": compiled.feature_names,
+            "scaler": None,
+            "scaled_features": compiled.scaled_features,
+            "plan": _FeaturePlan(compiled.feature_names, None, compiled.scaled_features),
+            "model_path": str(model_path),
+            "scaler_path": str(scaler_path),
+        }
 
     import joblib
 
-    model_path, scaler_path = _resolve_model_paths()
     model_bundle = joblib.load(model_path)
     scaler_bundle = joblib.load(scaler_path)
 
-    _ARTIFACTS_CACHE = {
+    return {
         "model": model_bundle["model"],
+        "compiled": None,
         "feature_names": model_bundle["feature_names"],
         "scaler": scaler_bundle["scaler"],
         "scaled_features": scaler_bundle["scaled_features"],
+        "plan": _FeaturePlan(
+            model_bundle["feature_names"], scaler_bundle["scaler"], scaler_bundle["scaled_features"]
+        ),
         "model_path": str(model_path),
         "scaler_path": str(scaler_path),
     }
-    return _ARTIFACTS_CACHE
 
 
-async def _fetch_otp_itinerary(
+def _artifacts_fingerprint(model_path: Path, scaler_path: Path) -> str:
+    from app.services.lpmc_compiled import source_fingerprint
+
+    return source_fingerprint(model_path, scaler_path)
+
+
+def _warm_up_artifacts(artifacts: dict[str, Any]) -> None:
+    # One dummy prediction: first-call costs (lazy imports, XGBoost predictor
+    # setup, NumPy buffers) are paid here instead of by the first request.
+    import numpy as np
+
+    x = np.zeros((1, len(artifacts["feature_names"])), dtype=float)
+    _predict_batch(x, artifacts["feature_names"], artifacts)
+
+
+def reload_artifacts() -> dict[str, Any]:
+    """
+    Load (or reload) the model/scaler found by _resolve_model_paths, warm
+    them up and swap them in atomically. Requests already running keep the
+    artifacts they started with. If loading fails, the current artifacts stay
+    in place and the error is re-raised.
+    """
+    global _ARTIFACTS_CACHE
+    with _ARTIFACTS_LOCK:
+        try:
+            model_path, scaler_path = _resolve_model_paths()
+            fingerprint = _artifacts_fingerprint(model_path, scaler_path)
+
+            t0 = time.perf_counter()
+            artifacts = _read_artifacts(model_path, scaler_path)
+            load_ms = (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            _warm_up_artifacts(artifacts)
+            warmup_ms = (time.perf_counter() - t0) * 1000
+        except Exception as exc:
+            _ARTIFACTS_STATUS["last_error"] = str(exc)
+            raise
+
+        artifacts["fingerprint"] = fingerprint
+        _ARTIFACTS_CACHE = artifacts
+        _ARTIFACTS_STATUS.update(
+            loaded=True,
+            model_path=str(model_path),
+            scaler_path=str(scaler_path),
+            predictor="numpy" if artifacts["compiled"] is not None else "xgboost",
+            fingerprint=fingerprint,
+            loaded_at=time.time(),
+            load_ms=round(load_ms, 1),
+            warmup_ms=round(warmup_ms, 1),
+            loads=_ARTIFACTS_STATUS["loads"] + 1,
+            last_error=None,
+        )
+        return artifacts_status()
+
+
+def load_artifacts() -> dict[str, Any]:
+    """Current model artifacts, loaded on first use (blocking: joblib/xgboost)."""
+    artifacts = _ARTIFACTS_CACHE
+    if artifacts is not None:
+        return artifacts
+    with _ARTIFACTS_LOCK:
+        if _ARTIFACTS_CACHE is None:
+            reload_artifacts()
+        return _ARTIFACTS_CACHE
+
+
+async def load_artifacts_async() -> dict[str, Any]:
+    """load_artifacts() for async paths: a first load (or one waiting on the
+    warm-up thread's lock) runs in a thread instead of stalling the loop."""
+    artifacts = _ARTIFACTS_CACHE
+    if artifacts is not None:
+        return artifacts
+    return await asyncio.to_thread(load_artifacts)
+
+
+def warm_up() -> None:
+    """Eager load + warm-up for the app lifespan; errors only go to /health."""
+    try:
+        load_artifacts()
+    except Exception:
+        pass
+
+
+def artifacts_changed() -> bool:
+    """True if the files _resolve_model_paths points to differ from the loaded ones."""
+    if _ARTIFACTS_STATUS["fingerprint"] is None:
+        return False  # not loaded yet; the first request/warm-up loads it
+    try:
+        model_path, scaler_path = _resolve_model_paths()
+        fingerprint = _artifacts_fingerprint(model_path, scaler_path)
+    except (FileNotFoundError, OSError):
+        return False
+    return fingerprint != _ARTIFACTS_STATUS["fingerprint"]
+
+
+async def watch_artifacts(interval_s: float) -> None:
+    """Reload the model whenever its files change (polls every interval_s)."""
+    while True:
+        await asyncio.sleep(interval_s)
+        if artifacts_changed():
+            try:
+                await asyncio.to_thread(reload_artifacts)
+            except Exception:
+                # Half-copied files, etc.: keep serving the current model and
+                # retry on the next tick (the error is visible in /health).
+                pass
+
+
+def artifacts_status() -> dict[str, Any]:
+    return dict(_ARTIFACTS_STATUS)
+
+
+async def fetch_otp_itinerary(
     origin_lat: float,
     origin_lon: float,
     destination_lat: float,
     destination_lon: float,
     itinerary_index: int | None,
 ) -> dict:
+    """Transit itinerary behind the LPMC features (OTP or RAPTOR, per LPMC_TRANSIT_SOURCE)."""
     req = OtpRouteRequest(
         origin=Point(lat=origin_lat, lon=origin_lon),
         destination=Point(lat=destination_lat, lon=destination_lon),
         itinerary_index=itinerary_index,
     )
-    params = _build_otp_params(req)
-
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        resp = await client.get(OTP_PLAN_URL, params=params)
-
-    if resp.status_code != 200:
-        raise RuntimeError(f"Error OTP: {resp.status_code}")
-
-    data = resp.json()
-    plan = data.get("plan") or {}
-    itineraries: list[dict] = plan.get("itineraries") or []
-    if not itineraries:
-        raise RuntimeError("OTP no encontro itinerarios")
-
-    itineraries = sorted(itineraries, key=lambda it: float(it.get("duration") or 1e20))
+    params = build_otp_params(req)
+
+    if LPMC_TRANSIT_SOURCE == "raptor":
+        from app.services import raptor
+
+        itineraries = await asyncio.to_thread(
+            raptor.plan,
+            origin_lat,
+            origin_lon,
+            destination_lat,
+            destination_lon,
+            raptor.params_datetime(params),
+        )
+        if not itineraries:
+            raise NoItineraryError("RAPTOR no encontro itinerarios")
+    else:
+        # Raises OtpError (a RuntimeError) on a non-200 OTP response.
+        itineraries = await fetch_otp_itineraries(params)
+        if not itineraries:
+            raise NoItineraryError("OTP no encontro itinerarios")
 
     if itinerary_index is not None and 0 <= itinerary_index < len(itineraries):
         idx = itinerary_index
     else:
-        idx = _pick_itinerary_with_transit(itineraries)
+        idx = pick_itinerary_with_transit(itineraries)
 
     return {
         "itinerary": itineraries[idx],
@@ -155,7 +383,17 @@ def _build_route_features(osrm_results: dict[str, dict], otp_itinerary: dict) ->
     cycling = osrm_results["cycling"]
     foot = osrm_results["foot"]
 
-    itinerary = otp_itinerary["itinerary"]
+    return {
+        "distance": float(driving["distance_m"]),
+        "dur_walking": float(foot["duration_s"]),
+        "dur_cycling": float(cycling["duration_s"]),
+        "dur_driving": float(driving["duration_s"]),
+        **transit_features(otp_itinerary["itinerary"]),
+    }
+
+
+def transit_features(itinerary: dict) -> dict[str, float | int]:
+    """dur_pt_* and pt_n_interchanges features of one OTP itinerary."""
     legs = itinerary.get("legs", [])
 
     walk_durations: list[float] = []
@@ -195,10 +433,6 @@ def _build_route_features(osrm_results: dict[str, dict], otp_itinerary: dict) ->
     inter_waiting = max(otp_total - sum_legs, 0.0)
 
     return {
-        "distance": float(driving["distance_m"]),
-        "dur_walking": float(foot["duration_s"]),
-        "dur_cycling": float(cycling["duration_s"]),
-        "dur_driving": float(driving["duration_s"]),
         "dur_pt_access": first_walk,
         "dur_pt_rail": rail_duration,
         "dur_pt_bus": bus_duration,
@@ -208,91 +442,212 @@ def _build_route_features(osrm_results: dict[str, dict], otp_itinerary: dict) ->
     }
 
 
-def _build_feature_frame(payload: dict, route_features: dict[str, float | int]):
+# Profile fields copied as-is into the feature row.
+DIRECT_NUMERIC = [
+    "day_of_week",
+    "start_time_linear",
+    "age",
+    "female",
+    "driving_license",
+    "car_ownership",
+    "cost_transit",
+    "cost_driving_total",
+]
+
+# Below this many rows, _FeaturePlan.fill builds rows in plain Python;
+# above it, it fills the matrix column by column.
+_COLUMNAR_FILL_MIN_ROWS = 32
+
+
+class _FeaturePlan:
+    """
+    Column layout of the model input, computed once per artifacts load.
+
+    Resolves every feature name to its column index (profile fields,
+    one-hot slots, route features, scaled columns) so building a row is
+    a handful of list/array writes instead of dict rebuilding per request.
+    The StandardScaler is folded into mean/scale vectors over the scaled
+    columns, which gives the same values as scaler.transform without its
+    per-call validation.
+    """
+
+    def __init__(self, feature_names: list[str], scaler, scaled_features: list[str]):
+        import numpy as np
+
+        index = {name: i for i, name in enumerate(feature_names)}
+        self.feature_names = feature_names
+        self.n_features = len(feature_names)
+        self.index = index
+        # household_id (legacy models) stays at its zero default.
+        self.direct = [(col, index[col]) for col in DIRECT_NUMERIC if col in index]
+        self.purpose_slots = {
+            v: index[f"purpose_{v}"] for v in PURPOSE_VALUES if f"purpose_{v}" in index
+        }
+        self.fueltype_slots = {
+            v: index[f"fueltype_{v}"] for v in FUELTYPE_VALUES if f"fueltype_{v}" in index
+        }
+        direct_cols = {col for col, _ in self.direct}
+        self.route_index = {name: i for name, i in index.items() if name not in direct_cols}
+
+        self.scaled_features = [c for c in scaled_features if c in index]
+        self.scaled_idx = np.array([index[c] for c in self.scaled_features], dtype=np.intp)
+        self.mean = self.scale = None
+        if hasattr(scaler, "with_mean") and len(self.scaled_features) == len(scaled_features):
+            # StandardScaler.transform: X -= mean_ (with_mean); X /= scale_ (with_std).
+            self.mean = np.asarray(scaler.mean_ if scaler.with_mean else 0.0, dtype=float)
+            self.scale = np.asarray(scaler.scale_ if scaler.with_std else 1.0, dtype=float)
+        self.scaler = scaler
+
+    def _row(self, payload: dict, route_features: dict[str, float | int]) -> list[float]:
+        row = [0.0] * self.n_features
+        for col, j in self.direct:
+            if col in payload:
+                row[j] = float(payload[col])
+        route_index = self.route_index
+        for col, value in route_features.items():
+            j = route_index.get(col)
+            if j is not None:
+                row[j] = float(value)
+        j = self.purpose_slots.get(payload.get("purpose"))
+        if j is not None:
+            row[j] = 1.0
+        j = self.fueltype_slots.get(payload.get("fueltype"))
+        if j is not None:
+            row[j] = 1.0
+        return row
+
+    def fill(self, payloads: list[dict], route_features: list[dict[str, float | int]], out=None):
+        """N x F feature matrix for N (payload, route_features) pairs, written into out."""
+        import numpy as np
+
+        n = len(payloads)
+        if out is None:
+            out = np.zeros((n, self.n_features), dtype=float)
+        else:
+            out[:] = 0.0
+        if n < _COLUMNAR_FILL_MIN_ROWS:
+            for i, (payload, rf) in enumerate(zip(payloads, route_features)):
+                out[i] = self._row(payload, rf)
+            return out
+
+        for col, j in self.direct:
+            out[:, j] = np.fromiter((float(p.get(col, 0.0)) for p in payloads), dtype=float, count=n)
+
+        names = {}
+        for rf in route_features:
+            names.update(dict.fromkeys(rf))
+        for col in names:
+            j = self.route_index.get(col)
+            if j is not None:
+                out[:, j] = np.fromiter(
+                    (float(rf.get(col, 0.0)) for rf in route_features), dtype=float, count=n
+                )
+
+        rows = np.arange(n)
+        for key, slots in (("purpose", self.purpose_slots), ("fueltype", self.fueltype_slots)):
+            cols = np.fromiter((slots.get(p.get(key), -1) for p in payloads), dtype=np.intp, count=n)
+            hit = cols >= 0
+            out[rows[hit], cols[hit]] = 1.0
+        return out
+
+    def scale_(self, x):
+        """Scale the scaled columns of x in place."""
+        if not len(self.scaled_idx):
+            return x
+        if self.mean is not None:
+            x[:, self.scaled_idx] = (x[:, self.scaled_idx] - self.mean) / self.scale
+        else:
+            x[:, self.scaled_idx] = self.scaler.transform(x[:, self.scaled_idx])
+        return x
+
+
+def _build_feature_frame(
+    payload: dict, route_features: dict[str, float | int], artifacts: dict[str, Any] | None = None
+):
+    artifacts = artifacts or load_artifacts()
+    plan: _FeaturePlan = artifacts["plan"]
+    return plan.fill([payload], [route_features]), plan.feature_names
+
+
+def _build_feature_matrix(
+    payloads: list[dict],
+    route_features: list[dict[str, float | int]],
+    artifacts: dict[str, Any] | None = None,
+):
+    """Same as _build_feature_frame, one row per (payload, route_features) pair."""
+    artifacts = artifacts or load_artifacts()
+    plan: _FeaturePlan = artifacts["plan"]
+    return plan.fill(payloads, route_features), plan.feature_names
+
+
+def _predict(x, feature_names: list[str], artifacts: dict[str, Any] | None = None) -> dict:
+    return _predict_batch(x, feature_names, artifacts)[0]
+
+
+def _scale(
+    x, feature_names: list[str], artifacts: dict[str, Any] | None = None, overwrite_x: bool = False
+):
+    """Apply the scaler to the scaled columns of x (in place if overwrite_x)."""
+    artifacts = artifacts or load_artifacts()
+    compiled = artifacts["compiled"]
+    if compiled is not None:
+        return compiled.transform(x)
+    return artifacts["plan"].scale_(x if overwrite_x else x.copy())
+
+
+def predict_proba_matrix(x, artifacts: dict[str, Any] | None = None, overwrite_x: bool = False):
+    """Class probabilities (N x K) for a raw N x F feature matrix."""
+    artifacts = artifacts or load_artifacts()
+    compiled = artifacts["compiled"]
+    if compiled is not None:
+        return compiled.predict_proba(x)
+    return artifacts["model"].predict_proba(_scale(x, artifacts["feature_names"], artifacts, overwrite_x))
+
+
+def _predict_batch(
+    x, feature_names: list[str], artifacts: dict[str, Any] | None = None, overwrite_x: bool = False
+) -> list[dict]:
     import numpy as np
 
-    artifacts = _load_artifacts()
-    feature_names: list[str] = artifacts["feature_names"]
-
-    row = {name: 0.0 for name in feature_names}
-
-    # Keep household_id out of the API contract. If a legacy model still
-    # contains this feature, neutralize it to a fixed value.
-    if "household_id" in row:
-        row["household_id"] = 0.0
-
-    direct_numeric = [
-        "day_of_week",
-        "start_time_linear",
-        "age",
-        "female",
-        "driving_license",
-        "car_ownership",
-        "cost_transit",
-        "cost_driving_total",
+    proba = predict_proba_matrix(x, artifacts, overwrite_x)
+    pred_idx = np.argmax(proba, axis=1)
+    n_modes = min(proba.shape[1], 4)
+
+    return [
+        {
+            "predicted_mode": MODE_LABELS.get(int(idx), str(int(idx))),
+            "confidence": float(row[idx]),
+            "probabilities": {MODE_LABELS[i]: float(row[i]) for i in range(n_modes)},
+        }
+        for row, idx in zip(proba, pred_idx)
     ]
-    for col in direct_numeric:
-        if col in row and col in payload:
-            row[col] = float(payload[col])
-
-    for col, value in route_features.items():
-        if col in row:
-            row[col] = float(value)
-
-    purpose = payload.get("purpose")
-    if purpose in PURPOSE_VALUES:
-        key = f"purpose_{purpose}"
-        if key in row:
-            row[key] = 1.0
-
-    fueltype = payload.get("fueltype")
-    if fueltype in FUELTYPE_VALUES:
-        key = f"fueltype_{fueltype}"
-        if key in row:
-            row[key] = 1.0
-
-    x = np.array([[float(row[name]) for name in feature_names]], dtype=float)
-    return x, feature_names
-
-
-def _predict(x, feature_names: list[str]) -> dict:
-    import numpy as np
-
-    artifacts = _load_artifacts()
-    model = artifacts["model"]
-    scaler = artifacts["scaler"]
-    scaled_features = [c for c in artifacts["scaled_features"] if c in feature_names]
-    feature_index = {name: idx for idx, name in enumerate(feature_names)}
-
-    if scaled_features:
-        idxs = [feature_index[c] for c in scaled_features]
-        x_scaled_subset = scaler.transform(x[:, idxs])
-        x = x.copy()
-        x[:, idxs] = x_scaled_subset
-
-    proba = model.predict_proba(x)[0]
-    pred_idx = int(np.argmax(proba))
 
-    probabilities = {MODE_LABELS[i]: float(proba[i]) for i in range(min(len(proba), 4))}
 
+def _model_info(feature_names: list[str], artifacts: dict[str, Any] | None = None) -> dict:
+    artifacts = artifacts or load_artifacts()
     return {
-        "predicted_mode": MODE_LABELS.get(pred_idx, str(pred_idx)),
-        "confidence": float(np.max(proba)),
-        "probabilities": probabilities,
+        "model_path": artifacts["model_path"],
+        "scaler_path": artifacts["scaler_path"],
+        "predictor": "numpy" if artifacts["compiled"] is not None else "xgboost",
+        "transit_source": LPMC_TRANSIT_SOURCE,
+        "household_id_strategy": (
+            "fixed_zero_legacy_model"
+            if "household_id" in feature_names
+            else "not_used_in_model_features"
+        ),
     }
 
 
-def _build_debug_payload(x, feature_names: list[str], otp: dict, route_features: dict[str, float | int]) -> dict:
-    artifacts = _load_artifacts()
-    scaler = artifacts["scaler"]
-    scaled_features = [c for c in artifacts["scaled_features"] if c in feature_names]
-    feature_index = {name: idx for idx, name in enumerate(feature_names)}
-
-    x_scaled = x.copy()
-    if scaled_features:
-        idxs = [feature_index[c] for c in scaled_features]
-        x_scaled_subset = scaler.transform(x_scaled[:, idxs])
-        x_scaled[:, idxs] = x_scaled_subset
+def _build_debug_payload(
+    x,
+    feature_names: list[str],
+    otp: dict,
+    route_features: dict[str, float | int],
+    artifacts: dict[str, Any] | None = None,
+) -> dict:
+    artifacts = artifacts or load_artifacts()
+    scaled_features = artifacts["plan"].scaled_features
+    x_scaled = _scale(x, feature_names, artifacts)
 
     raw_map = {name: float(x[0, i]) for i, name in enumerate(feature_names)}
     scaled_map = {name: float(x_scaled[0, i]) for i, name in enumerate(feature_names)}
@@ -304,32 +659,26 @@ def _build_debug_payload(x, feature_names: list[str], otp: dict, route_features:
         "scaled_columns": scaled_features,
         "route_features": route_features,
         "model_info": {
-            "model_path": artifacts["model_path"],
-            "scaler_path": artifacts["scaler_path"],
-            "household_id_strategy": (
-                "fixed_zero_legacy_model"
-                if "household_id" in feature_names
-                else "not_used_in_model_features"
-            ),
+            **_model_info(feature_names, artifacts),
             "itinerary_index": otp["itinerary_index"],
             "total_itineraries": otp["total_itineraries"],
         },
     }
 
 
-async def run_lpmc_inference(body: dict) -> dict:
-    origin = body["origin"]
-    destination = body["destination"]
-
+async def _fetch_route_features(
+    origin: dict, destination: dict, itinerary_index: int | None
+) -> tuple[dict[str, float | int], dict]:
+    """Fan out the three OSRM profiles and OTP for one OD pair."""
     driving_task = get_route("driving", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
     cycling_task = get_route("cycling", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
     foot_task = get_route("foot", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
-    otp_task = _fetch_otp_itinerary(
+    otp_task = fetch_otp_itinerary(
         origin["lat"],
         origin["lon"],
         destination["lat"],
         destination["lon"],
-        body.get("itinerary_index"),
+        itinerary_index,
     )
 
     driving, cycling, foot, otp = await asyncio.gather(
@@ -344,60 +693,338 @@ async def run_lpmc_inference(body: dict) -> dict:
         "cycling": cycling,
         "foot": foot,
     }
+    return _build_route_features(osrm_results, otp), otp
+
+
+def _feature_key(origin: dict, destination: dict, itinerary_index: int | None) -> tuple:
+    return (
+        snap(origin["lat"]),
+        snap(origin["lon"]),
+        snap(destination["lat"]),
+        snap(destination["lon"]),
+        itinerary_index,
+    )
+
 
-    route_features = _build_route_features(osrm_results, otp)
+async def _get_route_features(
+    origin: dict, destination: dict, itinerary_index: int | None
+) -> tuple[dict[str, float | int], dict]:
+    """Route features for one OD pair, from the feature cache when possible."""
+    key = _feature_key(origin, destination, itinerary_index)
+    cached = _FEATURE_CACHE.get(key)
+    if cached is not None:
+        return cached
 
+    async def fetch():
+        result = await _fetch_route_features(origin, destination, itinerary_index)
+        _FEATURE_CACHE.set(key, result)
+        return result
+
+    return await _FEATURE_FLIGHTS.do(key, fetch)
+
+
+async def _extract_features(body: dict):
+    route_features, otp = await _get_route_features(
+        body["origin"], body["destination"], body.get("itinerary_index")
+    )
+    # One artifacts snapshot per request, so a concurrent reload cannot mix
+    # the feature layout of one model with the weights of another.
+    artifacts = await load_artifacts_async()
     payload = dict(body["user_profile"])
-    x, feature_names = _build_feature_frame(payload, route_features)
-    prediction = _predict(x, feature_names)
+    x, feature_names = _build_feature_frame(payload, route_features, artifacts)
+    return x, feature_names, route_features, otp, artifacts
 
-    artifacts = _load_artifacts()
 
-    return {
+async def run_lpmc_inference(body: dict, debug: bool = False) -> dict:
+    x, feature_names, route_features, otp, artifacts = await _extract_features(body)
+    prediction = _predict(x, feature_names, artifacts)
+
+    result = {
         **prediction,
         "route_features": route_features,
         "model_info": {
-            "model_path": artifacts["model_path"],
-            "scaler_path": artifacts["scaler_path"],
-            "household_id_strategy": (
-                "fixed_zero_legacy_model"
-                if "household_id" in feature_names
-                else "not_used_in_model_features"
-            ),
+            **_model_info(feature_names, artifacts),
             "itinerary_index": otp["itinerary_index"],
             "total_itineraries": otp["total_itineraries"],
         },
     }
+    if debug:
+        result["debug"] = _build_debug_payload(x, feature_names, otp, route_features, artifacts)
+    return result
 
 
 async def run_lpmc_debug_features(body: dict) -> dict:
-    origin = body["origin"]
-    destination = body["destination"]
+    x, feature_names, route_features, otp, artifacts = await _extract_features(body)
+    return _build_debug_payload(x, feature_names, otp, route_features, artifacts)
 
-    driving_task = get_route("driving", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
-    cycling_task = get_route("cycling", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
-    foot_task = get_route("foot", origin["lon"], origin["lat"], destination["lon"], destination["lat"])
-    otp_task = _fetch_otp_itinerary(
-        origin["lat"],
-        origin["lon"],
-        destination["lat"],
-        destination["lon"],
-        body.get("itinerary_index"),
-    )
 
-    driving, cycling, foot, otp = await asyncio.gather(
-        driving_task,
-        cycling_task,
-        foot_task,
-        otp_task,
+def _od_key(item: dict) -> tuple:
+    return _feature_key(item["origin"], item["destination"], item.get("itinerary_index"))
+
+
+async def run_lpmc_batch(body: dict) -> dict:
+    """
+    Many (OD, user profile) predictions in one call.
+
+    Routing features are fetched once per distinct (snapped) OD pair and
+    itinerary index through the shared feature cache, at most
+    LPMC_BATCH_CONCURRENCY pairs at a time. All rows are then scaled and
+    scored in a single vectorized predict_proba call. Items whose routing
+    fails get an "error" instead of a prediction.
+    """
+    items: list[dict] = body["items"]
+
+    unique: dict[tuple, dict] = {}
+    for item in items:
+        unique.setdefault(_od_key(item), item)
+
+    sem = asyncio.Semaphore(LPMC_BATCH_CONCURRENCY)
+
+    async def fetch(item: dict):
+        async with sem:
+            return await _get_route_features(
+                item["origin"], item["destination"], item.get("itinerary_index")
+            )
+
+    outcomes = await asyncio.gather(
+        *(fetch(item) for item in unique.values()),
+        return_exceptions=True,
     )
+    features_by_od = dict(zip(unique.keys(), outcomes))
+
+    ok_rows: list[int] = []
+    payloads: list[dict] = []
+    route_features: list[dict[str, float | int]] = []
+    results: list[dict] = []
+    for i, item in enumerate(items):
+        outcome = features_by_od[_od_key(item)]
+        if isinstance(outcome, BaseException):
+            results.append({"error": str(outcome) or outcome.__class__.__name__})
+            continue
+        rf, otp = outcome
+        ok_rows.append(i)
+        payloads.append(dict(item["user_profile"]))
+        route_features.append(rf)
+        results.append(
+            {
+                "route_features": rf,
+                "itinerary_index": otp["itinerary_index"],
+                "total_itineraries": otp["total_itineraries"],
+            }
+        )
 
-    osrm_results = {
-        "driving": driving,
-        "cycling": cycling,
-        "foot": foot,
+    artifacts = await load_artifacts_async()
+    x, feature_names = _build_feature_matrix(payloads, route_features, artifacts)
+    if ok_rows:
+        predictions = _predict_batch(x, feature_names, artifacts, overwrite_x=True)
+        for i, prediction in zip(ok_rows, predictions):
+            results[i].update(prediction)
+
+    return {
+        "results": results,
+        "unique_od_pairs": len(unique),
+        "model_info": _model_info(feature_names, artifacts),
     }
-    route_features = _build_route_features(osrm_results, otp)
-    payload = dict(body["user_profile"])
-    x, feature_names = _build_feature_frame(payload, route_features)
-    return _build_debug_payload(x, feature_names, otp, route_features)
+
+
+# -----------------------
+# CLI
+# -----------------------
+# bench: predictions per second through the app, N x /predict against one
+# /predict-batch with the same items, over an in-process OSRM/OTP stub. The
+# route cache is off; the feature cache is cleared before each path, so both
+# fetch every distinct OD pair once.
+
+async def _bench(cases: list[tuple[int, int]], latency_s: float, seed: int) -> None:
+    import random
+
+    import httpx
+
+    from app.api import routes_otp
+    from app.main import app
+    from app.services import http_clients, lpmc_inference, osrm_client
+    from app.services.route_cache import ROUTE_CACHE
+    from app.services.single_flight import _stub_server
+
+    server = await _stub_server(latency_s, {"upstream": 0})
+    base = "http://127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+    for profile in osrm_client.OSRM_BASE_URLS:
+        osrm_client.OSRM_BASE_URLS[profile] = base
+    routes_otp.OTP_PLAN_URL = f"{base}/otp/routers/default/plan"
+    lpmc_inference.LPMC_TRANSIT_SOURCE = "otp"
+    ROUTE_CACHE.max_entries = 0
+    await http_clients.start()
+    await lpmc_inference.load_artifacts_async()
+
+    rng = random.Random(seed)
+    purposes = list(PURPOSE_VALUES)
+    print(f"OSRM/OTP simulado con {latency_s * 1000:.0f} ms de latencia")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        try:
+            for n, n_od in cases:
+                items = [
+                    {
+                        "origin": {"lat": 39.86 + (i % n_od) * 1e-3, "lon": -4.02},
+                        "destination": {"lat": 39.87, "lon": -4.03 + (i % n_od) * 1e-3},
+                        "user_profile": {"purpose": rng.choice(purposes), "age": 20 + i % 50},
+                    }
+                    for i in range(n)
+                ]
+
+                lpmc_inference._FEATURE_CACHE.clear()
+                t0 = time.perf_counter()
+                singles = []
+                for item in items:
+                    resp = await client.post("/api/lpmc/predict", json=item)
+                    resp.raise_for_status()
+                    singles.append(resp.json()["probabilities"])
+                t_single = time.perf_counter() - t0
+
+                lpmc_inference._FEATURE_CACHE.clear()
+                t0 = time.perf_counter()
+                resp = await client.post("/api/lpmc/predict-batch", json={"items": items})
+                resp.raise_for_status()
+                t_batch = time.perf_counter() - t0
+                batch = [r.get("probabilities") for r in resp.json()["results"]]
+
+                mismatches = sum(s != b for s, b in zip(singles, batch))
+                print(
+                    f"  N={n:<6} {n_od:>5} pares OD: /predict {n / t_single:7.0f} pred/s, "
+                    f"/predict-batch {n / t_batch:7.0f} pred/s ({mismatches} distintas)"
+                )
+        finally:
+            await http_clients.close()
+            server.close()
+
+# features-bench: feature assembly, scaling and the debug payload for 1 and
+# n rows of random payloads, against the per-name dict rows and the sklearn
+# scaler.transform call they replaced (bench reference only).
+
+def _reference_row(payload: dict, route_features: dict[str, float | int], feature_names: list[str]) -> list[float]:
+    """One feature row built by name through a dict (the layout before _FeaturePlan)."""
+    row = {name: 0.0 for name in feature_names}
+    for col in DIRECT_NUMERIC:
+        if col in row and col in payload:
+            row[col] = float(payload[col])
+    for col, value in route_features.items():
+        if col in row:
+            row[col] = float(value)
+    for prefix, values in (("purpose", PURPOSE_VALUES), ("fueltype", FUELTYPE_VALUES)):
+        value = payload.get(prefix)
+        if value in values and f"{prefix}_{value}" in row:
+            row[f"{prefix}_{value}"] = 1.0
+    return [row[name] for name in feature_names]
+
+
+def _features_bench_cli(n_rows: int, seed: int) -> None:
+    import random
+
+    import numpy as np
+
+    model_path, scaler_path = _resolve_model_paths()
+    artifacts = _read_artifacts(model_path, scaler_path, "xgboost")
+    feature_names = artifacts["feature_names"]
+    scaler = artifacts["scaler"]
+    scaled_idx = [feature_names.index(c) for c in artifacts["scaled_features"] if c in feature_names]
+
+    rng = random.Random(seed)
+    payloads, route_features = [], []
+    for _ in range(n_rows):
+        payloads.append(
+            {
+                "purpose": rng.choice(PURPOSE_VALUES + ["X"]),
+                "fueltype": rng.choice(FUELTYPE_VALUES),
+                "day_of_week": rng.randint(1, 7),
+                "start_time_linear": rng.random() * 24,
+                "age": rng.randint(16, 90),
+                "female": rng.randint(0, 1),
+                "driving_license": 1,
+                "car_ownership": rng.randint(0, 3),
+                "cost_transit": 1.5,
+                "cost_driving_total": rng.random() * 5,
+            }
+        )
+        route_features.append(
+            {
+                "distance": rng.random() * 9000,
+                "dur_walking": rng.random() * 5000,
+                "dur_cycling": rng.random() * 2000,
+                "dur_driving": rng.random() * 900,
+                "dur_pt_access": 300.0,
+                "dur_pt_rail": 0.0,
+                "dur_pt_bus": rng.random() * 900,
+                "dur_pt_int_waiting": 0.0,
+                "dur_pt_int_walking": 0.0,
+                "pt_n_interchanges": rng.randint(0, 2),
+            }
+        )
+
+    def reference_matrix(ps, rfs):
+        return np.array([_reference_row(p, rf, feature_names) for p, rf in zip(ps, rfs)], dtype=float)
+
+    def reference_scale(x):
+        x = x.copy()
+        if scaled_idx:
+            x[:, scaled_idx] = scaler.transform(x[:, scaled_idx])
+        return x
+
+    x_ref = reference_matrix(payloads, route_features)
+    x, _ = _build_feature_matrix(payloads, route_features, artifacts)
+    same_matrix = np.array_equal(x, x_ref)
+    same_scaled = np.array_equal(_scale(x, feature_names, artifacts), reference_scale(x_ref))
+
+    def mean_time(fn, reps: int) -> float:
+        fn()
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            fn()
+        return (time.perf_counter() - t0) / reps
+
+    p0, rf0 = payloads[0], route_features[0]
+    otp = {"itinerary_index": 0, "total_itineraries": 1}
+    cases = (
+        ("ensamblar 1 fila", lambda: reference_matrix([p0], [rf0]),
+         lambda: _build_feature_frame(p0, rf0, artifacts), 20000),
+        (f"ensamblar {n_rows} filas", lambda: reference_matrix(payloads, route_features),
+         lambda: _build_feature_matrix(payloads, route_features, artifacts), 10),
+        ("escalar 1 fila", lambda: reference_scale(x[:1]),
+         lambda: _scale(x[:1], feature_names, artifacts), 5000),
+        (f"escalar {n_rows} filas", lambda: reference_scale(x),
+         lambda: _scale(x, feature_names, artifacts), 50),
+    )
+    print(f"{len(feature_names)} features, {len(scaled_idx)} escaladas (antes: fila por nombre y scaler.transform)")
+    for label, before, after, reps in cases:
+        t_before, t_after = mean_time(before, reps), mean_time(after, reps)
+        unit, k = ("us", 1e6) if t_before < 1e-3 else ("ms", 1e3)
+        print(f"  {label:<24} {t_before * k:8.1f} {unit} -> {t_after * k:8.1f} {unit}")
+    t_debug = mean_time(lambda: _build_debug_payload(x[:1], feature_names, otp, rf0, artifacts), 5000)
+    print(f"  {'payload de debug 1 fila':<24} {t_debug * 1e6:8.1f} us")
+    print(f"  matriz idéntica: {same_matrix}, escalado idéntico: {same_scaled}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.lpmc_inference")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Predicciones por segundo, /predict uno a uno frente a /predict-batch")
+    bench.add_argument(
+        "--cases", nargs="+", default=["200:200", "500:50", "2000:20"],
+        help="N:pares_OD (N elementos repartidos entre esos pares)",
+    )
+    bench.add_argument("--latency-ms", type=float, default=2.0)
+    bench.add_argument("--seed", type=int, default=1)
+
+    features_bench = sub.add_parser(
+        "features-bench", help="Ensamblado y escalado de features para 1 fila y un lote"
+    )
+    features_bench.add_argument("--rows", type=int, default=10000)
+    features_bench.add_argument("--seed", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        cases = [tuple(int(v) for v in case.split(":")) for case in args.cases]
+        asyncio.run(_bench(cases, args.latency_ms / 1000, args.seed))
+    elif args.command == "features-bench":
+        _features_bench_cli(args.rows, args.seed)
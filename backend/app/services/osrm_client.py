@@ -1,6 +1,12 @@
-import httpx
+import asyncio
 import os
-from typing import Literal
+from typing import List, Literal, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.http_clients import get_client, osrm_client_name
+from app.services.route_cache import ROUTE_CACHE, osrm_key
+from app.services.single_flight import ROUTE_FLIGHTS
 
 
 Profile = Literal["driving", "cycling", "foot"]
@@ -15,9 +21,30 @@ OSRM_BASE_URLS = {
     "foot": os.environ.get("OSRM_FOOT_URL", "http://127.0.0.1:5002"),
 }
 
+# Límite de coordenadas por petición /table (--max-table-size de osrm-routed,
+# 100 por defecto) y nº de trozos de la matriz que se piden a la vez.
+OSRM_MAX_TABLE_SIZE = int(os.environ.get("OSRM_MAX_TABLE_SIZE", "100"))
+OSRM_TABLE_CONCURRENCY = int(os.environ.get("OSRM_TABLE_CONCURRENCY", "4"))
 
 
 async def get_route(profile: Profile, lon1: float, lat1: float, lon2: float, lat2: float):
+    # Cacheado por (perfil, origen, destino) con coordenadas redondeadas;
+    # las peticiones idénticas en vuelo comparten una sola llamada a OSRM.
+    key = osrm_key(profile, lon1, lat1, lon2, lat2)
+    cached = await ROUTE_CACHE.aget(key)
+    # Las entradas antiguas (geometría como lista de puntos) se vuelven a pedir
+    if cached is not None and "polyline6" in cached:
+        return cached
+
+    async def fetch():
+        result = await _fetch_route(profile, lon1, lat1, lon2, lat2)
+        await ROUTE_CACHE.aset(key, result)
+        return result
+
+    return await ROUTE_FLIGHTS.do(key, fetch)
+
+
+async def _fetch_route(profile: Profile, lon1: float, lat1: float, lon2: float, lat2: float):
     # url = (
     #     f"{OSRM_BASE_URL}/route/v1/{profile}/"
     #     f"{lon1},{lat1};{lon2},{lat2}"
@@ -30,24 +57,228 @@ async def get_route(profile: Profile, lon1: float, lat1: float, lon2: float, lat
         f"{base}/route/v1/driving/"
         f"{lon1},{lat1};{lon2},{lat2}"
         "?overview=full&"
-        "geometries=geojson&"
+        # polyline6: mismas coordenadas que geojson (OSRM trabaja con 6
+        # decimales) en una cadena mucho más corta de leer y de cachear
+        "geometries=polyline6&"
         # "alternatives=false&"
         "annotations=duration,distance"
     )
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.get(url)
-        resp.raise_for_status()
-        data = resp.json()
+    client = get_client(osrm_client_name(profile))
+    resp = await client.get(url)
+    resp.raise_for_status()
+    data = resp.json()
 
     route = data["routes"][0]
 
-    coords = route["geometry"]["coordinates"]  # lista de [lon, lat]
-    path = [{"lat": lat, "lon": lon} for lon, lat in coords]  # la convertimos para Leaflet
-
+    # La geometría se guarda codificada; routes_osrm la convierte al formato
+    # que pida el cliente (geometry.decode_polyline(..., 6) para Leaflet)
     return {
         "profile": profile,
         "distance_m": route["distance"],
         "duration_s": route["duration"],
-        "geometry": path,
+        "polyline6": route["geometry"],
+    }
+
+
+async def _get_table_chunk(
+    profile: Profile,
+    sources: Sequence[Tuple[float, float]],
+    destinations: Optional[Sequence[Tuple[float, float]]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    base = OSRM_BASE_URLS[profile]
+    if destinations is None:
+        # Matriz cuadrada: cada coordenada va una sola vez y OSRM usa todas
+        # como origen y destino
+        coords = ";".join(f"{lon},{lat}" for lon, lat in sources)
+        url = f"{base}/table/v1/driving/{coords}?annotations=duration,distance"
+    else:
+        coords = ";".join(f"{lon},{lat}" for lon, lat in [*sources, *destinations])
+        n_src = len(sources)
+        src_idx = ";".join(str(i) for i in range(n_src))
+        dst_idx = ";".join(str(n_src + j) for j in range(len(destinations)))
+        url = (
+            f"{base}/table/v1/driving/{coords}"
+            f"?sources={src_idx}&destinations={dst_idx}"
+            "&annotations=duration,distance"
+        )
+
+    client = get_client(osrm_client_name(profile))
+    resp = await client.get(url)
+    resp.raise_for_status()
+    data = resp.json()
+    if data.get("code") != "Ok":
+        raise RuntimeError(f"Error OSRM table: {data.get('code')}")
+
+    # null (par sin ruta) -> NaN
+    durations = np.array(data["durations"], dtype=float)
+    distances = np.array(data.get("distances") or np.nan, dtype=float)
+    return durations, np.broadcast_to(distances, durations.shape)
+
+
+async def get_table(
+    profile: Profile,
+    sources: Sequence[Tuple[float, float]],
+    destinations: Optional[Sequence[Tuple[float, float]]] = None,
+) -> dict:
+    """
+    Matriz origen-destino con el servicio /table de OSRM.
+
+    `sources` y `destinations` son listas de (lon, lat); si no se indican
+    destinos (o son los mismos puntos) se usa la matriz cuadrada sobre
+    `sources`. Las matrices grandes se parten en bloques que respetan
+    OSRM_MAX_TABLE_SIZE y se piden en paralelo (OSRM_TABLE_CONCURRENCY a la
+    vez). En la matriz cuadrada, los bloques de la diagonal mandan cada
+    coordenada una sola vez y llegan al límite completo.
+
+    Devuelve arrays densos (len(sources) x len(destinations)) de duraciones
+    en segundos y distancias en metros, con NaN donde no hay ruta.
+    """
+    square = destinations is None or destinations is sources or list(destinations) == list(sources)
+    if destinations is None:
+        destinations = sources
+    n_src, n_dst = len(sources), len(destinations)
+    durations = np.full((n_src, n_dst), np.nan)
+    distances = np.full((n_src, n_dst), np.nan)
+
+    # Bloques (filas [i0, i1), columnas [j0, j1)) de hasta la mitad del
+    # límite por lado (orígenes + destinos). En la matriz cuadrada, la
+    # diagonal va en bloques de lado completo y el resto se parte en mitades
+    # dentro de cada par de bloques, recortadas al bloque (con un límite
+    # impar, la última mitad no debe invadir el bloque siguiente).
+    half = max(OSRM_MAX_TABLE_SIZE // 2, 1)
+    blocks: List[Tuple[int, int, int, int]] = []
+    if square:
+        full = max(OSRM_MAX_TABLE_SIZE, 1)
+        for i in range(0, n_src, full):
+            i_end = min(i + full, n_src)
+            for j in range(0, n_src, full):
+                j_end = min(j + full, n_src)
+                if i == j:
+                    blocks.append((i, i_end, j, j_end))
+                    continue
+                blocks.extend(
+                    (ii, min(ii + half, i_end), jj, min(jj + half, j_end))
+                    for ii in range(i, i_end, half)
+                    for jj in range(j, j_end, half)
+                )
+    else:
+        blocks = [
+            (i, min(i + half, n_src), j, min(j + half, n_dst))
+            for i in range(0, n_src, half)
+            for j in range(0, n_dst, half)
+        ]
+    sem = asyncio.Semaphore(OSRM_TABLE_CONCURRENCY)
+
+    async def fetch_block(i0: int, i1: int, j0: int, j1: int) -> None:
+        async with sem:
+            if square and i0 == j0:
+                dur, dist = await _get_table_chunk(profile, sources[i0:i1])
+            else:
+                dur, dist = await _get_table_chunk(
+                    profile, sources[i0:i1], destinations[j0:j1]
+                )
+        durations[i0:i1, j0:j1] = dur
+        distances[i0:i1, j0:j1] = dist
+
+    await asyncio.gather(*(fetch_block(*block) for block in blocks))
+
+    return {
+        "profile": profile,
+        "durations": durations,
+        "distances": distances,
     }
+
+
+# -----------------------
+# CLI: benchmark de /api/osrm/routes
+# -----------------------
+# bench: /api/osrm/routes a través de la app contra tres OSRM falsos (en
+# proceso, uno por perfil, con latencias distintas), con la caché de rutas
+# desactivada; perfiles uno detrás de otro (como antes) frente a en paralelo.
+# Después, con foot lento y un timeout corto, la respuesta parcial.
+
+async def _bench(n: int, latencies_ms: Sequence[float], slow_ms: float, slow_timeout_s: float) -> None:
+    import dataclasses
+    import time
+
+    import httpx
+
+    from app.api import routes_osrm
+    from app.main import app
+    from app.services import http_clients, osrm_client
+    from app.services.single_flight import _stub_server
+
+    profiles = ("driving", "cycling", "foot")
+    counter = {"upstream": 0}
+    servers = {}
+    for profile, latency_ms in zip(profiles, latencies_ms):
+        servers[profile] = await _stub_server(latency_ms / 1000, counter)
+        osrm_client.OSRM_BASE_URLS[profile] = "http://127.0.0.1:%d" % servers[profile].sockets[0].getsockname()[1]
+    ROUTE_CACHE.max_entries = 0
+    await http_clients.start()
+
+    body = {"origin": {"lat": 39.86, "lon": -4.03}, "destination": {"lat": 39.87, "lon": -4.0}}
+    request = routes_osrm.RouteRequest(**body)
+
+    async def sequential():
+        for profile in profiles:
+            await routes_osrm._fetch_profile(profile, request)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def concurrent():
+            resp = await client.post("/api/osrm/routes", json=body)
+            resp.raise_for_status()
+            return resp.json()
+
+        print(
+            f"{n} peticiones por caso; OSRM simulado: "
+            + ", ".join(f"{p} {ms:.0f} ms" for p, ms in zip(profiles, latencies_ms))
+        )
+        try:
+            for label, call in (("secuencial (antes)", sequential), ("en paralelo", concurrent)):
+                await call()
+                t0 = time.perf_counter()
+                for _ in range(n):
+                    await call()
+                print(f"  {label:<20} {(time.perf_counter() - t0) / n * 1000:6.0f} ms/petición")
+
+            # foot lento y con un timeout más corto que su latencia
+            servers["foot"].close()
+            servers["foot"] = await _stub_server(slow_ms / 1000, counter)
+            osrm_client.OSRM_BASE_URLS["foot"] = "http://127.0.0.1:%d" % servers["foot"].sockets[0].getsockname()[1]
+            name = http_clients.osrm_client_name("foot")
+            http_clients.BACKENDS[name] = dataclasses.replace(http_clients.BACKENDS[name], timeout_s=slow_timeout_s)
+            t0 = time.perf_counter()
+            data = await concurrent()
+            elapsed = time.perf_counter() - t0
+            print(
+                f"  foot a {slow_ms:.0f} ms con timeout {slow_timeout_s} s: {elapsed * 1000:.0f} ms, "
+                f"resultados {[r['profile'] for r in data['results']]}, "
+                f"errores {[(e['profile'], e['detail']) for e in data['errors']]}"
+            )
+        finally:
+            await http_clients.close()
+            for server in servers.values():
+                server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.osrm_client")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="/api/osrm/routes con los perfiles en secuencia y en paralelo")
+    bench.add_argument("-n", type=int, default=50)
+    bench.add_argument(
+        "--latency-ms", type=float, nargs=3, default=[50.0, 80.0, 120.0],
+        help="Latencia de driving, cycling y foot",
+    )
+    bench.add_argument("--slow-ms", type=float, default=3000.0, help="Latencia de foot en la prueba de timeout")
+    bench.add_argument("--slow-timeout-s", type=float, default=0.3)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        asyncio.run(_bench(args.n, args.latency_ms, args.slow_ms, args.slow_timeout_s))
@@ -0,0 +1,982 @@
+# backend/app/services/raptor.py
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date as Date, datetime, time as Time, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import polyline
+
+from app.services import gtfs_loader
+from app.services.gtfs_loader import (
+    GTFS_DATA,
+    GtfsData,
+    grid_candidates,
+    haversine_m,
+    METERS_PER_DEGREE,
+)
+
+# Enrutador RAPTOR (Round-bAsed Public Transit Optimized Router) sobre el
+# GTFS cargado en memoria, como alternativa en proceso a OTP.
+#
+# Cada ronda k calcula la llegada más temprana a cada parada usando como
+# mucho k vehículos. Los trips se agrupan en "patrones" (misma ruta, misma
+# secuencia de paradas y mismos pickup/drop-off) y las horas de cada
+# posición (patrón, parada) se guardan por columnas ordenadas, así que
+# "primer trip que sale después de t" es un searchsorted. Una ronda entera
+# se resuelve con operaciones NumPy sobre todas las posiciones a la vez.
+#
+# Caminatas: acceso/egreso y transbordos a pie en línea recta por un factor
+# de rodeo (RAPTOR_WALK_DETOUR) a RAPTOR_WALK_SPEED_MPS.
+RAPTOR_ACCESS_M = float(os.environ.get("RAPTOR_ACCESS_M", "1000"))
+RAPTOR_TRANSFER_M = float(os.environ.get("RAPTOR_TRANSFER_M", "300"))
+RAPTOR_MAX_WALK_M = float(os.environ.get("RAPTOR_MAX_WALK_M", "2000"))  # itinerario solo a pie
+RAPTOR_WALK_SPEED_MPS = float(os.environ.get("RAPTOR_WALK_SPEED_MPS", "1.2"))
+RAPTOR_WALK_DETOUR = float(os.environ.get("RAPTOR_WALK_DETOUR", "1.3"))
+RAPTOR_MIN_CHANGE_S = int(os.environ.get("RAPTOR_MIN_CHANGE_S", "60"))
+RAPTOR_MAX_TRANSFERS = int(os.environ.get("RAPTOR_MAX_TRANSFERS", "3"))
+
+# route_type GTFS -> modo OTP (los tipos extendidos se agrupan por centena)
+_ROUTE_TYPE_MODES = {0: "TRAM", 1: "SUBWAY", 2: "RAIL", 3: "BUS", 4: "FERRY",
+                     5: "CABLE_CAR", 6: "GONDOLA", 7: "FUNICULAR", 11: "TROLLEYBUS", 12: "MONORAIL"}
+_EXTENDED_TYPE_MODES = {1: "RAIL", 2: "BUS", 4: "SUBWAY", 7: "BUS", 8: "TROLLEYBUS", 9: "TRAM",
+                        10: "FERRY", 13: "GONDOLA", 14: "FUNICULAR"}
+
+# Horas en segundos < 2^20 (~12 días): clave de búsqueda posición * _SPAN + hora
+_SPAN = 1 << 20
+INF = 1 << 30
+_DAY_S = 24 * 3600
+
+
+def walk_seconds(meters: np.ndarray | float) -> np.ndarray | float:
+    """Segundos a pie para una distancia en línea recta (con RAPTOR_WALK_DETOUR)."""
+    return meters * RAPTOR_WALK_DETOUR / RAPTOR_WALK_SPEED_MPS
+
+
+def _path_length_m(lats: np.ndarray, lons: np.ndarray) -> float:
+    """Longitud (haversine) de una polilínea."""
+    if len(lats) < 2:
+        return 0.0
+    phi = np.radians(lats)
+    dphi = np.diff(phi)
+    dlmb = np.diff(np.radians(lons))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(dlmb / 2) ** 2
+    return float((2 * gtfs_loader.EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).sum())
+
+
+def _route_mode(route_type: Optional[int]) -> str:
+    if route_type is None:
+        return "BUS"
+    if route_type < 100:
+        return _ROUTE_TYPE_MODES.get(route_type, "BUS")
+    return _EXTENDED_TYPE_MODES.get(route_type // 100, "BUS")
+
+
+# -----------------------
+# Red base (independiente del día)
+# -----------------------
+
+@dataclass
+class _Network:
+    # Patrones: CSR patrón -> paradas, con permisos de subida/bajada
+    pat_route: np.ndarray  # int32 -> route_ids
+    pat_stop_offsets: np.ndarray  # int64, n_patrones + 1
+    pat_stops: np.ndarray  # int32 -> stop_ids
+    pat_board: np.ndarray  # bool, por posición
+    pat_alight: np.ndarray  # bool, por posición
+    # CSR patrón -> trips, ordenados por hora sin adelantamientos
+    pat_trip_offsets: np.ndarray  # int64, n_patrones + 1
+    pat_trips: np.ndarray  # int32 -> trip_ids
+    # Horas por (trip, posición), fila a fila dentro de cada patrón
+    pat_time_offsets: np.ndarray  # int64, n_patrones + 1
+    arr_s: np.ndarray  # int32
+    dep_s: np.ndarray  # int32
+    # Transbordos a pie (origen, destino, segundos), ordenados por destino;
+    # fp_to_stops / fp_to_starts: destinos distintos y dónde empieza cada uno
+    fp_from: np.ndarray  # int64
+    fp_to: np.ndarray  # int64
+    fp_s: np.ndarray  # int64
+    fp_to_stops: np.ndarray  # int64
+    fp_to_starts: np.ndarray  # int64
+
+
+def _fill_times(arr: np.ndarray, dep: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Completa horas vacías (-1): la otra hora de la parada o interpolación lineal."""
+    arr = np.where(arr < 0, dep, arr)
+    dep = np.where(dep < 0, arr, dep)
+    for row in np.flatnonzero((arr < 0).any(axis=1)):
+        known = np.flatnonzero(arr[row] >= 0)
+        if len(known) < 2:
+            continue
+        filled = np.interp(np.arange(arr.shape[1]), known, arr[row, known]).astype(arr.dtype)
+        arr[row] = np.where(arr[row] < 0, filled, arr[row])
+        dep[row] = np.where(dep[row] < 0, filled, dep[row])
+    return arr, dep
+
+
+def _build_network(data: GtfsData) -> _Network:
+    offsets = data.trip_stop_offsets.tolist()
+    st_stop = data.st_stop
+    pickup = data.st_pickup_type
+    drop_off = data.st_drop_off_type
+
+    groups: Dict[tuple, List[int]] = {}
+    for t in range(len(data.trip_ids)):
+        lo, hi = offsets[t], offsets[t + 1]
+        if hi - lo < 2:
+            continue
+        key = (
+            int(data.trip_route[t]),
+            st_stop[lo:hi].tobytes(),
+            pickup[lo:hi].tobytes(),
+            drop_off[lo:hi].tobytes(),
+        )
+        groups.setdefault(key, []).append(t)
+
+    pat_route, pat_stops, pat_board, pat_alight, pat_trips = [], [], [], [], []
+    pat_arr, pat_dep = [], []
+    for (route, stops_b, pickup_b, drop_b), trips in groups.items():
+        stops = np.frombuffer(stops_b, dtype=np.int32)
+        m = len(stops)
+        trips_arr = np.array(trips, dtype=np.int64)
+        rows = data.trip_stop_offsets[trips_arr][:, None] + np.arange(m)
+        arr, dep = _fill_times(data.st_arrival_s[rows], data.st_departure_s[rows])
+        timed = (arr >= 0).all(axis=1)
+        trips_arr, arr, dep = trips_arr[timed], arr[timed], dep[timed]
+        order = np.lexsort((arr[:, -1], dep[:, 0]))
+
+        # RAPTOR necesita trips que no se adelantan dentro de un patrón: si
+        # uno adelanta a otro, va a un subpatrón distinto.
+        subs: List[List[int]] = []
+        for row in order.tolist():
+            for sub in subs:
+                last = sub[-1]
+                if (arr[last] <= arr[row]).all() and (dep[last] <= dep[row]).all():
+                    sub.append(row)
+                    break
+            else:
+                subs.append([row])
+
+        board = np.frombuffer(pickup_b, dtype=np.int8) != 1
+        alight = np.frombuffer(drop_b, dtype=np.int8) != 1
+        for sub in subs:
+            pat_route.append(route)
+            pat_stops.append(stops)
+            pat_board.append(board)
+            pat_alight.append(alight)
+            pat_trips.append(trips_arr[sub].astype(np.int32))
+            pat_arr.append(arr[sub].ravel())
+            pat_dep.append(dep[sub].ravel())
+
+    def _offsets(parts: List[np.ndarray]) -> np.ndarray:
+        out = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=out[1:])
+        return out
+
+    def _concat(parts: List[np.ndarray], dtype) -> np.ndarray:
+        return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+    return _Network(
+        pat_route=np.array(pat_route, dtype=np.int32),
+        pat_stop_offsets=_offsets(pat_stops),
+        pat_stops=_concat(pat_stops, np.int32),
+        pat_board=_concat(pat_board, bool),
+        pat_alight=_concat(pat_alight, bool),
+        pat_trip_offsets=_offsets(pat_trips),
+        pat_trips=_concat(pat_trips, np.int32),
+        pat_time_offsets=_offsets(pat_arr),
+        arr_s=_concat(pat_arr, np.int32),
+        dep_s=_concat(pat_dep, np.int32),
+        **_build_footpaths(data),
+    )
+
+
+def _build_footpaths(data: GtfsData) -> dict:
+    """Pares de paradas a menos de RAPTOR_TRANSFER_M metros (sin la propia parada)."""
+    dlat = RAPTOR_TRANSFER_M / METERS_PER_DEGREE
+    dlon = RAPTOR_TRANSFER_M / max(float(data.stop_grid[6]), 1e-6)
+
+    from_parts: List[np.ndarray] = []
+    to_parts: List[np.ndarray] = []
+    m_parts: List[np.ndarray] = []
+    for s in range(len(data.stop_lat)):
+        lat, lon = float(data.stop_lat[s]), float(data.stop_lon[s])
+        idx = grid_candidates(data, lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        dist = haversine_m(lat, lon, data.stop_lat[idx], data.stop_lon[idx])
+        keep = (dist <= RAPTOR_TRANSFER_M) & (idx != s)
+        from_parts.append(np.full(int(keep.sum()), s, dtype=np.int64))
+        to_parts.append(idx[keep].astype(np.int64))
+        m_parts.append(dist[keep])
+
+    fp_from = np.concatenate(from_parts) if from_parts else np.zeros(0, dtype=np.int64)
+    fp_to = np.concatenate(to_parts) if to_parts else np.zeros(0, dtype=np.int64)
+    fp_m = np.concatenate(m_parts) if m_parts else np.zeros(0)
+    order = np.lexsort((fp_from, fp_to))
+    fp_to = fp_to[order]
+    starts = np.flatnonzero(np.r_[True, fp_to[1:] != fp_to[:-1]]) if len(fp_to) else fp_to[:0]
+    return {
+        "fp_from": fp_from[order],
+        "fp_to": fp_to,
+        "fp_s": np.ceil(walk_seconds(fp_m[order])).astype(np.int64),
+        "fp_to_stops": fp_to[starts],
+        "fp_to_starts": starts.astype(np.int64),
+    }
+
+
+_NETWORK: Optional[_Network] = None
+_NETWORK_LOCK = threading.Lock()
+
+
+def network() -> _Network:
+    """Red base (patrones y transbordos), construida una vez por proceso."""
+    global _NETWORK
+    if _NETWORK is None:
+        with _NETWORK_LOCK:
+            if _NETWORK is None:
+                _NETWORK = _build_network(GTFS_DATA)
+    return _NETWORK
+
+
+# -----------------------
+# Red del día (trips con servicio)
+# -----------------------
+
+@dataclass
+class _DayNetwork:
+    # Posiciones (patrón, índice en el patrón) de los patrones con servicio
+    pos_stop: np.ndarray  # int64 -> stop_ids
+    pos_pattern: np.ndarray  # int64, patrón del día
+    pos_index: np.ndarray  # int64, índice dentro del patrón
+    pos_board: np.ndarray  # bool
+    pos_alight: np.ndarray  # bool
+    pattern_pos_offsets: np.ndarray  # int64, n_patrones_día + 1
+    pattern_route: np.ndarray  # int32 -> route_ids
+    # CSR patrón del día -> trips activos, en orden de salida
+    pattern_trip_offsets: np.ndarray  # int64
+    pattern_trips: np.ndarray  # int32 -> trip_ids
+    # Columnas de horas por posición (una fila por trip activo del patrón)
+    col_offsets: np.ndarray  # int64, n_posiciones + 1
+    col_arr: np.ndarray  # int64
+    col_dep: np.ndarray  # int64
+    col_key: np.ndarray  # int64, posición * _SPAN + salida (orden global)
+    key_stride: int  # > índice máximo en un patrón
+    key_span: int  # > clave (trip, índice) máxima
+    last_dep: int  # última salida del día (-1 sin trips)
+
+
+@lru_cache(maxsize=16)
+def _day_network(pattern: bytes) -> _DayNetwork:
+    """Red con los trips de los servicios activos de un patrón de calendario."""
+    data = GTFS_DATA
+    net = network()
+    service_active = np.unpackbits(
+        np.frombuffer(pattern, dtype=np.uint8), count=len(data.service_ids)
+    ).astype(bool)
+    services = data.trip_service[net.pat_trips]
+    trip_active = np.ones(len(net.pat_trips), dtype=bool)
+    with_service = services >= 0
+    trip_active[with_service] = service_active[services[with_service]]
+
+    pos_stop, pos_pattern, pos_index, pos_board, pos_alight = [], [], [], [], []
+    pattern_route, pattern_trips, col_arr, col_dep, col_len = [], [], [], [], []
+    for p in range(len(net.pat_route)):
+        t_lo, t_hi = int(net.pat_trip_offsets[p]), int(net.pat_trip_offsets[p + 1])
+        active = trip_active[t_lo:t_hi]
+        n_active = int(active.sum())
+        if not n_active:
+            continue
+        s_lo, s_hi = int(net.pat_stop_offsets[p]), int(net.pat_stop_offsets[p + 1])
+        m = s_hi - s_lo
+        times = slice(int(net.pat_time_offsets[p]), int(net.pat_time_offsets[p + 1]))
+        arr = net.arr_s[times].reshape(-1, m)[active]
+        dep = net.dep_s[times].reshape(-1, m)[active]
+
+        day_p = len(pattern_route)
+        pattern_route.append(int(net.pat_route[p]))
+        pattern_trips.append(net.pat_trips[t_lo:t_hi][active])
+        pos_stop.append(net.pat_stops[s_lo:s_hi])
+        pos_pattern.append(np.full(m, day_p, dtype=np.int64))
+        pos_index.append(np.arange(m, dtype=np.int64))
+        pos_board.append(net.pat_board[s_lo:s_hi])
+        pos_alight.append(net.pat_alight[s_lo:s_hi])
+        # Por columnas: las horas de cada posición quedan contiguas
+        col_arr.append(arr.T.ravel())
+        col_dep.append(dep.T.ravel())
+        col_len.append(np.full(m, n_active, dtype=np.int64))
+
+    def _cat(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+    pos_stop_arr = _cat(pos_stop, np.int64)
+    lengths = _cat(col_len, np.int64)
+    col_offsets = np.zeros(len(pos_stop_arr) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=col_offsets[1:])
+    col_dep_arr = _cat(col_dep, np.int64)
+    col_pos = np.repeat(np.arange(len(pos_stop_arr), dtype=np.int64), lengths)
+
+    trip_counts = [len(t) for t in pattern_trips]
+    pattern_trip_offsets = np.zeros(len(trip_counts) + 1, dtype=np.int64)
+    np.cumsum(trip_counts, out=pattern_trip_offsets[1:])
+    pattern_pos_offsets = np.zeros(len(pos_stop) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in pos_stop], out=pattern_pos_offsets[1:])
+
+    key_stride = max((len(s) for s in pos_stop), default=0) + 1
+    return _DayNetwork(
+        pos_stop=pos_stop_arr,
+        pos_pattern=_cat(pos_pattern, np.int64),
+        pos_index=_cat(pos_index, np.int64),
+        pos_board=_cat(pos_board, bool),
+        pos_alight=_cat(pos_alight, bool),
+        pattern_pos_offsets=pattern_pos_offsets,
+        pattern_route=np.array(pattern_route, dtype=np.int32),
+        pattern_trip_offsets=pattern_trip_offsets,
+        pattern_trips=_cat(pattern_trips, np.int32),
+        col_offsets=col_offsets,
+        col_arr=_cat(col_arr, np.int64),
+        col_dep=col_dep_arr,
+        col_key=col_pos * _SPAN + col_dep_arr,
+        key_stride=key_stride,
+        key_span=(max(trip_counts, default=0) + 1) * key_stride,
+        last_dep=int(col_dep_arr.max()) if len(col_dep_arr) else -1,
+    )
+
+
+# -----------------------
+# Búsqueda
+# -----------------------
+
+@dataclass
+class _Labels:
+    """Etiquetas por ronda de una búsqueda desde un origen."""
+
+    # Ronda r >= 1: llegada en vehículo y posición de bajada / trip / índice
+    # de subida (solo paradas que mejoran en esa ronda; INF en el resto).
+    trip_arr: List[np.ndarray]
+    trip_pos: List[np.ndarray]
+    trip_rank: List[np.ndarray]
+    trip_board: List[np.ndarray]
+    # Nivel r >= 0: hora a la que se puede subir en cada parada con como
+    # mucho r vehículos, la ronda que la fijó y la parada desde la que se
+    # llegó (-1: desde el origen a pie).
+    ready: List[np.ndarray]
+    ready_round: List[np.ndarray]
+    ready_src: List[np.ndarray]
+
+
+def nearby_stops(data: GtfsData, lat: float, lon: float, meters: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Paradas a menos de `meters` y segundos a pie hasta ellas."""
+    dlat = meters / METERS_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 1e-6)
+    dlon = meters / (METERS_PER_DEGREE * cos_lat)
+    idx = grid_candidates(data, lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+    dist = haversine_m(lat, lon, data.stop_lat[idx], data.stop_lon[idx])
+    keep = dist <= meters
+    return idx[keep].astype(np.int64), np.ceil(walk_seconds(dist[keep])).astype(np.int64)
+
+
+def _search(
+    day: _DayNetwork,
+    net: _Network,
+    n_stops: int,
+    access_stops: np.ndarray,
+    access_s: np.ndarray,
+    depart_s: int,
+    max_rounds: int,
+) -> _Labels:
+    ready = np.full(n_stops, INF, dtype=np.int64)
+    np.minimum.at(ready, access_stops, depart_s + access_s)
+    ready_round = np.where(ready < INF, 0, -1).astype(np.int64)
+    ready_src = np.full(n_stops, -1, dtype=np.int64)
+    marked = ready < INF
+
+    labels = _Labels([], [], [], [], [ready.copy()], [ready_round.copy()], [ready_src.copy()])
+    best_trip = np.full(n_stops, INF, dtype=np.int64)
+    stride, span = day.key_stride, day.key_span
+    n_pos = len(day.pos_stop)
+    # Clave "sin trip" de cada posición; el desplazamiento negativo por patrón
+    # hace que minimum.accumulate no arrastre valores entre patrones.
+    empty = -day.pos_pattern * span + (span - 1)
+    first_in_pattern = day.pos_index == 0
+    pos_ids = np.arange(n_pos, dtype=np.int64)
+    stop_ids = np.arange(n_stops, dtype=np.int64)
+
+    for r in range(1, max_rounds + 1):
+        if not n_pos or not marked.any():
+            break
+
+        # 1. Primer trip que se puede coger en cada posición marcada
+        ks = np.flatnonzero(marked[day.pos_stop] & day.pos_board)
+        bound = ready[day.pos_stop[ks]]
+        idx = np.searchsorted(day.col_key, ks * _SPAN + bound)
+        rank = idx - day.col_offsets[ks]
+        ok = idx < day.col_offsets[ks + 1]
+        ks, rank = ks[ok], rank[ok]
+        key = empty.copy()
+        key[ks] = -day.pos_pattern[ks] * span + rank * stride + day.pos_index[ks]
+
+        # 2. En cada posición, el trip más temprano subido antes en el patrón
+        carried = np.minimum.accumulate(key) + day.pos_pattern * span
+        onboard = np.empty(n_pos, dtype=np.int64)
+        onboard[0:1] = span - 1
+        onboard[1:] = carried[:-1]
+        onboard[first_in_pattern] = span - 1
+        vk = np.flatnonzero((onboard < span - 1) & day.pos_alight)
+        v_rank = onboard[vk] // stride
+        v_board = onboard[vk] % stride
+        arrival = day.col_arr[day.col_offsets[vk] + v_rank]
+
+        # 3. Mejor llegada por parada (y la posición que la da)
+        enc = np.full(n_stops, INF * (n_pos + 1), dtype=np.int64)
+        np.minimum.at(enc, day.pos_stop[vk], arrival * (n_pos + 1) + pos_ids[vk])
+        stop_arr = enc // (n_pos + 1)
+        improved = stop_arr < best_trip
+        best_trip = np.minimum(best_trip, stop_arr)
+
+        trip_arr = np.where(improved, stop_arr, INF)
+        trip_pos = np.where(improved, enc % (n_pos + 1), -1)
+        by_pos_rank = np.zeros(n_pos, dtype=np.int64)
+        by_pos_board = np.zeros(n_pos, dtype=np.int64)
+        by_pos_rank[vk] = v_rank
+        by_pos_board[vk] = v_board
+        safe_pos = np.maximum(trip_pos, 0)
+        labels.trip_arr.append(trip_arr)
+        labels.trip_pos.append(trip_pos)
+        labels.trip_rank.append(np.where(improved, by_pos_rank[safe_pos], -1))
+        labels.trip_board.append(np.where(improved, by_pos_board[safe_pos], -1))
+
+        # 4. Transbordos: cambio en la misma parada o a pie a otra cercana.
+        # Una pasada sobre todos los tramos a pie (ordenados por destino)
+        # sale más barata que reunir los de las paradas mejoradas.
+        enc_ready = (trip_arr + RAPTOR_MIN_CHANGE_S) * (n_stops + 1) + stop_ids
+        if len(net.fp_to_stops):
+            enc_walk = (trip_arr[net.fp_from] + net.fp_s) * (n_stops + 1) + net.fp_from
+            walk_best = np.minimum.reduceat(enc_walk, net.fp_to_starts)
+            enc_ready[net.fp_to_stops] = np.minimum(enc_ready[net.fp_to_stops], walk_best)
+        new_ready = enc_ready // (n_stops + 1)
+        marked = new_ready < ready
+        ready = np.where(marked, new_ready, ready)
+        ready_round = np.where(marked, r, ready_round)
+        ready_src = np.where(marked, enc_ready % (n_stops + 1), ready_src)
+        labels.ready.append(ready.copy())
+        labels.ready_round.append(ready_round.copy())
+        labels.ready_src.append(ready_src.copy())
+
+    return labels
+
+
+def earliest_arrivals(
+    day: _DayNetwork,
+    net: _Network,
+    start: np.ndarray,
+    max_rounds: int,
+    bounds: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Las mismas rondas que _search, sin etiquetas para reconstruir viajes y
+    con varias búsquedas a la vez: cada columna de `start` (n_paradas,
+    n_búsquedas) es la hora a la que se llega a pie a cada parada desde un
+    origen y una hora de salida (INF donde no se llega). Devuelve
+    (max_rounds, n_paradas, n_búsquedas): la llegada en vehículo más
+    temprana a cada parada con como mucho r + 1 vehículos (como trip_arr en
+    _search; el egreso a pie lo añade quien llama).
+
+    `bounds`, con la misma forma, son llegadas de una salida posterior desde
+    el mismo origen (range RAPTOR): también valen para esta salida
+    esperando en el origen, así que solo se propagan las llegadas que las
+    mejoran con el mismo número de vehículos.
+
+    Las búsquedas van en el eje rápido: cada operación por posición o por
+    tramo a pie trabaja sobre una fila contigua con todas las búsquedas.
+    """
+    n_stops, n_cols = start.shape
+    n_pos = len(day.pos_stop)
+    stride, span = day.key_stride, day.key_span
+    empty = (-day.pos_pattern * span + (span - 1))[:, None]
+    pattern_base = (day.pos_pattern * span)[:, None]
+    first_in_pattern = day.pos_index == 0
+    can_board = day.pos_board[:, None]
+    can_alight = day.pos_alight[:, None]
+
+    by_round = np.full((max_rounds, n_stops, n_cols), INF, dtype=np.int64)
+    ready = start.copy()
+    best_trip = np.full_like(start, INF)
+    marked = ready < INF
+    for r in range(max_rounds):
+        bound = best_trip if bounds is None else np.minimum(best_trip, bounds[r])
+        if not n_pos or not marked.any():
+            by_round[r] = bound
+            continue
+
+        ks, cols = np.nonzero(marked[day.pos_stop] & can_board)
+        idx = np.searchsorted(day.col_key, ks * _SPAN + ready[day.pos_stop[ks], cols])
+        ok = idx < day.col_offsets[ks + 1]
+        ks, cols, idx = ks[ok], cols[ok], idx[ok]
+        key = np.repeat(empty, n_cols, axis=1)
+        key[ks, cols] = -day.pos_pattern[ks] * span + (idx - day.col_offsets[ks]) * stride + day.pos_index[ks]
+
+        carried = np.minimum.accumulate(key, axis=0) + pattern_base
+        onboard = np.empty_like(carried)
+        onboard[0] = span - 1
+        onboard[1:] = carried[:-1]
+        onboard[first_in_pattern] = span - 1
+        vk, cols = np.nonzero((onboard < span - 1) & can_alight)
+        arrival = day.col_arr[day.col_offsets[vk] + onboard[vk, cols] // stride]
+
+        trip_arr = np.full(n_stops * n_cols, INF, dtype=np.int64)
+        np.minimum.at(trip_arr, day.pos_stop[vk] * n_cols + cols, arrival)
+        trip_arr = trip_arr.reshape(n_stops, n_cols)
+        trip_arr = np.where(trip_arr < bound, trip_arr, INF)
+        best_trip = np.minimum(best_trip, trip_arr)
+        by_round[r] = np.minimum(bound, trip_arr)
+
+        # Transbordos: solo los tramos que salen de paradas mejoradas en
+        # alguna búsqueda (siguen ordenados por destino), en int32
+        new_ready = trip_arr + RAPTOR_MIN_CHANGE_S
+        edges = np.flatnonzero((trip_arr < INF).any(axis=1)[net.fp_from])
+        if len(edges):
+            to = net.fp_to[edges]
+            starts = np.flatnonzero(np.r_[True, to[1:] != to[:-1]])
+            walk = trip_arr.astype(np.int32)[net.fp_from[edges]] + net.fp_s[edges].astype(np.int32)[:, None]
+            walk_best = np.minimum.reduceat(walk, starts, axis=0)
+            new_ready[to[starts]] = np.minimum(new_ready[to[starts]], walk_best)
+        marked = new_ready < ready
+        ready = np.minimum(ready, new_ready)
+
+    return by_round
+
+
+# -----------------------
+# Itinerarios (formato OTP)
+# -----------------------
+
+def _place(data: GtfsData, stop: Optional[int] = None, lat: float = 0.0, lon: float = 0.0, name: str = "") -> dict:
+    if stop is None:
+        return {"name": name, "lat": lat, "lon": lon}
+    stop_id = data.stop_ids[stop]
+    meta = data.stops.get(stop_id) or {}
+    return {"name": meta.get("name") or stop_id, "stopId": stop_id, "lat": meta.get("lat"), "lon": meta.get("lon")}
+
+
+def _walk_leg(start: dict, end: dict, start_s: int, geometry: bool = True) -> dict:
+    meters = float(haversine_m(start["lat"], start["lon"], np.array([end["lat"]]), np.array([end["lon"]]))[0])
+    duration = int(math.ceil(walk_seconds(meters)))
+    leg = {
+        "mode": "WALK",
+        "transitLeg": False,
+        "distance": meters * RAPTOR_WALK_DETOUR,
+        "duration": float(duration),
+        "from": start,
+        "to": end,
+        "start_s": start_s,
+        "end_s": start_s + duration,
+    }
+    if geometry:
+        leg["legGeometry"] = {"points": polyline.encode([(start["lat"], start["lon"]), (end["lat"], end["lon"])])}
+    return leg
+
+
+def _transit_leg(
+    data: GtfsData, day: _DayNetwork, board_k: int, alight_k: int, rank: int, geometry: bool = True
+) -> dict:
+    p = int(day.pos_pattern[board_k])
+    trip = int(day.pattern_trips[day.pattern_trip_offsets[p] + rank])
+    route_id = data.route_ids[int(day.pattern_route[p])]
+    route = data.routes.get(route_id) or {}
+    dep = int(day.col_dep[day.col_offsets[board_k] + rank])
+    arr = int(day.col_arr[day.col_offsets[alight_k] + rank])
+    stops = day.pos_stop[board_k : alight_k + 1]
+    located = stops[stops < len(data.stop_lat)]
+    lats, lons = data.stop_lat[located], data.stop_lon[located]
+    distance = _path_length_m(lats, lons)
+    headsign = int(data.trip_headsign[trip])
+    leg = {
+        "mode": _route_mode(route.get("type")),
+        "transitLeg": True,
+        "distance": distance,
+        "duration": float(arr - dep),
+        "from": _place(data, int(stops[0])),
+        "to": _place(data, int(stops[-1])),
+        "start_s": dep,
+        "end_s": arr,
+        "routeId": route_id,
+        "routeShortName": route.get("short_name"),
+        "routeLongName": route.get("long_name"),
+        "tripId": data.trip_ids[trip],
+        "headsign": data.headsigns[headsign] if headsign >= 0 else None,
+    }
+    if geometry:
+        leg["legGeometry"] = {"points": polyline.encode(list(zip(lats.tolist(), lons.tolist())))}
+    return leg
+
+
+def _journey(
+    data: GtfsData,
+    day: _DayNetwork,
+    labels: _Labels,
+    r: int,
+    stop: int,
+    origin: dict,
+    destination: dict,
+    geometry: bool = True,
+) -> dict:
+    """Reconstruye el viaje que llega en vehículo a `stop` en la ronda r."""
+    legs: List[dict] = []
+    arrival = int(labels.trip_arr[r - 1][stop])
+    legs.append(_walk_leg(_place(data, stop), destination, arrival, geometry))
+    while r >= 1:
+        alight_k = int(labels.trip_pos[r - 1][stop])
+        rank = int(labels.trip_rank[r - 1][stop])
+        p = int(day.pos_pattern[alight_k])
+        board_k = int(day.pattern_pos_offsets[p] + labels.trip_board[r - 1][stop])
+        leg = _transit_leg(data, day, board_k, alight_k, rank, geometry)
+        legs.append(leg)
+        board_stop = int(day.pos_stop[board_k])
+        q = int(labels.ready_round[r - 1][board_stop])
+        src = int(labels.ready_src[r - 1][board_stop])
+        if q == 0:
+            access = _walk_leg(origin, _place(data, board_stop), 0, geometry)
+            shift = leg["start_s"] - access["end_s"]
+            access["start_s"] += shift
+            access["end_s"] += shift
+            legs.append(access)
+            break
+        if src != board_stop:
+            prev_arrival = int(labels.trip_arr[q - 1][src])
+            legs.append(_walk_leg(_place(data, src), _place(data, board_stop), prev_arrival, geometry))
+        r, stop = q, src
+    legs.reverse()
+    return _itinerary(legs)
+
+
+def _itinerary(legs: List[dict]) -> dict:
+    start_s, end_s = legs[0]["start_s"], legs[-1]["end_s"]
+    walk_time = sum(leg["duration"] for leg in legs if not leg["transitLeg"])
+    n_transit = sum(1 for leg in legs if leg["transitLeg"])
+    return {
+        "duration": float(end_s - start_s),
+        "start_s": start_s,
+        "end_s": end_s,
+        "walkTime": float(walk_time),
+        "walkDistance": float(sum(leg["distance"] for leg in legs if not leg["transitLeg"])),
+        "transitTime": float(sum(leg["duration"] for leg in legs if leg["transitLeg"])),
+        "waitingTime": float(end_s - start_s - sum(leg["duration"] for leg in legs)),
+        "transfers": max(n_transit - 1, 0),
+        "legs": legs,
+    }
+
+
+def _with_epoch(itinerary: dict, service_day: Date) -> dict:
+    """Añade startTime/endTime en ms epoch (hora local), como OTP."""
+    midnight_ms = int(datetime.combine(service_day, Time()).timestamp() * 1000)
+    for item in (itinerary, *itinerary["legs"]):
+        item["startTime"] = midnight_ms + item.pop("start_s") * 1000
+        item["endTime"] = midnight_ms + item.pop("end_s") * 1000
+    return itinerary
+
+
+def _itineraries_to(
+    data: GtfsData,
+    day: _DayNetwork,
+    labels: _Labels,
+    origin: dict,
+    destination: dict,
+    depart_s: int,
+    geometry: bool = True,
+    walk: bool = True,
+) -> List[dict]:
+    """Itinerarios Pareto (llegada, nº de vehículos) hasta un destino."""
+    egress_stops, egress_s = nearby_stops(data, destination["lat"], destination["lon"], RAPTOR_ACCESS_M)
+    found: List[dict] = []
+    best = INF
+    for r in range(1, len(labels.trip_arr) + 1):
+        if not len(egress_stops):
+            break
+        total = labels.trip_arr[r - 1][egress_stops] + egress_s
+        j = int(np.argmin(total))
+        if total[j] < best:
+            best = int(total[j])
+            found.append(_journey(data, day, labels, r, int(egress_stops[j]), origin, destination, geometry))
+
+    if walk:
+        leg = _walk_leg(origin, destination, depart_s, geometry)
+        if leg["distance"] <= RAPTOR_MAX_WALK_M:
+            found.append(_itinerary([leg]))
+    return found
+
+
+def _pareto(itineraries: List[dict]) -> List[dict]:
+    """Quita los itinerarios en vehículo dominados en (llegada, transbordos)."""
+    transit = [it for it in itineraries if any(leg["transitLeg"] for leg in it["legs"])]
+    kept: List[dict] = []
+    best = None
+    for it in sorted(transit, key=lambda it: (it["transfers"], it["endTime"])):
+        if best is None or it["endTime"] < best:
+            best = it["endTime"]
+            kept.append(it)
+    return kept + [it for it in itineraries if not any(leg["transitLeg"] for leg in it["legs"])]
+
+
+def service_day_network(service_day: Date) -> _DayNetwork:
+    """Red con los trips de un día de servicio (compartida entre días de igual calendario)."""
+    return _day_network(gtfs_loader.service_pattern(service_day))
+
+
+def plan(
+    from_lat: float,
+    from_lon: float,
+    to_lat: float,
+    to_lon: float,
+    when: datetime,
+    max_transfers: Optional[int] = None,
+) -> List[dict]:
+    """
+    Itinerarios en transporte público saliendo a partir de `when`, en el
+    formato de /plan de OTP (legs con mode, duration, distance, from/to,
+    routeShortName, legGeometry, startTime/endTime...) y ordenados por
+    duración. Incluye el itinerario solo a pie si no supera
+    RAPTOR_MAX_WALK_M. Además de los trips del día de servicio de `when`
+    se consideran los del día anterior que pasan de medianoche (horas GTFS
+    de 24:00:00 en adelante), como en gtfs_loader.stop_departures().
+    """
+    return plan_many(from_lat, from_lon, [(to_lat, to_lon)], when, max_transfers)[0]
+
+
+def plan_many(
+    from_lat: float,
+    from_lon: float,
+    destinations: List[Tuple[float, float]],
+    when: datetime,
+    max_transfers: Optional[int] = None,
+    geometry: bool = True,
+) -> List[List[dict]]:
+    """
+    Como plan(), pero hacia varios destinos (lat, lon) con una sola búsqueda.
+    Con geometry=False los legs no llevan legGeometry (codificar polylines es
+    la mayor parte del coste cuando solo interesan duraciones).
+    """
+    data = GTFS_DATA
+    net = network()
+    service_day = when.date()
+    day = service_day_network(service_day)
+    depart_s = when.hour * 3600 + when.minute * 60 + when.second
+    rounds = (RAPTOR_MAX_TRANSFERS if max_transfers is None else max_transfers) + 1
+
+    origin = {"name": "Origen", "lat": from_lat, "lon": from_lon}
+    access_stops, access_s = nearby_stops(data, from_lat, from_lon, RAPTOR_ACCESS_M)
+    # (día de servicio, red, salida relativa a ese día): el anterior solo si
+    # tiene trips después de la hora de salida desplazada 24 h.
+    searches = [(service_day, day, depart_s)]
+    prev_day = service_day - timedelta(days=1)
+    prev = service_day_network(prev_day)
+    if prev.last_dep >= depart_s + _DAY_S:
+        searches.append((prev_day, prev, depart_s + _DAY_S))
+    labels = [
+        _search(d, net, len(data.stop_ids), access_stops, access_s, s, rounds) for _, d, s in searches
+    ]
+
+    results = []
+    for to_lat, to_lon in destinations:
+        destination = {"name": "Destino", "lat": to_lat, "lon": to_lon}
+        itineraries = []
+        for k, ((sday, d, s), lab) in enumerate(zip(searches, labels)):
+            # El itinerario a pie solo una vez (la red del día anterior puede
+            # ser el mismo objeto si el calendario coincide)
+            found = _itineraries_to(data, d, lab, origin, destination, s, geometry, walk=k == 0)
+            itineraries.extend(_with_epoch(it, sday) for it in found)
+        if len(searches) > 1:
+            itineraries = _pareto(itineraries)
+        itineraries.sort(key=lambda it: it["duration"])
+        results.append(itineraries)
+    return results
+
+
+def warm_up() -> None:
+    """Construye la red base (patrones y transbordos) antes de la primera consulta."""
+    network()
+
+
+# -----------------------
+# CLI: comparación con OTP y benchmark
+# -----------------------
+# record:  guarda respuestas reales de OTP para pares O-D aleatorios (JSONL)
+# compare: las compara con RAPTOR (duración, transbordos y features LPMC)
+# bench:   consultas por segundo sobre pares O-D aleatorios
+
+def _random_pairs(n: int, seed: int) -> List[Tuple[float, float, float, float]]:
+    data = GTFS_DATA
+    rng = random.Random(seed)
+    n_located = len(data.stop_lat)
+    pairs = []
+    for _ in range(n):
+        a, b = rng.randrange(n_located), rng.randrange(n_located)
+        pairs.append((float(data.stop_lat[a]), float(data.stop_lon[a]), float(data.stop_lat[b]), float(data.stop_lon[b])))
+    return pairs
+
+
+def _otp_params(from_lat: float, from_lon: float, to_lat: float, to_lon: float, when: Optional[datetime] = None) -> dict:
+    """Parámetros /plan de OTP como los de la API (con otra fecha/hora si se indica)."""
+    from app.api.routes_otp import OtpRouteRequest, Point, build_otp_params
+
+    params = build_otp_params(
+        OtpRouteRequest(origin=Point(lat=from_lat, lon=from_lon), destination=Point(lat=to_lat, lon=to_lon))
+    )
+    if when is not None:
+        params.update(date=when.strftime("%Y-%m-%d"), time=when.strftime("%H:%M"))
+    return params
+
+
+def params_datetime(params: dict) -> datetime:
+    """Fecha y hora de salida de unos parámetros /plan de OTP."""
+    return datetime.fromisoformat(f"{params['date']}T{params['time']}")
+
+
+def default_departure() -> datetime:
+    """Salida por defecto: la misma fecha/hora que usa /api/otp/routes."""
+    return params_datetime(_otp_params(0.0, 0.0, 0.0, 0.0))
+
+
+def _record_cli(out: Path, n: int, when: datetime, seed: int) -> None:
+    import httpx
+
+    from app.api.routes_otp import OTP_PLAN_URL
+
+    with httpx.Client(timeout=60.0) as client, out.open("w", encoding="utf-8") as f:
+        for pair in _random_pairs(n, seed):
+            params = _otp_params(*pair, when)
+            resp = client.get(OTP_PLAN_URL, params=params)
+            resp.raise_for_status()
+            itineraries = (resp.json().get("plan") or {}).get("itineraries") or []
+            f.write(json.dumps({"params": params, "itineraries": itineraries}) + "\n")
+    print(f"{n} respuestas de OTP guardadas en {out}")
+
+
+def _percentiles(values: List[float]) -> str:
+    if not values:
+        return "-"
+    p50, p90, mx = np.percentile(np.abs(values), [50, 90, 100]).tolist()
+    return f"p50 {p50:.0f}  p90 {p90:.0f}  max {mx:.0f}"
+
+
+def _compare_cli(recorded: Path) -> None:
+    from app.api.routes_otp import pick_itinerary_with_transit
+    from app.services.lpmc_inference import transit_features
+
+    rows = [json.loads(line) for line in recorded.read_text(encoding="utf-8").splitlines() if line.strip()]
+    both = only_otp = only_raptor = neither = same_transfers = 0
+    duration_diff: List[float] = []
+    feature_diff: Dict[str, List[float]] = {}
+    t0 = time.perf_counter()
+    for row in rows:
+        params = row["params"]
+        from_lat, from_lon = map(float, params["fromPlace"].split(","))
+        to_lat, to_lon = map(float, params["toPlace"].split(","))
+        when = params_datetime(params)
+        otp_its = sorted(row["itineraries"], key=lambda it: float(it.get("duration") or 1e20))
+        raptor_its = plan(from_lat, from_lon, to_lat, to_lon, when)
+
+        def transit_only(its):
+            return [it for it in its if any(leg.get("transitLeg") for leg in it.get("legs", []))]
+
+        otp_t, raptor_t = transit_only(otp_its), transit_only(raptor_its)
+        if otp_t and raptor_t:
+            both += 1
+            duration_diff.append(float(raptor_t[0]["duration"]) - float(otp_t[0]["duration"]))
+            otp_it = otp_its[pick_itinerary_with_transit(otp_its)]
+            raptor_it = raptor_its[pick_itinerary_with_transit(raptor_its)]
+            same_transfers += int(
+                sum(1 for leg in otp_it["legs"] if leg.get("transitLeg"))
+                == sum(1 for leg in raptor_it["legs"] if leg.get("transitLeg"))
+            )
+            f_otp, f_raptor = transit_features(otp_it), transit_features(raptor_it)
+            for name in f_otp:
+                feature_diff.setdefault(name, []).append(float(f_raptor[name]) - float(f_otp[name]))
+        elif otp_t:
+            only_otp += 1
+        elif raptor_t:
+            only_raptor += 1
+        else:
+            neither += 1
+    elapsed = time.perf_counter() - t0
+
+    print(f"Pares comparados: {len(rows)} ({elapsed / max(len(rows), 1) * 1000:.1f} ms por consulta RAPTOR)")
+    print(f"  con transporte público en ambos: {both}")
+    print(f"  solo OTP: {only_otp}   solo RAPTOR: {only_raptor}   ninguno: {neither}")
+    if both:
+        print(f"  mismo nº de vehículos (itinerario elegido): {same_transfers / both:.1%}")
+        print(f"  |duración RAPTOR - OTP| (s), el más rápido: {_percentiles(duration_diff)}")
+        for name, diffs in feature_diff.items():
+            print(f"  |{name}| (diferencia): {_percentiles(diffs)}")
+
+
+def _bench_cli(n: int, when: datetime, seed: int) -> None:
+    t0 = time.perf_counter()
+    gtfs_loader.warm_up()
+    t_gtfs = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    network()
+    t_network = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    service_day_network(when.date())
+    t_day = time.perf_counter() - t0
+
+    pairs = _random_pairs(n, seed)
+    found = 0
+    latencies = []
+    t_all = time.perf_counter()
+    for pair in pairs:
+        t0 = time.perf_counter()
+        its = plan(*pair, when)
+        latencies.append(time.perf_counter() - t0)
+        found += any(leg["transitLeg"] for it in its for leg in it["legs"])
+    elapsed = time.perf_counter() - t_all
+
+    data = GTFS_DATA
+    day = service_day_network(when.date())
+    print(f"GTFS: {len(data.stop_ids)} paradas, {len(data.trip_ids)} trips ({t_gtfs * 1000:.0f} ms)")
+    print(f"Red base: {len(network().pat_route)} patrones ({t_network * 1000:.0f} ms)")
+    print(f"Red del día {when.date()}: {len(day.pattern_route)} patrones, {len(day.col_dep)} horas ({t_day * 1000:.0f} ms)")
+    p50, p90 = (np.percentile(latencies, [50, 90]) * 1000).tolist()
+    print(f"{n} consultas: {n / elapsed:.0f} consultas/s, p50 {p50:.1f} ms, p90 {p90:.1f} ms, {found} con transporte público")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.services.raptor")
+    sub = parser.add_subparsers(dest="command", required=True)
+    when_help = "Salida YYYY-MM-DDTHH:MM (por defecto, la fecha/hora de build_otp_params)"
+
+    record = sub.add_parser("record", help="Guarda respuestas de OTP (OTP_PLAN_URL) para pares aleatorios")
+    record.add_argument("--out", type=Path, required=True)
+    record.add_argument("-n", type=int, default=200)
+    record.add_argument("--when", default=None, help=when_help)
+    record.add_argument("--seed", type=int, default=1)
+
+    compare = sub.add_parser("compare", help="Compara RAPTOR con respuestas grabadas de OTP")
+    compare.add_argument("recorded", type=Path)
+
+    bench = sub.add_parser("bench", help="Consultas por segundo sobre pares aleatorios")
+    bench.add_argument("-n", type=int, default=1000)
+    bench.add_argument("--when", default=None, help=when_help)
+    bench.add_argument("--seed", type=int, default=1)
+
+    args = parser.parse_args()
+    if getattr(args, "when", None):
+        when_arg = datetime.fromisoformat(args.when)
+    else:
+        when_arg = default_departure()
+    if args.command == "record":
+        _record_cli(args.out, args.n, when_arg, args.seed)
+    elif args.command == "compare":
+        _compare_cli(args.recorded)
+    elif args.command == "bench":
+        _bench_cli(args.n, when_arg, args.seed)
@@ -0,0 +1,312 @@
+# backend/app/services/route_cache.py
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Caché de resultados de enrutado (OSRM / OTP).
+#
+# Las claves llevan las coordenadas redondeadas a ROUTE_CACHE_PRECISION
+# decimales (4 ~ 11 m), así que marcadores arrastrados a "casi" el mismo
+# sitio comparten resultado. En memoria es un LRU con TTL; si se define
+# ROUTE_CACHE_PATH, además se guarda en un SQLite que sobrevive a reinicios.
+#
+# Los grafos solo cambian al reconstruirlos: la versión del grafo se toma de
+# ROUTING_GRAPH_VERSION o, si no está, de los mtimes/tamaños de los ficheros
+# de ROUTING_GRAPH_FILES (separados por os.pathsep, p. ej. clm.osrm.mldgr y
+# graph.obj). Si cambia, se invalida toda la caché.
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "4096"))  # 0 = desactivada
+ROUTE_CACHE_TTL_S = float(os.environ.get("ROUTE_CACHE_TTL_S", "86400"))
+ROUTE_CACHE_PRECISION = int(os.environ.get("ROUTE_CACHE_PRECISION", "4"))
+ROUTE_CACHE_PATH = os.environ.get("ROUTE_CACHE_PATH") or None
+ROUTE_CACHE_VERSION_CHECK_S = float(os.environ.get("ROUTE_CACHE_VERSION_CHECK_S", "30"))
+# Cada cuánto se borran del disco las filas caducadas (además de al arrancar
+# y al cambiar la versión del grafo)
+ROUTE_CACHE_PURGE_S = float(os.environ.get("ROUTE_CACHE_PURGE_S", "3600"))
+
+
+def snap(value: float) -> float:
+    return round(float(value), ROUTE_CACHE_PRECISION)
+
+
+def graph_version() -> str:
+    explicit = os.environ.get("ROUTING_GRAPH_VERSION")
+    if explicit:
+        return explicit
+
+    files = [p for p in os.environ.get("ROUTING_GRAPH_FILES", "").split(os.pathsep) if p]
+    if not files:
+        return "default"
+
+    h = hashlib.sha1()
+    for path in files:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+        except OSError:
+            h.update(f"{path}:missing;".encode())
+    return h.hexdigest()[:16]
+
+
+class _DiskStore:
+    """Tabla SQLite (key, version, expires, value JSON) compartible entre procesos."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache ("
+                " key TEXT PRIMARY KEY, version TEXT NOT NULL,"
+                " expires REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str, version: str, now: float) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM route_cache WHERE key = ? AND version = ? AND expires > ?",
+                (key, version, now),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, version: str, expires: float, value: Any) -> None:
+        payload = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route_cache (key, version, expires, value) VALUES (?, ?, ?, ?)",
+                (key, version, expires, payload),
+            )
+            self._conn.commit()
+
+    def purge(self, version: str, now: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM route_cache WHERE version != ? OR expires <= ?", (version, now)
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM route_cache")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RouteCache:
+    """
+    LRU + TTL en memoria, con respaldo opcional en disco.
+
+    Los valores deben ser serializables a JSON y no se copian: quien los
+    recibe no debe modificarlos. Puede usarse desde varios hilos (threadpool
+    de FastAPI, asyncio.to_thread), así que el OrderedDict y los contadores
+    van bajo un lock, como en http_cache; el disco tiene el suyo.
+
+    Desde el event loop hay que usar aget()/aset(): las lecturas, escrituras
+    y purgas de SQLite (que pueden esperar hasta 5 s a otro proceso) se hacen
+    en un hilo.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ROUTE_CACHE_SIZE,
+        ttl_s: float = ROUTE_CACHE_TTL_S,
+        path: Optional[str] = ROUTE_CACHE_PATH,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskStore(path) if path and max_entries > 0 else None
+        self._version = graph_version()
+        self._version_checked = time.monotonic()
+        self._purge_pending = False
+        self._purged_at = time.monotonic()
+        self._counters: Dict[str, int] = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+        if self._disk is not None:
+            self._disk.purge(self._version, time.time())
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _check_version(self) -> None:
+        # Con self._lock tomado; la purga del disco la hace quien llama, fuera
+        # del lock (_take_purge)
+        now = time.monotonic()
+        if now - self._version_checked < ROUTE_CACHE_VERSION_CHECK_S:
+            return
+        self._version_checked = now
+        version = graph_version()
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+            self._purge_pending = True
+
+    def _take_purge(self) -> Optional[str]:
+        """
+        Con self._lock tomado: versión con la que purgar el disco (cambio de
+        grafo, o filas caducadas cada ROUTE_CACHE_PURGE_S), o None.
+        """
+        if self._disk is None:
+            return None
+        now = time.monotonic()
+        if not self._purge_pending and now - self._purged_at < ROUTE_CACHE_PURGE_S:
+            return None
+        self._purge_pending = False
+        self._purged_at = now
+        return self._version
+
+    @staticmethod
+    def _disk_key(key: Hashable) -> str:
+        return json.dumps(key, separators=(",", ":"))
+
+    def _memory_get(self, key: Hashable, now: float) -> Tuple[bool, Any, str, Optional[str]]:
+        """(acierto, valor, versión, versión a purgar en disco)."""
+        with self._lock:
+            self._check_version()
+            purge = self._take_purge()
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return True, value, self._version, purge
+                del self._entries[key]
+            return False, None, self._version, purge
+
+    def _disk_get(self, key: Hashable, version: str, now: float, purge: Optional[str], lookup: bool) -> Optional[Any]:
+        if purge is not None:
+            self._disk.purge(purge, now)
+        return self._disk.get(self._disk_key(key), version, now) if lookup else None
+
+    def _after_disk_get(self, key: Hashable, now: float, value: Optional[Any]) -> Optional[Any]:
+        with self._lock:
+            if value is not None:
+                self._remember(key, now + self.ttl_s, value)
+                self._counters["disk_hits"] += 1
+            else:
+                self._counters["misses"] += 1
+        return value
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Versión síncrona de aget() (hilos, scripts): bloquea en SQLite."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        hit, value, version, purge = self._memory_get(key, now)
+        found = None
+        if self._disk is not None and (not hit or purge is not None):
+            found = self._disk_get(key, version, now, purge, not hit)
+        return value if hit else self._after_disk_get(key, now, found)
+
+    async def aget(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        hit, value, version, purge = self._memory_get(key, now)
+        found = None
+        if self._disk is not None and (not hit or purge is not None):
+            found = await asyncio.to_thread(self._disk_get, key, version, now, purge, not hit)
+        return value if hit else self._after_disk_get(key, now, found)
+
+    def _memory_set(self, key: Hashable, value: Any) -> Tuple[float, str, Optional[str]]:
+        expires = time.time() + self.ttl_s
+        with self._lock:
+            self._remember(key, expires, value)
+            return expires, self._version, self._take_purge()
+
+    def _disk_set(self, key: Hashable, version: str, expires: float, value: Any, purge: Optional[str]) -> None:
+        if purge is not None:
+            self._disk.purge(purge, time.time())
+        self._disk.set(self._disk_key(key), version, expires, value)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Versión síncrona de aset() (hilos, scripts): bloquea en SQLite."""
+        if not self.enabled:
+            return
+        expires, version, purge = self._memory_set(key, value)
+        if self._disk is not None:
+            self._disk_set(key, version, expires, value, purge)
+
+    async def aset(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        expires, version, purge = self._memory_set(key, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk_set, key, version, expires, value, purge)
+
+    def _remember(self, key: Hashable, expires: float, value: Any) -> None:
+        # Con self._lock tomado
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+            version = self._version
+        lookups = counters["hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["hits"] + counters["disk_hits"]
+        return {
+            "enabled": self.enabled,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "disk": self._disk is not None,
+            "graph_version": version,
+            "hit_ratio": hits / lookups if lookups else None,
+            **counters,
+        }
+
+
+ROUTE_CACHE = RouteCache()
+
+
+def osrm_key(profile: str, lon1: float, lat1: float, lon2: float, lat2: float) -> tuple:
+    return ("osrm", profile, snap(lon1), snap(lat1), snap(lon2), snap(lat2))
+
+
+def otp_key(params: Dict[str, Any]) -> tuple:
+    """Clave para una consulta /plan de OTP: params con fromPlace/toPlace redondeados."""
+    items = []
+    for name, value in sorted(params.items()):
+        if name in ("fromPlace", "toPlace"):
+            lat, lon = str(value).split(",")
+            value = f"{snap(float(lat))},{snap(float(lon))}"
+        items.append((name, value))
+    return ("otp", tuple(items))
@@ -0,0 +1,712 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+import numpy as np
+
+from app.api.routes_otp import pick_itinerary_with_transit
+from app.services import gtfs_loader, lpmc_inference, raptor
+from app.services.lpmc_inference import MODE_LABELS, NoItineraryError, fetch_otp_itinerary, transit_features
+from app.services.osrm_client import get_table
+from app.services.route_cache import graph_version
+
+# Rows per scoring task sent to the process pool.
+SCENARIO_CHUNK_ROWS = int(os.environ.get("SCENARIO_CHUNK_ROWS", "20000"))
+# Scoring processes; 0 scores in a thread of the API process instead.
+SCENARIO_WORKERS = int(os.environ.get("SCENARIO_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# OTP plans requested at once while building transit features.
+SCENARIO_OTP_CONCURRENCY = int(os.environ.get("SCENARIO_OTP_CONCURRENCY", "8"))
+# Finished jobs kept in memory for GET /api/scenarios/{id}.
+SCENARIO_MAX_JOBS = int(os.environ.get("SCENARIO_MAX_JOBS", "50"))
+# Intermediate stage results reused by later runs: memory budget, and an
+# optional directory where they are also written as .npz files.
+SCENARIO_STAGE_CACHE_MB = float(os.environ.get("SCENARIO_STAGE_CACHE_MB", "256"))
+SCENARIO_STAGE_DIR = os.environ.get("SCENARIO_STAGE_DIR") or None
+
+# Duration features scaled by each mode's multiplier. For pt this covers
+# in-vehicle and waiting time (what frequency/priority changes act on),
+# not the walk to the stop.
+DURATION_COLUMNS = {
+    "walk": ["dur_walking"],
+    "cycle": ["dur_cycling"],
+    "drive": ["dur_driving"],
+    "pt": ["dur_pt_bus", "dur_pt_rail", "dur_pt_int_waiting"],
+}
+
+# Routing source each mode's route features come from (see _route_block).
+MODE_SOURCES = {"walk": "foot", "cycle": "cycling", "drive": "driving", "pt": "transit"}
+PT_COLUMNS = [
+    "dur_pt_access",
+    "dur_pt_rail",
+    "dur_pt_bus",
+    "dur_pt_int_waiting",
+    "dur_pt_int_walking",
+    "pt_n_interchanges",
+]
+
+_JOBS: "OrderedDict[str, dict[str, Any]]" = OrderedDict()
+_POOL: ProcessPoolExecutor | None = None
+_POOL_FINGERPRINT: str | None = None
+
+
+# -----------------------
+# Stage store
+# -----------------------
+
+def _digest(*parts: Any) -> str:
+    """Content hash of arrays and JSON-serialisable values."""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            a = np.ascontiguousarray(part)
+            h.update(f"{a.dtype.str}{a.shape}".encode())
+            h.update(a.data)
+        else:
+            h.update(json.dumps(part, sort_keys=True, separators=(",", ":")).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class StageStore:
+    """
+    Stage results (dicts of read-only arrays) keyed by a digest of their inputs.
+
+    Memory is an LRU bounded by max_bytes; with a directory, entries are also
+    written as <key>.npz and survive restarts. Keys include everything the
+    result depends on (graph version, model fingerprint, overrides...), so
+    nothing is ever invalidated: outdated entries are simply not asked for
+    again and age out of the LRU. The directory can be emptied at any time.
+    """
+
+    def __init__(self, max_bytes: int, directory: str | None = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries: "OrderedDict[str, dict[str, np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key: str) -> dict[str, np.ndarray] | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry
+
+        if self.directory:
+            try:
+                with np.load(self._path(key), allow_pickle=False) as npz:
+                    entry = {name: npz[name] for name in npz.files}
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self._counters["disk_hits"] += 1
+                return self._remember(key, entry)
+
+        self._counters["misses"] += 1
+        return None
+
+    def set(self, key: str, arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        entry = self._remember(key, {name: np.array(a) for name, a in arrays.items()})
+        if self.directory:
+            tmp = self._path(f"{key}.{os.getpid()}.tmp")
+            try:
+                with open(tmp, "wb") as f:
+                    np.savez(f, **entry)
+                os.replace(tmp, self._path(key))
+            except OSError:
+                # Full or read-only disk: the entry still lives in memory.
+                pass
+        return entry
+
+    def _remember(self, key: str, entry: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        for a in entry.values():
+            a.setflags(write=False)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= sum(a.nbytes for a in old.values())
+        self._entries[key] = entry
+        self._bytes += sum(a.nbytes for a in entry.values())
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= sum(a.nbytes for a in evicted.values())
+        return entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk": self.directory is not None,
+            **self._counters,
+        }
+
+
+STAGES = StageStore(int(SCENARIO_STAGE_CACHE_MB * 1024 * 1024), SCENARIO_STAGE_DIR)
+
+
+# -----------------------
+# Scoring pool
+# -----------------------
+
+def _init_worker() -> None:
+    lpmc_inference.load_artifacts()
+
+
+def _score_chunk(x: np.ndarray) -> np.ndarray:
+    return lpmc_inference.predict_proba_matrix(x, overwrite_x=True)
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _POOL, _POOL_FINGERPRINT
+    if SCENARIO_WORKERS <= 0:
+        return None
+    # Workers load the model once; after a hot reload, start fresh ones.
+    fingerprint = lpmc_inference.artifacts_status()["fingerprint"]
+    if _POOL is not None and fingerprint != _POOL_FINGERPRINT:
+        shutdown_pool()
+    if _POOL is None:
+        _POOL_FINGERPRINT = fingerprint
+        # spawn: the API process has threads and an event loop running.
+        _POOL = ProcessPoolExecutor(
+            max_workers=SCENARIO_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _POOL
+
+
+def shutdown_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+# -----------------------
+# Jobs
+# -----------------------
+
+def _set_progress(job: dict[str, Any], stage: str, done: int, total: int) -> None:
+    job["stage"] = stage
+    job["stage_progress"] = {"done": done, "total": total}
+
+
+def submit(body: dict) -> dict[str, Any]:
+    """Register a scenario job and start it in the background."""
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "name": body.get("name"),
+        "status": "queued",
+        "stage": None,
+        "stage_progress": None,
+        "created_at": time.time(),
+        "finished_at": None,
+        "error": None,
+        "result": None,
+    }
+    _JOBS[job_id] = job
+    while len(_JOBS) > SCENARIO_MAX_JOBS:
+        oldest_id, oldest = next(iter(_JOBS.items()))
+        if oldest["status"] in ("queued", "running"):
+            break
+        del _JOBS[oldest_id]
+
+    job["task"] = asyncio.create_task(_run_job(job, body))
+    return public_view(job)
+
+
+def get_job(job_id: str) -> dict[str, Any] | None:
+    job = _JOBS.get(job_id)
+    return None if job is None else public_view(job)
+
+
+def public_view(job: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in job.items() if k != "task"}
+
+
+async def _run_job(job: dict[str, Any], body: dict) -> None:
+    job["status"] = "running"
+    t0 = time.perf_counter()
+    try:
+        job["result"] = await run_scenario(body, job)
+        job["result"]["elapsed_s"] = round(time.perf_counter() - t0, 3)
+        job["status"] = "done"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except Exception as exc:
+        job["status"] = "failed"
+        job["error"] = str(exc) or exc.__class__.__name__
+    finally:
+        job["finished_at"] = time.time()
+
+
+# -----------------------
+# Engine
+# -----------------------
+
+def _resolve_zones(body: dict) -> tuple[list[str], np.ndarray]:
+    """Zone ids and (lon, lat) coordinates, from explicit zones or GTFS stops."""
+    if body.get("zones"):
+        zones = body["zones"]
+        return [z["id"] for z in zones], np.array([[z["lon"], z["lat"]] for z in zones], dtype=float)
+
+    from app.services.gtfs_loader import GTFS_DATA
+
+    ids = list(body["stop_ids"])
+    missing = [s for s in ids if s not in GTFS_DATA.stop_index]
+    if missing:
+        raise ValueError(f"Paradas GTFS desconocidas: {missing[:10]}")
+    idx = np.array([GTFS_DATA.stop_index[s] for s in ids], dtype=np.intp)
+    return ids, np.column_stack([GTFS_DATA.stop_lon[idx], GTFS_DATA.stop_lat[idx]])
+
+
+def _od_demand(body: dict, zone_ids: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(origin index, destination index, trips) arrays."""
+    if body.get("od_pairs"):
+        pos = {z: i for i, z in enumerate(zone_ids)}
+        pairs = body["od_pairs"]
+        unknown = {p[k] for p in pairs for k in ("origin", "destination") if p[k] not in pos}
+        if unknown:
+            raise ValueError(f"Zonas desconocidas en od_pairs: {sorted(unknown)[:10]}")
+        o = np.array([pos[p["origin"]] for p in pairs], dtype=np.intp)
+        d = np.array([pos[p["destination"]] for p in pairs], dtype=np.intp)
+        trips = np.array([float(p.get("trips", 1.0)) for p in pairs], dtype=float)
+        return o, d, trips
+
+    n = len(zone_ids)
+    o, d = np.nonzero(~np.eye(n, dtype=bool))
+    return o.astype(np.intp), d.astype(np.intp), np.ones(len(o), dtype=float)
+
+
+async def _transit_matrix(
+    coords: np.ndarray, o: np.ndarray, d: np.ndarray, job: dict[str, Any] | None
+) -> np.ndarray:
+    """PT_COLUMNS per OD pair, NaN where there is no transit itinerary."""
+    if lpmc_inference.LPMC_TRANSIT_SOURCE == "raptor":
+        return await asyncio.to_thread(_raptor_transit_matrix, coords, o, d, job)
+
+    total = len(o)
+    done = 0
+    failures: list[Exception] = []
+    sem = asyncio.Semaphore(SCENARIO_OTP_CONCURRENCY)
+
+    async def one(i: int, j: int) -> list[float]:
+        nonlocal done
+        async with sem:
+            try:
+                otp = await fetch_otp_itinerary(coords[i, 1], coords[i, 0], coords[j, 1], coords[j, 0], None)
+                features = transit_features(otp["itinerary"])
+                return [float(features[col]) for col in PT_COLUMNS]
+            except NoItineraryError:
+                return [np.nan] * len(PT_COLUMNS)
+            except Exception as exc:
+                # OTP errors, timeouts, connection errors: not an answer, so
+                # the matrix must not be stored as a stage.
+                failures.append(exc)
+                return [np.nan] * len(PT_COLUMNS)
+            finally:
+                done += 1
+                if job is not None:
+                    _set_progress(job, "transit", done, total)
+
+    rows = await asyncio.gather(*(one(int(i), int(j)) for i, j in zip(o, d)))
+    if failures:
+        raise RuntimeError(
+            f"Fallaron {len(failures)} de {total} consultas de transporte público: {failures[0]!r}"
+        )
+    return np.array(rows, dtype=float).reshape(len(o), len(PT_COLUMNS))
+
+
+def _raptor_transit_matrix(
+    coords: np.ndarray, o: np.ndarray, d: np.ndarray, job: dict[str, Any] | None
+) -> np.ndarray:
+    """Same as the OTP path, with one RAPTOR search per origin zone."""
+    when = raptor.default_departure()
+    out = np.full((len(o), len(PT_COLUMNS)), np.nan)
+    origins = np.unique(o)
+    for n_done, i in enumerate(origins.tolist(), start=1):
+        rows = np.flatnonzero(o == i)
+        destinations = [(coords[j, 1], coords[j, 0]) for j in d[rows].tolist()]
+        plans = raptor.plan_many(coords[i, 1], coords[i, 0], destinations, when, geometry=False)
+        for row, itineraries in zip(rows.tolist(), plans):
+            if itineraries:
+                features = transit_features(itineraries[pick_itinerary_with_transit(itineraries)])
+                out[row] = [float(features[col]) for col in PT_COLUMNS]
+        if job is not None:
+            _set_progress(job, "transit", n_done, len(origins))
+    return out
+
+
+def _route_block(
+    mode: str, source: dict[str, np.ndarray], o: np.ndarray, d: np.ndarray, factor: float
+) -> dict[str, np.ndarray]:
+    """Route feature columns of one mode, with its duration multiplier applied."""
+    if mode == "pt":
+        block = {col: source["features"][:, k] for k, col in enumerate(PT_COLUMNS)}
+    else:
+        column = {"walk": "dur_walking", "cycle": "dur_cycling", "drive": "dur_driving"}[mode]
+        block = {column: source["durations"][o, d]}
+        if mode == "drive":
+            block["distance"] = source["distances"][o, d]
+    for col in DURATION_COLUMNS[mode]:
+        block[col] = block[col] * factor
+    return block
+
+
+def _track(stages: dict[str, dict[str, int]], name: str, reused: bool) -> None:
+    counts = stages.setdefault(name, {"reused": 0, "computed": 0})
+    counts["reused" if reused else "computed"] += 1
+
+
+async def run_scenario(body: dict, job: dict[str, Any] | None = None) -> dict[str, Any]:
+    """
+    Run a scenario, reusing every stage whose inputs match an earlier run.
+
+    Stage keys (see StageStore):
+      routing     OSRM table per profile     <- zones, graph version
+      transit     OTP features per OD pair   <- zones, OD pairs, graph version
+      route       feature columns per mode   <- its source, OD pairs, multiplier
+      population  profile feature rows       <- segment profiles, costs, model
+      scoring     probabilities per segment  <- its profile row, route blocks, model
+    So a cost or profile change only re-scores (the affected segments), and a
+    duration multiplier only rebuilds that mode's columns before re-scoring.
+    Weights and trips only enter the aggregation, which always runs.
+    """
+    zone_ids, coords = _resolve_zones(body)
+    o, d, trips = _od_demand(body, zone_ids)
+    overrides = body.get("overrides") or {}
+    multipliers = overrides.get("duration_multipliers") or {}
+
+    artifacts = await lpmc_inference.load_artifacts_async()
+    plan = artifacts["plan"]
+    model_fp = artifacts["fingerprint"]
+    graph = graph_version()
+    od_key = _digest("od", o, d)
+
+    timings: dict[str, float] = {}
+    stages: dict[str, dict[str, int]] = {}
+    sources: dict[str, dict[str, np.ndarray]] = {}
+    source_keys: dict[str, str] = {}
+
+    # 1. Road modes: one OSRM /table per profile over all zones.
+    t0 = time.perf_counter()
+    if job is not None:
+        _set_progress(job, "routing", 0, 3)
+    points = [tuple(p) for p in coords]
+    for k, profile in enumerate(("driving", "cycling", "foot")):
+        key = source_keys[profile] = _digest("table", profile, graph, coords)
+        entry = STAGES.get(key)
+        _track(stages, "routing", entry is not None)
+        if entry is None:
+            table = await get_table(profile, points)
+            entry = STAGES.set(key, {"durations": table["durations"], "distances": table["distances"]})
+        sources[profile] = entry
+        if job is not None:
+            _set_progress(job, "routing", k + 1, 3)
+    timings["routing"] = time.perf_counter() - t0
+
+    # 2. Transit: one OTP plan per OD pair (cached / coalesced upstream), or
+    # one RAPTOR search per origin zone with LPMC_TRANSIT_SOURCE=raptor.
+    t0 = time.perf_counter()
+    transit_source = lpmc_inference.LPMC_TRANSIT_SOURCE
+    # RAPTOR answers from the feed loaded in this process, not from whatever
+    # is on disk right now; the first call may load it, hence the thread.
+    if transit_source == "raptor":
+        transit_version = await asyncio.to_thread(gtfs_loader.dataset_version)
+    else:
+        transit_version = graph
+    key = source_keys["transit"] = _digest("transit", transit_source, transit_version, coords, od_key)
+    entry = STAGES.get(key)
+    _track(stages, "transit", entry is not None)
+    if entry is None:
+        entry = STAGES.set(key, {"features": await _transit_matrix(coords, o, d, job)})
+    sources["transit"] = entry
+    timings["transit"] = time.perf_counter() - t0
+
+    # 3. Feature matrices. Profile and route columns are disjoint, so the
+    # (segments x valid ODs) matrix is the sum of the two partial matrices.
+    t0 = time.perf_counter()
+    blocks = {}
+    block_keys = []
+    for mode, source in MODE_SOURCES.items():
+        factor = float(multipliers.get(mode) or 1.0)
+        key = _digest("route", mode, source_keys[source], od_key, factor)
+        entry = STAGES.get(key)
+        _track(stages, "route", entry is not None)
+        if entry is None:
+            entry = STAGES.set(key, _route_block(mode, sources[source], o, d, factor))
+        blocks[mode] = entry
+        block_keys.append(key)
+
+    valid = np.ones(len(o), dtype=bool)
+    for block in blocks.values():
+        for values in block.values():
+            valid &= ~np.isnan(values)
+    vo, vtrips = o[valid], trips[valid]
+    route_x = np.zeros((len(vo), plan.n_features), dtype=float)
+    for block in blocks.values():
+        for col, values in block.items():
+            j = plan.route_index.get(col)
+            if j is not None:
+                route_x[:, j] = values[valid]
+
+    segments = body["segments"]
+    payloads = []
+    for seg in segments:
+        payload = dict(seg["profile"])
+        for name in ("cost_transit", "cost_driving_total"):
+            if overrides.get(name) is not None:
+                payload[name] = float(overrides[name])
+        payloads.append(payload)
+    key = _digest("population", model_fp, payloads)
+    entry = STAGES.get(key)
+    _track(stages, "population", entry is not None)
+    if entry is None:
+        entry = STAGES.set(key, {"x": plan.fill(payloads, [{}] * len(payloads))})
+    profile_x = entry["x"]
+    weights = np.array([float(seg.get("weight", 1.0)) for seg in segments], dtype=float)
+    timings["features"] = time.perf_counter() - t0
+
+    # 4. Scoring of the segments without a stored result, in chunks built
+    # from profile_x + route_x as they are sent, on the process pool when
+    # configured.
+    t0 = time.perf_counter()
+    score_keys = [_digest("scores", model_fp, row, block_keys) for row in profile_x]
+    scored = [STAGES.get(key) for key in score_keys]
+    missing = [s for s, entry in enumerate(scored) if entry is None]
+    for s in range(len(segments)):
+        _track(stages, "scoring", scored[s] is not None)
+    rows_scored = 0
+    if missing:
+        proba = await _score(profile_x[missing], route_x, job)
+        proba = proba.reshape(len(missing), len(vo), proba.shape[1])
+        for s, p in zip(missing, proba):
+            scored[s] = STAGES.set(score_keys[s], {"proba": p})
+        rows_scored = len(missing) * len(vo)
+    proba = np.stack([entry["proba"] for entry in scored])
+    n_modes = proba.shape[2]
+    timings["scoring"] = time.perf_counter() - t0
+
+    # 5. Aggregation: expected trips per origin zone and mode.
+    t0 = time.perf_counter()
+    if job is not None:
+        _set_progress(job, "aggregating", 0, 1)
+    expected = np.einsum("s,n,snk->nk", weights, vtrips, proba)
+    per_zone = np.zeros((len(zone_ids), n_modes), dtype=float)
+    np.add.at(per_zone, vo, expected)
+
+    labels = [MODE_LABELS.get(k, str(k)) for k in range(n_modes)]
+    zones_out = []
+    for i, zone_id in enumerate(zone_ids):
+        total = float(per_zone[i].sum())
+        zones_out.append(
+            {
+                "zone_id": zone_id,
+                "trips": total,
+                "mode_shares": {
+                    labels[k]: (float(per_zone[i, k]) / total if total > 0 else None)
+                    for k in range(n_modes)
+                },
+            }
+        )
+    grand = per_zone.sum(axis=0)
+    if job is not None:
+        _set_progress(job, "aggregating", 1, 1)
+    timings["aggregating"] = time.perf_counter() - t0
+
+    return {
+        "zones": zones_out,
+        "mode_shares": {
+            labels[k]: (float(grand[k]) / float(grand.sum()) if grand.sum() > 0 else None)
+            for k in range(n_modes)
+        },
+        "trips_by_mode": {labels[k]: float(grand[k]) for k in range(n_modes)},
+        "od_pairs": int(len(o)),
+        "od_pairs_scored": int(valid.sum()),
+        "rows_scored": int(rows_scored),
+        "overrides": overrides,
+        "stages": stages,
+        "timings_s": {stage: round(v, 3) for stage, v in timings.items()},
+    }
+
+
+async def _score(profile_x: np.ndarray, route_x: np.ndarray, job: dict[str, Any] | None) -> np.ndarray:
+    """
+    Probabilities for every (profile row, route row) pair, profile-major.
+
+    Each chunk of SCENARIO_CHUNK_ROWS feature rows is built just before it
+    is scored, and only as many chunks as there are workers are in flight,
+    so the full segments x OD pairs matrix never exists in this process.
+    """
+    n_rows = len(profile_x) * len(route_x)
+    starts = list(range(0, n_rows, SCENARIO_CHUNK_ROWS))
+    if not starts:
+        return np.zeros((0, len(MODE_LABELS)), dtype=float)
+
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    in_flight = asyncio.Semaphore(max(SCENARIO_WORKERS, 1))
+    done = 0
+
+    def build(lo: int) -> np.ndarray:
+        rows = np.arange(lo, min(lo + SCENARIO_CHUNK_ROWS, n_rows))
+        chunk = route_x[rows % len(route_x)]
+        chunk += profile_x[rows // len(route_x)]
+        return chunk
+
+    async def one(lo: int) -> np.ndarray:
+        nonlocal done
+        async with in_flight:
+            chunk = build(lo)
+            if pool is not None:
+                try:
+                    result = await loop.run_in_executor(pool, _score_chunk, chunk)
+                except BrokenProcessPool:
+                    # A worker died (OOM, kill): the next job starts a new pool.
+                    shutdown_pool()
+                    raise
+            else:
+                result = await asyncio.to_thread(_score_chunk, chunk)
+            del chunk
+        done += 1
+        if job is not None:
+            _set_progress(job, "scoring", done, len(starts))
+        return result
+
+    if job is not None:
+        _set_progress(job, "scoring", 0, len(starts))
+    return np.concatenate(await asyncio.gather(*(one(lo) for lo in starts)))
+
+
+# -----------------------
+# CLI
+# -----------------------
+# bench: a cold scenario run and the usual re-runs (same scenario, cost
+# change, pt multiplier, one segment edited) against an in-process OSRM/OTP
+# stub, with the stages in a temporary SCENARIO_STAGE_DIR. The memory LRU is
+# emptied before each re-run, so stages are read back from disk as in a
+# fresh process. --verify also runs each re-run cold on an empty store and
+# checks the results match.
+
+def _stub_table(path: str) -> dict | None:
+    """OSRM /table answer for the bench stub: durations from straight-line distance."""
+    if "/table/" not in path:
+        return None
+    coords, _, query = path.split("/")[4].partition("?")
+    points = np.array([[float(v) for v in c.split(",")] for c in coords.split(";")])
+    params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+    src = [int(i) for i in params["sources"].split(";")] if "sources" in params else range(len(points))
+    dst = [int(i) for i in params["destinations"].split(";")] if "destinations" in params else range(len(points))
+    a, b = points[list(src)], points[list(dst)]
+    meters = np.abs(a[:, None, 0] - b[None, :, 0]) * 85_000 + np.abs(a[:, None, 1] - b[None, :, 1]) * 111_000
+    return {"code": "Ok", "durations": (meters / 8.0).tolist(), "distances": meters.tolist()}
+
+
+async def _bench(n_zones: int, latency_s: float, workers: int, verify: bool) -> None:
+    import copy
+    import tempfile
+
+    from app.api import routes_otp
+    from app.services import http_clients, osrm_client, scenarios
+    from app.services.route_cache import ROUTE_CACHE
+    from app.services.single_flight import _stub_server
+
+    server = await _stub_server(latency_s, {"upstream": 0}, _stub_table)
+    base = "http://127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+    for profile in osrm_client.OSRM_BASE_URLS:
+        osrm_client.OSRM_BASE_URLS[profile] = base
+    routes_otp.OTP_PLAN_URL = f"{base}/otp/routers/default/plan"
+    lpmc_inference.LPMC_TRANSIT_SOURCE = "otp"
+    ROUTE_CACHE.max_entries = 0
+    scenarios.SCENARIO_WORKERS = workers
+    await http_clients.start()
+
+    zones = [
+        {"id": f"z{i}", "lat": 39.84 + (i % 15) * 0.003, "lon": -4.06 + (i // 15) * 0.004}
+        for i in range(n_zones)
+    ]
+    segments = [
+        {"profile": {"age": age, "car_ownership": cars, "purpose": "HBW"}, "weight": weight}
+        for age, cars, weight in ((25, 0, 0.3), (40, 1, 0.4), (70, 2, 0.3))
+    ]
+    edited = copy.deepcopy(segments)
+    edited[0]["profile"]["age"] = 30
+    runs = [
+        ("en frío", {}, segments),
+        ("mismo escenario", {}, segments),
+        ("cost_transit cambiado", {"cost_transit": 2.5}, segments),
+        ("multiplicador pt", {"duration_multipliers": {"pt": 0.7}}, segments),
+        ("un segmento editado", {}, edited),
+    ]
+
+    print(
+        f"{n_zones} zonas, {len(segments)} segmentos, OSRM/OTP simulado con "
+        f"{latency_s * 1000:.0f} ms de latencia, {workers} procesos de puntuación"
+    )
+    try:
+        with tempfile.TemporaryDirectory() as stage_dir:
+            scenarios.STAGES = scenarios.StageStore(scenarios.STAGES.max_bytes, stage_dir)
+            for k, (label, overrides, segs) in enumerate(runs):
+                body = {"zones": zones, "segments": segs, "overrides": overrides}
+                if k:
+                    scenarios.STAGES.clear()
+                t0 = time.perf_counter()
+                result = await scenarios.run_scenario(body)
+                elapsed = time.perf_counter() - t0
+                reused = sum(s["reused"] for s in result["stages"].values())
+                computed = sum(s["computed"] for s in result["stages"].values())
+                print(
+                    f"  {label:<22} {elapsed:7.2f} s, {result['rows_scored']:>7} filas puntuadas, "
+                    f"fases {reused} reutilizadas / {computed} calculadas, {result['timings_s']}"
+                )
+                if k == 0:
+                    size = sum(os.path.getsize(os.path.join(stage_dir, f)) for f in os.listdir(stage_dir))
+                    print(f"  {'':<22} {size / 2**20:.1f} MB en SCENARIO_STAGE_DIR")
+                if verify and k:
+                    stored = scenarios.STAGES
+                    scenarios.STAGES = scenarios.StageStore(stored.max_bytes)
+                    cold = await scenarios.run_scenario(body)
+                    scenarios.STAGES = stored
+                    same = (cold["zones"], cold["mode_shares"]) == (result["zones"], result["mode_shares"])
+                    print(f"  {'':<22} idéntico a una ejecución en frío: {same}")
+    finally:
+        scenarios.shutdown_pool()
+        await http_clients.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.scenarios")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Escenario en frío y re-ejecuciones reutilizando fases guardadas")
+    bench.add_argument("--zones", type=int, default=150)
+    bench.add_argument("--latency-ms", type=float, default=1.0)
+    bench.add_argument("--workers", type=int, default=1)
+    bench.add_argument("--verify", action="store_true", help="Compara cada re-ejecución con una en frío")
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        asyncio.run(_bench(args.zones, args.latency_ms / 1000, args.workers, args.verify))
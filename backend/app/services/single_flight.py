@@ -0,0 +1,178 @@
+# backend/app/services/single_flight.py
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes idénticas: mientras hay una petición en
+    vuelo para una clave, las demás esperan su resultado (o su excepción) en
+    lugar de lanzar otra petición al backend.
+
+    La llamada se ejecuta en su propia tarea, así que si el primer llamante
+    se cancela (p. ej. por un wait_for con timeout) los demás siguen
+    recibiendo el resultado.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._counters: Dict[str, int] = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self._counters["calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        else:
+            self._counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marca la excepción como consultada aunque todos los llamantes se
+        # hayan cancelado (evita el aviso "exception was never retrieved").
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), **self._counters}
+
+
+# Compartido por OSRM (/route) y OTP (/plan); las claves son las de route_cache.
+ROUTE_FLIGHTS = SingleFlight()
+
+
+# -----------------------
+# CLI: benchmark contra un backend simulado
+# -----------------------
+# bench: N peticiones idénticas simultáneas a un OSRM/OTP falso (en proceso,
+# con latencia fija) con la caché de rutas desactivada, sin agrupar y con
+# single-flight.
+
+_STUB_ROUTE = {
+    "code": "Ok",
+    "routes": [{"distance": 1234.5, "duration": 321.0, "geometry": "_c`|@_c`|@_ibE_ibE"}],
+}
+_STUB_PLAN = {
+    "plan": {
+        "itineraries": [
+            {
+                "duration": 1500,
+                "legs": [
+                    {"mode": "WALK", "transitLeg": False, "duration": 300, "distance": 400},
+                    {"mode": "BUS", "transitLeg": True, "duration": 900, "distance": 5000, "routeShortName": "L1"},
+                    {"mode": "WALK", "transitLeg": False, "duration": 300, "distance": 300},
+                ],
+            }
+        ]
+    }
+}
+
+
+async def _stub_server(
+    latency_s: float,
+    counter: Dict[str, int],
+    respond: Optional[Callable[[str], Optional[dict]]] = None,
+):
+    """
+    Servidor HTTP/1.1 keep-alive mínimo: /route/... de OSRM y /plan de OTP.
+    Con `respond(path) -> dict | None` se pueden servir otras rutas (p. ej.
+    /table en el bench de escenarios); None devuelve la respuesta por defecto.
+    """
+    import json
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                path = line.split()[1].decode()
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                counter["upstream"] += 1
+                await asyncio.sleep(latency_s)
+                data = respond(path) if respond is not None else None
+                if data is None:
+                    data = _STUB_PLAN if "/plan" in path else _STUB_ROUTE
+                body = json.dumps(data).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+                    b"content-length: %d\r\n\r\n" % len(body) + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096)
+
+
+async def _bench(n: int, latency_s: float) -> None:
+    import time
+
+    from app.api import routes_otp
+    from app.services import http_clients, osrm_client
+    from app.services.route_cache import ROUTE_CACHE
+
+    counter = {"upstream": 0}
+    server = await _stub_server(latency_s, counter)
+    base = "http://127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+    osrm_client.OSRM_BASE_URLS["driving"] = base
+    routes_otp.OTP_PLAN_URL = f"{base}/otp/routers/default/plan"
+    ROUTE_CACHE.max_entries = 0
+    await http_clients.start()
+
+    lon1, lat1, lon2, lat2 = -4.02, 39.86, -4.03, 39.87
+    client = http_clients.get_client(http_clients.osrm_client_name("driving"))
+    url = f"{base}/route/v1/driving/{lon1},{lat1};{lon2},{lat2}?overview=full&geometries=polyline6"
+    params = routes_otp.build_otp_params(
+        routes_otp.OtpRouteRequest(origin={"lat": lat1, "lon": lon1}, destination={"lat": lat2, "lon": lon2})
+    )
+
+    async def plain_osrm():
+        resp = await client.get(url)
+        resp.raise_for_status()
+        return resp.json()
+
+    cases = (
+        ("OSRM sin agrupar", plain_osrm),
+        ("OSRM single-flight", lambda: osrm_client.get_route("driving", lon1, lat1, lon2, lat2)),
+        ("OTP single-flight", lambda: routes_otp.fetch_otp_itineraries(params)),
+    )
+    print(f"{n} peticiones idénticas simultáneas, backend con {latency_s * 1000:.0f} ms de latencia, sin caché de rutas")
+    try:
+        for label, call in cases:
+            counter["upstream"] = 0
+            t0 = time.perf_counter()
+            results = await asyncio.gather(*(call() for _ in range(n)), return_exceptions=True)
+            elapsed = time.perf_counter() - t0
+            errors = sum(isinstance(r, BaseException) for r in results)
+            print(
+                f"  {label:<20} {counter['upstream']:>5} llamadas al backend, "
+                f"{errors:>5} errores, {elapsed * 1000:.0f} ms"
+            )
+    finally:
+        await http_clients.close()
+        server.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.services.single_flight")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Peticiones idénticas simultáneas, sin agrupar y con single-flight")
+    bench.add_argument("-n", type=int, default=1000)
+    bench.add_argument("--latency-ms", type=float, default=50.0)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        asyncio.run(_bench(args.n, args.latency_ms / 1000))